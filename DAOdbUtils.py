@@ -1,15 +1,19 @@
 
 
 # you'll need to import these libraries
-# pip install pypiwin32
-import win32com.client
-import distance
-import numpy as np
+# pip install pypiwin32 distance
+# win32com (DAO) and distance are imported on first use, so that modules and worker processes that only read
+# snapshots or compare already-loaded objects start quickly; see bench_importtime.py.
+from dbBudget import BudgetMeter, RecordsUnavailable, grading_budget, unlimited_budget
 # these are built in to python
 import collections
 import re
 import itertools
-import copy
+import functools
+import hashlib
+import heapq
+import importlib.util
+import math
 
 
 
@@ -25,14 +29,60 @@ Relationship = collections.namedtuple('Relationship', ['Table', 'Field', 'Relate
                                                        'EnforceIntegrity', 'JoinType', 'Attributes'])
 
 
+# True if the DAO engine can be used (pywin32 is installed, i.e. on Windows), without importing it
+def DAOAvailable():
+    return importlib.util.find_spec('win32com') is not None
+
+
+# engine_factory, if set, makes the engine instead of DAO (e.g. a fake with the same API); engine_wrapper, if set,
+# wraps every engine made (dbTrace.EnableTracing sets it to count COM round-trips)
+engine_factory = None
+engine_wrapper = None
+
+
+def _DBEngine():
+    if engine_factory is not None:
+        engine = engine_factory()
+    else:
+        import win32com.client
+        engine = win32com.client.Dispatch("DAO.DBEngine.120")
+    return engine if engine_wrapper is None else engine_wrapper(engine)
+
+
+_levenshtein = None
+
+
+def Levenshtein(seq1, seq2):
+    global _levenshtein
+    if _levenshtein is None:
+        import distance
+        _levenshtein = distance.levenshtein
+    return _levenshtein(seq1, seq2)
+
+
+# numpy.size of a list: the number of elements, counting those of equal-length nested lists
+def _Size(items):
+    def Shape(value):
+        if not isinstance(value, (list, tuple)):
+            return ()
+        shapes = {Shape(item) for item in value}
+        return (len(value),) + (shapes.pop() if len(shapes) == 1 else ())
+    size = 1
+    for dimension in Shape(items):
+        size *= dimension
+    return size
+
+
 '''-----------------------------------------------------------------------------------------------------------------'''
 '''                                               CLASS: DATABASE                                                   '''
 '''    DataBase class loads key properties of database to include relationships, table, and query properties        '''
 
 
 class DataBase:
+    ThreadSafe = False  # DAO objects can't be shared between threads, so AssessDatabase grades them one at a time
+
     def __init__(self, dbPath, debug=0):
-        self._dbEngine = win32com.client.Dispatch("DAO.DBEngine.120")
+        self._dbEngine = _DBEngine()
         self._ws = self._dbEngine.Workspaces(0)
         self._dbPath = dbPath
         self._db = self._ws.OpenDatabase(self._dbPath)
@@ -134,7 +184,7 @@ class Table:
     def __init__(self, table_meta=None, isTable=True, dbPath=None, debug=0):
         if table_meta==None:
             return
-        self._dbEngine = win32com.client.Dispatch("DAO.DBEngine.120")
+        self._dbEngine = _DBEngine()
         self._ws = self._dbEngine.Workspaces(0)
         self._dbPath = dbPath
         self._TableMetaData = table_meta
@@ -271,20 +321,9 @@ class Table:
         else:
             return 0
 
-    def GetRecords(self, debug=0):
-        self._db = self._ws.OpenDatabase(self._dbPath)
-        table = self._db.OpenRecordset(self.Name)
-        records = []
-        while not table.EOF:
-            temp_rec = []
-            record = table.GetRows()
-            for item in record:
-                temp_rec.append(list(item)[0])
-            records.append(temp_rec)
-            if debug > 1:
-                print(temp_rec)
-        self._db.Close()
-        return records
+    # Raises BudgetExceeded if the records run over budget (a dbBudget.FetchBudget; None uses the default)
+    def GetRecords(self, debug=0, budget=None):
+        return FetchRecords(self._dbPath, self.Name, debug, budget, self._ws)
 
     def GetFieldObject(self, name):
         return self._TableMetaData.Fields(name)
@@ -310,6 +349,137 @@ class Table:
 
 '''---------------------------------------------- END TABLE CLASS ------------------------------------------------'''
 
+
+# Records of a table/query read through DAO: Table.GetRecords, and TableMeta.GetRecords for a detached DAO table.
+# ws is an open workspace (a new engine's is used if None). Raises BudgetExceeded if the records run over budget.
+def FetchRecords(dbPath, name, debug=0, budget=None, ws=None):
+    meter = BudgetMeter(name, budget)
+    if ws is None:
+        ws = _DBEngine().Workspaces(0)
+    db = ws.OpenDatabase(dbPath)
+    try:
+        table = db.OpenRecordset(name)
+        records = []
+        while not table.EOF:
+            temp_rec = []
+            record = table.GetRows()
+            for item in record:
+                temp_rec.append(list(item)[0])
+            meter.Add(temp_rec)
+            records.append(temp_rec)
+            if debug > 1:
+                print(temp_rec)
+    finally:
+        db.Close()
+    return records
+
+
+'''-----------------------------------------------------------------------------------------------------------------'''
+'''                                       CLASS: TABLEMETA / DATABASEMETA                                           '''
+''' Plain copies of a Table and a DataBase (of any backend), made once on load by Detach: columns, keys,            '''
+''' relationships, SQL, record count and lookups, but no COM objects. They can be pickled (sent to worker           '''
+''' processes, cached on disk) and the Assess* functions take them like the originals. Records are either copied    '''
+''' too (records=True) or fetched on demand by Loader, e.g. FetchRecords for DAO tables.                            '''
+
+
+class TableMeta:
+    __slots__ = ('Name', 'TableType', 'ColumnMetaData', 'ColumnCount', 'RecordCount', 'PrimaryKeys', 'ForeignKeys',
+                 'SQL', 'Lookups', 'Records', 'Loader')
+
+    def __init__(self, Name, TableType, ColumnMetaData, RecordCount=None, PrimaryKeys=(), ForeignKeys='', SQL=None,
+                 Lookups=None, Records=None, Loader=None):
+        self.Name = Name
+        self.TableType = TableType
+        self.ColumnMetaData = list(ColumnMetaData)
+        self.ColumnCount = len(self.ColumnMetaData)
+        self.RecordCount = RecordCount
+        self.PrimaryKeys = list(PrimaryKeys)
+        self.ForeignKeys = ForeignKeys
+        self.SQL = SQL
+        self.Lookups = Lookups or {}  # field name -> Lookup, for the fields that have one
+        self.Records = Records
+        self.Loader = Loader  # picklable callable(debug=, budget=) returning the records
+
+    __str__ = Table.__str__
+    hasColumn = Table.hasColumn
+    GetFields = Table.GetFields
+    GetTypes = Table.GetTypes
+    GetSizes = Table.GetSizes
+
+    def QueryRecordCount(self):
+        return self.RecordCount
+
+    def GetRecords(self, debug=0, budget=None):
+        if self.Records is not None:
+            if debug > 1:
+                for record in self.Records:
+                    print(record)
+            return self.Records
+        if self.Loader is None:
+            raise RecordsUnavailable('The records of {} were not kept when it was detached'.format(self.Name))
+        return self.Loader(debug=debug, budget=budget)
+
+    def GetLookupProperties(self, fieldName, debug=0):
+        if fieldName not in self.Lookups:
+            raise KeyError('{} field {} has no lookup properties'.format(self.Name, fieldName))
+        if debug > 1:
+            print(self.Lookups[fieldName])
+        return self.Lookups[fieldName]
+
+
+class DataBaseMeta:
+    __slots__ = ('_dbPath', 'Source', 'ThreadSafe', 'TableNames', 'QueryNames', 'Relationships', 'Tables', 'Queries')
+
+    def __init__(self, dbPath, TableNames, QueryNames, Relationships, Tables, Queries, ThreadSafe=True, Source=None):
+        self._dbPath = dbPath
+        self.Source = Source if Source is not None else dbPath
+        self.ThreadSafe = ThreadSafe
+        self.TableNames = list(TableNames)
+        self.QueryNames = list(QueryNames)
+        self.Relationships = Relationships
+        self.Tables = Tables
+        self.Queries = Queries
+
+
+# A TableMeta of table (a Table, or a snapshot/ACE table). Records are copied if records is True and they can be
+# fetched (a parameter query can't be opened, for instance); otherwise DAO tables fetch them again when asked, and
+# other backends can't. Lookups are read for every field.
+def DetachTable(table, records=False):
+    lookups = {}
+    for column in table.ColumnMetaData:
+        try:
+            lookups[column.Name] = Lookup(*table.GetLookupProperties(column.Name))
+        except Exception:  # field has no lookup (DisplayControl etc. properties don't exist)
+            continue
+    loader = None
+    kept = None
+    if records:
+        try:
+            kept = table.GetRecords(budget=unlimited_budget)
+        except Exception:
+            pass
+    if kept is None and type(table) is Table:
+        loader = functools.partial(FetchRecords, table._dbPath, table.Name)
+    isTable = table.TableType == 'TABLE'
+    return TableMeta(table.Name, table.TableType, table.ColumnMetaData, table.RecordCount,
+                     table.PrimaryKeys if isTable else (), table.ForeignKeys if isTable else '',
+                     None if isTable else table.SQL, lookups, kept, loader)
+
+
+# A DataBaseMeta of database, with every table's and query's records copied if records is True. The detached copy
+# is ThreadSafe if the records were copied or the original is.
+def Detach(database, records=False):
+    return DataBaseMeta(database._dbPath, database.TableNames, database.QueryNames, database.Relationships,
+                        {name: DetachTable(database.Tables[name], records) for name in database.TableNames},
+                        {name: DetachTable(database.Queries[name], records) for name in database.QueryNames},
+                        ThreadSafe=records or getattr(database, 'ThreadSafe', False),
+                        Source=getattr(database, 'Source', None))
+
+
+# Loads dbPath with DAO and detaches it; no COM objects are kept once it returns
+def LoadDataBase(dbPath, records=False, debug=0):
+    return Detach(DataBase(dbPath, debug=debug), records)
+
 def CompareLookupProperties(soln_table, soln_field, stdnt_table, stdnt_field):
     global max_misspelled
     soln_lookup = soln_table.GetLookupProperties(soln_field)
@@ -331,7 +501,7 @@ def CompareLookupProperties(soln_table, soln_field, stdnt_table, stdnt_field):
     else:
         report += ['\tRow source type DOES NOT match\n\t\tSOLN row source type:{}\n\t\tSTDNT row source type: '
                    '{}\n'.format(soln_lookup.RowSourceType, stdnt_lookup.RowSourceType)]
-    if distance.levenshtein(stdnt_lookup.RowSource.lower(), soln_lookup.RowSource.lower()) <= max_misspelled:
+    if Levenshtein(stdnt_lookup.RowSource.lower(), soln_lookup.RowSource.lower()) <= max_misspelled:
         row_source = 1
         report += ['\tRow source matches\n']
     else:
@@ -418,6 +588,8 @@ class TableScore(collections.namedtuple('TableScore',['NameScore','RowCountScore
             row_score_str = 'Records Score: 2 (Exact, rows out of order)'
         elif self.RowsScore == 1/4:
             row_score_str = 'Records Score: 1 (Exact, rows and columns out of order)'
+        elif self.RowsScore:
+            row_score_str = 'Records Score: {:.2f} (Partial)'.format(4 * self.RowsScore)
         else:
             row_score_str = 'Records Score: 0'
         return name_str+row_cnt_str+col_cnt_str+field_name_str+field_type_str+field_size_str+sm_pri_keys_str+ \
@@ -518,7 +690,7 @@ def GradeRelationships(rltn_dict1, rltn_dict2, debug=False):
                         print(field1)
                     rltn1 = rltn_dict1[rltd_tbl1_key][field1]
                     rltn2 = rltn_dict2[rltd_tbl1_key][field1]
-                    if distance.levenshtein(rltn1.RelatedField.lower(), rltn2.RelatedField.lower()) <= max_misspelled:
+                    if Levenshtein(rltn1.RelatedField.lower(), rltn2.RelatedField.lower()) <= max_misspelled:
                         rltd_fld += 1
                     if rltn1.JoinType == rltn2.JoinType:
                         join += 1
@@ -534,11 +706,22 @@ def GradeRelationships(rltn_dict1, rltn_dict2, debug=False):
     return correct_num_rltns, fld, rltd_tbl, rltd_fld, join, integrity
 
 
-def ExactRecordsMatch(table1, table2):
+# Records that can't be fetched within budget don't match; the reason is added to report (if given)
+def _FetchWithinBudget(table1, table2, report=None, budget=None):
+    try:
+        return table1.GetRecords(budget=budget), table2.GetRecords(budget=budget)
+    except RecordsUnavailable as e:  # over budget, or (dbLocalQuery) the SQL can't be run locally
+        if report is not None:
+            report += ['\t-Records NOT compared: {}\n'.format(e)]
+        return None, None
+
+
+def ExactRecordsMatch(table1, table2, report=None, budget=None):
     #print('Pre if: Table1 # Recs :{}\tTable2 # Recs: {}'.format(table1.RecordCount, table2.RecordCount))
-    table2_recs = table2.GetRecords()
+    table1_recs, table2_recs = _FetchWithinBudget(table1, table2, report, budget)
+    if table1_recs is None:
+        return 0
     table2.RecordCount = len(table2_recs)
-    table1_recs = table1.GetRecords()
     table1.RecordCount = len(table1_recs)
     #print('In if: Table1 # Recs :{}\tTable2 # Recs: {}'.format(table1.RecordCount, table2.RecordCount))
     if table1.RecordCount != table2.RecordCount:
@@ -550,53 +733,415 @@ def ExactRecordsMatch(table1, table2):
     return 1
 
 
-def AssessTableEntries(table1, table2, quick_answer=False):
-    table1_recs = table1.GetRecords()
-    table2_recs = table2.GetRecords()
+# Records that fall short of a permutation of the solution's earn at most this fraction of the records score, in
+# proportion to how many rows (and columns of nearly matching rows) they get right; see DiffRecords.
+partial_records_credit = .25
+diff_sample_size = 5  # differing rows shown in a report
+
+# Matched/Missing/Extra count rows (Missing: in the solution only, Extra: in the student's only). ColumnMismatches[i]
+# counts the missing rows that pair with an extra row (same first column) but differ in column i. Score is 0-1.
+# Sample holds up to diff_sample_size (solution row, student row) pairs; None stands for a missing/extra row.
+RecordDiff = collections.namedtuple('RecordDiff', ['Matched', 'Missing', 'Extra', 'ColumnMismatches', 'Score',
+                                                   'Sample'])
+
+
+# Sort key of a value: None first, then numbers (True == 1 == 1.0, as for ==), strings, dates, anything else
+def _ValueKey(value):
+    if value is None:
+        return 0, 0
+    if isinstance(value, (bool, int, float)) or type(value).__name__ == 'Decimal':
+        return 1, value
+    if isinstance(value, str):
+        return 2, value
+    if hasattr(value, 'year') and hasattr(value, 'day'):
+        return 3, value
+    return 4, repr(value)
+
+
+def _RowKey(row):
+    return tuple(_ValueKey(value) for value in row)
+
+
+# Sorts both record sets once and merge-walks them, so a table that is off by a few rows is scored by how much of
+# it is right, in O(n log n) rather than by comparing every row with every other.
+def DiffRecords(records1, records2, sample_size=None):
+    if sample_size is None:
+        sample_size = diff_sample_size
+    rows1 = sorted(((_RowKey(row), row) for row in records1), key=lambda item: item[0])
+    rows2 = sorted(((_RowKey(row), row) for row in records2), key=lambda item: item[0])
+    matched = 0
+    missing = []
+    extra = []
+    i = j = 0
+    while i < len(rows1) and j < len(rows2):
+        if rows1[i][0] == rows2[j][0]:
+            matched += 1
+            i += 1
+            j += 1
+        elif rows1[i][0] < rows2[j][0]:
+            missing.append(rows1[i])
+            i += 1
+        else:
+            extra.append(rows2[j])
+            j += 1
+    missing += rows1[i:]
+    extra += rows2[j:]
+    # pair each missing row with an extra row that has the same first column (usually the key) to see which columns
+    # are wrong; both lists are sorted, so the pairs come out in order
+    by_first = collections.defaultdict(collections.deque)
+    for key, row in extra:
+        by_first[key[:1]].append((key, row))
+    num_columns = max([len(row) for row in records1[:1]] + [0])
+    column_mismatches = [0] * num_columns
+    pairs = []
+    unpaired = []
+    for key, row in missing:
+        candidates = by_first.get(key[:1])
+        if not candidates:
+            unpaired.append(row)
+            continue
+        other_key, other = candidates.popleft()
+        wrong = [cnt for cnt in range(max(len(key), len(other_key)))
+                 if key[cnt:cnt + 1] != other_key[cnt:cnt + 1]]
+        for cnt in wrong:
+            if cnt < num_columns:
+                column_mismatches[cnt] += 1
+        pairs.append((row, other, 1 - len(wrong) / max(len(key), len(other_key))))
+    leftover = [row for candidates in by_first.values() for key, row in candidates]
+    rows = matched + len(missing) + len(extra) - len(pairs)
+    score = (matched + sum(credit for row, other, credit in pairs)) / rows if rows else 1
+    sample = [(row, other) for row, other, credit in pairs] + [(row, None) for row in unpaired] + \
+             [(None, row) for row in leftover]
+    return RecordDiff(matched, len(missing), len(extra), column_mismatches, score, sample[:sample_size])
+
+
+def DiffReport(diff, fields=None):
+    report = ['\t-Records DO NOT match: {} of {} rows match ({} missing, {} extra)\n'.format(
+        diff.Matched, diff.Matched + diff.Missing, diff.Missing, diff.Extra)]
+    if fields is None or len(fields) != len(diff.ColumnMismatches):
+        fields = ['column {}'.format(cnt + 1) for cnt in range(len(diff.ColumnMismatches))]
+    wrong = ['{} ({})'.format(fields[cnt], count) for cnt, count in enumerate(diff.ColumnMismatches) if count]
+    if wrong:
+        report += ['\t\tColumns that differ: {}\n'.format(', '.join(wrong))]
+    for row1, row2 in diff.Sample:
+        report += ['\t\tSoln: {}\n\t\tStdnt: {}\n'.format(row1 if row1 is not None else '(no such row)',
+                                                          row2 if row2 is not None else '(no such row)')]
+    return report
+
+
+'''-----------------------------------------------------------------------------------------------------------------'''
+'''                                                 RECORD SAMPLING                                                 '''
+''' Comparing every row of two very large record sets costs a full pass (and a sort) per student. With sampling on  '''
+''' (record_sampling, or the sampling argument of AssessRecords), large record sets are first compared on their row '''
+''' counts and column digests and then on a seeded sample of rows: rows whose first column hashes into one partition'''
+''' (so a row and the student's version of it are sampled together) and rows at random positions (for the order).   '''
+''' The sampled result is used when its confidence interval is narrow enough; otherwise the records are compared in '''
+''' full, as they are when record_sampling is None (exact grading, the default).                                    '''
+
+# MinRows: smaller record sets are always compared in full. Size: rows to sample. Confidence: of the bound reported.
+# Tolerance: the widest confidence interval (half-width, on the 0-1 records score) accepted from a sample.
+RecordSampling = collections.namedtuple('RecordSampling', ['MinRows', 'Size', 'Seed', 'Confidence', 'Tolerance'])
+default_sampling = RecordSampling(MinRows=20000, Size=2000, Seed=305, Confidence=.95, Tolerance=.05)
+record_sampling = None  # e.g. default_sampling
+
+# Tier: as AssessTableEntries, 0 if only partial credit applies. Score: estimated DiffRecords score (0-1), within
+# Bound at the sampling's Confidence. Rows: sampled rows.
+SampledComparison = collections.namedtuple('SampledComparison', ['Tier', 'Score', 'Bound', 'Rows', 'Report'])
+
+_hash_mask = (1 << 64) - 1
+
+
+# A hash of a value that is the same in every process. hash() of text and dates is salted per process, so text goes
+# through blake2b and dates are hashed by their day and time; hash() of a number is fixed (True == 1 == 1.0 hash
+# alike, as for ==).
+def _StableHash(value):
+    if isinstance(value, str):
+        return int.from_bytes(hashlib.blake2b(value.encode('utf-8', 'surrogatepass'), digest_size=8).digest(), 'little')
+    if value is None:
+        return 0
+    if isinstance(value, (bool, int, float)) or type(value).__name__ == 'Decimal':
+        return hash(value)
+    if hasattr(value, 'toordinal'):
+        return hash((value.toordinal(), getattr(value, 'hour', 0), getattr(value, 'minute', 0),
+                     getattr(value, 'second', 0), getattr(value, 'microsecond', 0)))
+    return _StableHash('\0' + repr(value))
+
+
+# An order-independent digest of each column, the sum of its values' hashes: equal columns have equal digests, and
+# a column with other values almost certainly doesn't
+def ColumnDigests(records):
+    return [sum(map(_StableHash, column)) & _hash_mask for column in zip(*records)]
+
+
+# The rows whose value in column falls in the sampled partition, 1 in every buckets
+def _Partition(records, buckets, seed, column=0):
+    if buckets <= 1:
+        return list(records)
+    return [row for row in records
+            if hash((seed, _StableHash(row[column] if column < len(row) else None))) % buckets == 0]
+
+
+# A SampledComparison of two large record sets, or None if the sample can't settle it (compare them in full)
+def SampleRecords(records1, records2, sampling=None):
+    import random
+    import statistics
+    if sampling is None:
+        sampling = default_sampling
+    digests1, digests2 = ColumnDigests(records1), ColumnDigests(records2)
+    identity = list(range(len(digests1)))
+    order = None  # the student's columns in the solution's order, if they hold the same values
+    if digests1 == digests2:
+        order = identity
+    elif sorted(digests1) == sorted(digests2) and len(set(digests1)) == len(digests1):
+        order = [digests2.index(digest) for digest in digests1]
+    buckets = max(1, len(records1) // sampling.Size)
+    sample1 = _Partition(records1, buckets, sampling.Seed)
+    sample2 = _Partition(records2, buckets, sampling.Seed, order[0] if order else 0)
+    if order and order != identity:
+        sample2 = _Reorder(sample2, order)
+    diff = DiffRecords(sample1, sample2)
+    rows = diff.Matched + diff.Missing + diff.Extra
+    if not rows:
+        return None
+    if diff.Score == 1:  # no differences among rows sampled: at most this fraction differs
+        bound = -math.log(1 - sampling.Confidence) / rows
+    else:
+        z = statistics.NormalDist().inv_cdf((1 + sampling.Confidence) / 2)
+        bound = z * math.sqrt(diff.Score * (1 - diff.Score) / rows)
+    if bound > sampling.Tolerance:
+        return None
+    tier = 0
+    if diff.Score == 1:
+        if len(records1) != len(records2) or order is None:
+            return None  # the sample matches but the whole doesn't; only a full comparison can say how well
+        positions = random.Random(sampling.Seed).sample(range(len(records1)), min(sampling.Size, len(records1)))
+        in_order = all(list(records1[p]) == [records2[p][j] for j in order] for p in positions)
+        tier = (4 if in_order else 2) if order == identity else (3 if in_order else 1)
+    report = ['\t-Records compared on a sample of {} of {} rows: score {:.2f} (within {:.1%}, {:.0%} confidence)\n'
+              .format(rows, len(records1), diff.Score, bound, sampling.Confidence)]
+    return SampledComparison(tier, diff.Score, bound, rows, report)
+
+
+'''-----------------------------------------------------------------------------------------------------------------'''
+'''                                               COLUMN ALIGNMENT                                                  '''
+''' A student's query may return the right columns in another order (or named differently). Each column gets a      '''
+''' signature computed in one pass (type, distinct values, a bottom-k MinHash of the values, numeric range); the    '''
+''' columns are paired once by solving the assignment on signature similarity, and then compared column by column.  '''
+
+minhash_size = 32
+
+# Type: the _ValueKey tag of most of the non-null values (None if all null). MinHash: the minhash_size smallest
+# hashes of the distinct values. Min/Max: the numeric range (None for other types).
+ColumnSignature = collections.namedtuple('ColumnSignature', ['Type', 'Distinct', 'Nulls', 'MinHash', 'Min', 'Max'])
+
+
+def ColumnSignatures(records):
+    num_columns = max([len(row) for row in records[:1]] + [0])
+    signatures = []
+    for cnt in range(num_columns):
+        keys = [_ValueKey(row[cnt]) for row in records if cnt < len(row)]
+        types = collections.Counter(key[0] for key in keys if key[0])
+        distinct = set(keys)
+        numbers = [key[1] for key in distinct if key[0] == 1]
+        signatures.append(ColumnSignature(types.most_common(1)[0][0] if types else None, len(distinct),
+                                          len(keys) - sum(types.values()),
+                                          frozenset(heapq.nsmallest(minhash_size, map(hash, distinct))),
+                                          min(numbers) if numbers else None, max(numbers) if numbers else None))
+    return signatures
+
+
+# 0 (different types) to 1 (same values, as far as the signatures can tell)
+def SignatureSimilarity(sig1, sig2):
+    if sig1.Type != sig2.Type and sig1.Type is not None and sig2.Type is not None:
+        return 0
+    union = heapq.nsmallest(minhash_size, sig1.MinHash | sig2.MinHash)
+    jaccard = sum(1 for h in union if h in sig1.MinHash and h in sig2.MinHash) / len(union) if union else 1
+    distinct = min(sig1.Distinct, sig2.Distinct) / max(sig1.Distinct, sig2.Distinct, 1)
+    if sig1.Min is None or sig2.Min is None:
+        return .8 * jaccard + .2 * distinct
+    overlap = min(sig1.Max, sig2.Max) - max(sig1.Min, sig2.Min)
+    span = max(sig1.Max, sig2.Max) - min(sig1.Min, sig2.Min)
+    in_range = (max(overlap, 0) / span if span else 1) if overlap >= 0 else 0
+    return .6 * jaccard + .2 * distinct + .2 * in_range
+
+
+# Hungarian algorithm: assignment[i] is the column j (of len(weights[0]) >= len(weights)) given to row i so that the
+# total weight is as large as possible
+def _Assign(weights):
+    n, m = len(weights), len(weights[0])
+    inf = float('inf')
+    u, v = [0] * (n + 1), [0] * (m + 1)
+    owner = [0] * (m + 1)  # owner[j]: the row (1-based) assigned to column j, 0 if none
+    way = [0] * (m + 1)
+    for i in range(1, n + 1):
+        owner[0] = i
+        j0 = 0
+        min_cost = [inf] * (m + 1)
+        used = [False] * (m + 1)
+        while owner[j0] != 0:
+            used[j0] = True
+            i0, delta, j1 = owner[j0], inf, 0
+            for j in range(1, m + 1):
+                if not used[j]:
+                    cost = -weights[i0 - 1][j - 1] - u[i0] - v[j]
+                    if cost < min_cost[j]:
+                        min_cost[j], way[j] = cost, j0
+                    if min_cost[j] < delta:
+                        delta, j1 = min_cost[j], j
+            for j in range(m + 1):
+                if used[j]:
+                    u[owner[j]] += delta
+                    v[j] -= delta
+                else:
+                    min_cost[j] -= delta
+            j0 = j1
+        while j0:
+            j1 = way[j0]
+            owner[j0] = owner[j1]
+            j0 = j1
+    assignment = [None] * n
+    for j in range(1, m + 1):
+        if owner[j]:
+            assignment[owner[j] - 1] = j - 1
+    return assignment
+
+
+# order[i] is the column of records2 that holds what column i of records1 holds (None if records2 has fewer
+# columns). Columns that look alike keep their positions.
+def AlignColumns(records1, records2):
+    sigs1, sigs2 = ColumnSignatures(records1), ColumnSignatures(records2)
+    if not sigs1 or not sigs2:
+        return [None] * len(sigs1)
+    weights = [[SignatureSimilarity(sig1, sig2) + (1e-6 if i == j else 0) for j, sig2 in enumerate(sigs2)]
+               for i, sig1 in enumerate(sigs1)]
+    if len(sigs1) <= len(sigs2):
+        return _Assign(weights)
+    order = [None] * len(sigs1)
+    for j, i in enumerate(_Assign([list(column) for column in zip(*weights)])):
+        order[i] = j
+    return order
+
+
+def _Reorder(records, order):
+    return [[row[j] for j in order] for row in records]
+
+
+# True if the two lists of values are equal position by position; numeric columns are compared as NumPy arrays
+# when NumPy is installed
+def _ColumnsEqual(values1, values2):
+    if len(values1) != len(values2):
+        return False
+    if _numpy_available and all(isinstance(value, (int, float)) for value in itertools.chain(values1, values2)):
+        import numpy as np
+        return bool(np.array_equal(np.asarray(values1), np.asarray(values2)))
+    return all(_ValueKey(value1) == _ValueKey(value2) for value1, value2 in zip(values1, values2))
+
+
+_numpy_available = importlib.util.find_spec('numpy') is not None
+
+
+# 4: the same rows in the same order, 3: in the same order but with columns out of order, 2: the same rows out of
+# order, 1: rows and columns out of order, 0: anything else. Rows are compared by sorting and columns after
+# AlignColumns, rather than row against row.
+def _RecordsTier(table1_recs, table2_recs, quick_answer=False, order=None):
     if len(table1_recs) != len(table2_recs):
         return 0
-    exact_rec_score = 4
-    # check out of order exact records match (i.e. rows out of order, but col order still matters)
-    for cnt, row in enumerate(table1_recs):
-        if exact_rec_score == 4 and row != table2_recs[cnt]:
-            exact_rec_score = 3
-        row_set = set(row)
-        if exact_rec_score == 3 and len(row_set.intersection(table2_recs[cnt])) != len(row_set):
-            exact_rec_score == 2
+    if all(list(row) == list(table2_recs[cnt]) for cnt, row in enumerate(table1_recs)):
+        return 4
+    if order is None:
+        order = AlignColumns(table1_recs, table2_recs)
+    same_width = None not in order and all(len(row) == len(order) for row in itertools.chain(table1_recs,
+                                                                                            table2_recs))
+    # rows in order, columns out of order
+    if same_width and order != list(range(len(order))) and \
+            all(_ColumnsEqual([row[i] for row in table1_recs], [row[j] for row in table2_recs])
+                for i, j in enumerate(order)):
+        return 3
     if quick_answer:
-        if exact_rec_score == 2:
-            return 0
-        return exact_rec_score
-    if exact_rec_score == 2:
-        for row in table1_recs:
-            if row not in table2_recs:
-                exact_rec_score = 1
-                break
+        return 0
+    if sorted(map(_RowKey, table1_recs)) == sorted(map(_RowKey, table2_recs)):
+        return 2
     # check if recs in table but out of order (col order doesn't matter)
-    if exact_rec_score == 1:
-        for row in table1_recs:
-            any_score = False
-            for row2 in table2_recs:
-                if set(row).intersection(row2) == set(row):
-                    any_score = True
-                    break
-            if not any_score:
-                exact_rec_score = 0
-                break
-    return exact_rec_score
+    if same_width and sorted(map(_RowKey, table1_recs)) == sorted(map(_RowKey, _Reorder(table2_recs, order))):
+        return 1
+    return 0
+
+
+def AssessTableEntries(table1, table2, quick_answer=False, report=None, budget=None):
+    table1_recs, table2_recs = _FetchWithinBudget(table1, table2, report, budget)
+    if table1_recs is None:
+        return 0
+    return _RecordsTier(table1_recs, table2_recs, quick_answer)
+
+
+# (records score from 0 to 4, RecordDiff or None): the AssessTableEntries tier, or partial credit from DiffRecords
+# when the records are not a rearrangement of the solution's. The diff is added to report (if given). When both
+# have the same number of columns, the student's columns are put in the solution's order (AlignColumns) first.
+# exact_only only looks for an exact match (4, or 0 otherwise): no column alignment and no diff. Large record sets
+# are compared on a sample (SampleRecords) when sampling, which defaults to record_sampling, is set.
+def AssessRecords(table1, table2, report=None, budget=None, exact_only=False, sampling=None):
+    table1_recs, table2_recs = _FetchWithinBudget(table1, table2, report, budget)
+    if table1_recs is None:
+        return 0, None
+    table1.RecordCount = len(table1_recs)
+    table2.RecordCount = len(table2_recs)
+    if sampling is None:
+        sampling = record_sampling
+    if sampling is not None and min(len(table1_recs), len(table2_recs)) >= sampling.MinRows:
+        sampled = SampleRecords(table1_recs, table2_recs, sampling)
+        if sampled is not None:
+            if report is not None:
+                report += sampled.Report
+            if exact_only:
+                return (4 if sampled.Tier == 4 else 0), None
+            return (sampled.Tier or 4 * partial_records_credit * sampled.Score), None
+    if exact_only:
+        return _RecordsTier(table1_recs, table2_recs, quick_answer=True, order=[]), None  # [] skips AlignColumns
+    order = AlignColumns(table1_recs, table2_recs)
+    tier = _RecordsTier(table1_recs, table2_recs, order=order)
+    if tier:
+        return tier, None
+    aligned = None not in order and order != list(range(len(order))) and \
+        all(len(row) == len(order) for row in table2_recs)
+    diff = DiffRecords(table1_recs, _Reorder(table2_recs, order) if aligned else table2_recs)
+    if report is not None:
+        try:
+            fields = table1.GetFields()
+        except Exception:
+            fields = None
+        if aligned:
+            report += ['\t-Student columns compared in the order {} (by content)\n'.format(
+                [column + 1 for column in order])]
+        report += DiffReport(diff, fields)
+    return 4 * partial_records_credit * diff.Score, diff
+
+
+# The checks an Assess function should run: the TableScore/QueryScore fields with a non-zero weight, plus any
+# fields in sections (assessed and reported even though they don't count). Checks that aren't run score 0.
+def CompileChecks(weights, sections=()):
+    return frozenset(name for name, weight in zip(weights._fields, weights) if weight) | frozenset(sections)
+
+
+def _Wanted(checks, *names):
+    return checks is None or any(name in checks for name in names)
 
 
 # Note: Table1 should be the 'correct' table/query. Table 2 is compared against Table 1.
 # The scores are returned as percentages. For example, if you had 2 of 3 primary keys correct the
 # score returned is 0.67 (this makes it easier to multiply by whatever rubric you want to use)
-def AssessTables(table1, table2, compare_records = True):
+# checks (see CompileChecks) limits the assessment to what is scored; None assesses everything. sampling: as for
+# AssessRecords.
+def AssessTables(table1, table2, compare_records = True, budget=None, checks=None, sampling=None):
     global too_many_penalty
     global max_misspelled
     name_score = row_count_score = col_count_score = field_name_score = field_type_score = field_size_score = \
-        exact_rec_score = excess_fields = 0
+        exact_rec_score = excess_fields = pk_same = pk_diff = 0
+    correct_num_rltns = fld = rltd_tbl = rltd_fld = join = integrity = 0
     score_report = []
     score_report += ['{} TABLE\n'.format(table1.Name)]
-    if distance.levenshtein(table1.Name.lower(), table2.Name.lower()) <= max_misspelled:
+    if not _Wanted(checks, 'NameScore'):
+        pass
+    elif Levenshtein(table1.Name.lower(), table2.Name.lower()) <= max_misspelled:
         name_score = 1
         score_report += ['\t-Table names match\n']
     else:
@@ -605,6 +1150,37 @@ def AssessTables(table1, table2, compare_records = True):
         row_count_score = 1
     if table1.ColumnCount == table2.ColumnCount:
         col_count_score = 1
+    if _Wanted(checks, 'FieldNameScore', 'FieldTypeScore', 'FieldSizeScore'):
+        field_name_score, field_type_score, field_size_score = _AssessFields(table1, table2, score_report, checks)
+    if _Wanted(checks, 'SamePriKeysScore', 'DiffPriKeysScore'):
+        pk_same, pk_diff = _AssessPrimaryKeys(table1, table2, score_report)
+    if _Wanted(checks, 'Correct_Num_Rltns', 'Fld', 'Rltd_Tbl', 'Rltd_Fld', 'Join', 'Integrity'):
+        correct_num_rltns, fld, rltd_tbl, rltd_fld, join, integrity = GradeRelationships(table1.ForeignKeys,
+                                                                                         table2.ForeignKeys)
+        if sum([fld, rltd_tbl, rltd_fld, join, integrity]) == 5:
+            score_report += ['\t-Relationships match\n']
+        else:
+            score_report += ['\t-Relationships DO NOT match\n\t\tSoln: {}\n\t\tStdnt: {}\n'.format(
+                table1.ForeignKeys, table2.ForeignKeys)]
+    if compare_records and _Wanted(checks, 'RowsScore'):
+        exact_rec_score, diff = AssessRecords(table1, table2, report=score_report, budget=budget, sampling=sampling)
+        if diff is not None:  # AssessRecords reported the differences
+            pass
+        elif exact_rec_score:
+            score_report += ['\t-Records match\n']
+        else:
+            score_report += ['\t-Records DO NOT match']
+    exact_rec_score /= 4
+    table_score = TableScore(name_score, row_count_score, col_count_score, field_name_score, field_type_score,
+                             field_size_score, exact_rec_score, pk_same, pk_diff, correct_num_rltns, fld, rltd_tbl,
+                             rltd_fld, join, integrity)
+    # print(''.join(score_report))
+    return table_score, score_report
+
+
+# (field name, field type, field size scores) of AssessTables
+def _AssessFields(table1, table2, score_report, checks=None):
+    field_name_score = field_type_score = field_size_score = excess_fields = 0
     table1_fields = table1.GetFields()
     table2_fields = table2.GetFields()
     table1_types = table1.GetTypes()
@@ -613,7 +1189,7 @@ def AssessTables(table1, table2, compare_records = True):
     table2_sizes = table2.GetSizes()
     for cnt, field in enumerate(table1_fields):
         # added the next 3 lines to take field closest to correct as long as distance < max_misspelled
-        distance_list = [distance.levenshtein(field, i) for i in table2_fields]
+        distance_list = [Levenshtein(field, i) for i in table2_fields]
         smallest_distance = min(distance_list)
         # if field in table2_fields:
         if smallest_distance <= max_misspelled:
@@ -627,21 +1203,31 @@ def AssessTables(table1, table2, compare_records = True):
     if len(table2_fields) > len(table1_fields):
         excess_fields = len(table2_fields) - len(table1_fields)
     field_name_score *= (1-(excess_fields*too_many_penalty)) / len(table1_fields)
-    if field_name_score == 1:
+    if not _Wanted(checks, 'FieldNameScore'):
+        field_name_score = 0
+    elif field_name_score == 1:
         score_report += ['\t-Fields match\n']
     else:
         score_report += ['\t-Fields DO NOT match\n\t\tSoln: {}\n\t\tStdnt: {}\n'.format(table1_fields, table2_fields)]
     field_type_score *= (1-(excess_fields*too_many_penalty)) / len(table1_types)
-    if field_type_score == 1:
+    if not _Wanted(checks, 'FieldTypeScore'):
+        field_type_score = 0
+    elif field_type_score == 1:
         score_report += ['\t-Field types match\n']
     else:
         score_report += ['\t-Field types DO NOT match\n\t\tSoln: {}\n\t\tStdnt: {}\n'.format(table1_sizes, table2_sizes)]
     field_size_score *= (1-(excess_fields*too_many_penalty)) / len(table1_sizes)
-    if field_size_score == 1:
+    if not _Wanted(checks, 'FieldSizeScore'):
+        field_size_score = 0
+    elif field_size_score == 1:
         score_report += ['\t-Field sizes match\n']
     else:
         score_report += ['\t-Field sizes DO NOT match\n\t\tSoln: {}\n\t\tStdnt: {}\n'.format(table1_fields, table2_fields)]
+    return field_name_score, field_type_score, field_size_score
 
+
+# (same primary keys, different primary keys scores) of AssessTables
+def _AssessPrimaryKeys(table1, table2, score_report):
     # how to handle primary key distance?
     # primary keys intersection returns primary keys in common between table1 and table2
     # pk_same = len(set(table1.PrimaryKeys).intersection(table2.PrimaryKeys)) / len(table1.PrimaryKeys)
@@ -659,26 +1245,7 @@ def AssessTables(table1, table2, compare_records = True):
     else:
         score_report += ['\t-Prmary keys DO NOT match\n\t\tSoln: {}\n\t\tStdnt: {}\n'.format(table1.PrimaryKeys,
                                                                                             table2.PrimaryKeys)]
-    correct_num_rltns, fld, rltd_tbl, rltd_fld, join, integrity = GradeRelationships(table1.ForeignKeys,
-                                                                                     table2.ForeignKeys)
-    if sum([fld, rltd_tbl, rltd_fld, join, integrity]) == 5:
-        score_report += ['\t-Relationships match\n']
-    else:
-        score_report += ['\t-Relationships DO NOT match\n\t\tSoln: {}\n\t\tStdnt: {}\n'.format(table1.ForeignKeys,
-                                                                                            table2.ForeignKeys)]
-    if compare_records:
-        if row_count_score:
-            exact_rec_score = AssessTableEntries(table1, table2)
-        if exact_rec_score:
-            score_report += ['\t-Records match\n']
-        else:
-            score_report += ['\t-Records DO NOT match']
-    exact_rec_score /= 4
-    table_score = TableScore(name_score, row_count_score, col_count_score, field_name_score, field_type_score,
-                             field_size_score, exact_rec_score, pk_same, pk_diff, correct_num_rltns, fld, rltd_tbl,
-                             rltd_fld, join, integrity)
-    # print(''.join(score_report))
-    return table_score, score_report
+    return pk_same, pk_diff
 
 
 def ScoreTable(assessed_table, score_vector=base_table_weight):
@@ -702,30 +1269,85 @@ def ScoreQuery(assessed_query, score_vector=base_query_weight):
     return query_score
 
 def FindMinDistance(field, comparison_list):
-    distance_list = [distance.levenshtein(field.lower(), i.lower()) for i in comparison_list]
+    distance_list = [Levenshtein(field.lower(), i.lower()) for i in comparison_list]
     smallest_distance = min(distance_list)
     smallest_item = comparison_list[distance_list.index(smallest_distance)]
     return smallest_distance, smallest_item
 
 
+'''-----------------------------------------------------------------------------------------------------------------'''
+'''                                                  FUZZY MATCHING                                                 '''
+''' GetNumberMatches pairs each item of list2 with the closest remaining reference item (case ignored, ties going   '''
+''' to the earliest) if it is fewer than max_misspelled edits away. FuzzyMatcher indexes the reference list once by '''
+''' its deletion neighborhood (every string left after deleting up to max_misspelled - 1 characters), so only the   '''
+''' few reference items that can be close enough are compared, and tracks the items already matched in a bitmask.   '''
+''' Matchers are cached, so the permutation loops reuse them.                                                       '''
+
+
+def _Deletions(word, depth):
+    found = {word} if depth >= 0 else set()
+    frontier = found
+    for _ in range(depth):
+        frontier = {variant[:i] + variant[i + 1:] for variant in frontier for i in range(len(variant))}
+        found = found | frontier
+    return found
+
+
+class FuzzyMatcher:
+    def __init__(self, reference_list, max_misspelled=2):
+        self.Reference = list(reference_list)
+        self.MaxDistance = max_misspelled - 1  # a match must be strictly closer than max_misspelled
+        self._lowered = [item.lower() for item in self.Reference]
+        self._variants = collections.defaultdict(list)
+        for index, item in enumerate(self._lowered):
+            for variant in _Deletions(item, self.MaxDistance):
+                self._variants[variant].append(index)
+        self._candidates = {}
+        self.All = (1 << len(self.Reference)) - 1  # bitmask with every reference item available
+
+    # [(distance, index)] of the reference items close enough to item, closest and then earliest first
+    def Candidates(self, item):
+        item = item.lower()
+        found = self._candidates.get(item)
+        if found is None:
+            indices = set()
+            for variant in _Deletions(item, self.MaxDistance):
+                indices.update(self._variants.get(variant, ()))
+            found = sorted((Levenshtein(item, self._lowered[index]), index) for index in indices)
+            found = [candidate for candidate in found if candidate[0] <= self.MaxDistance]
+            self._candidates[item] = found
+        return found
+
+    # index of the best reference item still set in available, or None
+    def Match(self, item, available):
+        for item_distance, index in self.Candidates(item):
+            if available >> index & 1:
+                return index
+        return None
+
+    # Same results as GetNumberMatches(self.Reference, items)
+    def Matches(self, items):
+        available = self.All
+        matches = []
+        for item in items:
+            index = self.Match(item, available)
+            if index is not None:
+                available &= ~(1 << index)
+                matches.append(self.Reference[index])
+        return len(matches), matches
+
+
+@functools.lru_cache(maxsize=4096)
+def _CachedMatcher(reference, max_misspelled):
+    return FuzzyMatcher(reference, max_misspelled)
+
+
 def GetNumberMatches(reference_list, list2, debug=True):
-    global max_misspelled
-    count = 0
-    matches = []
-    copy_list = copy.deepcopy(reference_list)
-    # if debug:
-    #     print('LIST1:', reference_list)
-    #     print('LIST2:', list2)
-    for item in list2:
-        # if item in copy_list:
-        sm_distance, sm_item = FindMinDistance(item, copy_list)
-        if sm_distance < max_misspelled:
-            count += 1
-            matches.append(sm_item)
-            copy_list.remove(sm_item)
-    # if debug:
-    #     print('Num Matches: {}\nMatches: {}'.format(count, matches))
-    return count, matches
+    try:
+        matcher = _CachedMatcher(tuple(reference_list), max_misspelled)
+    except TypeError:  # unhashable reference items
+        matcher = FuzzyMatcher(reference_list, max_misspelled)
+    return matcher.Matches(list2)
 
 
 def CleanStatement(statement):
@@ -749,8 +1371,8 @@ def GetFieldsFromCompoundField(compound_field):
 def GetPenaltyMultiple(soln_list, student_list):
     global too_many_penalty
     penalty_multiple = 0
-    num_in_soln = np.size(soln_list)
-    num_in_student = np.size(student_list)
+    num_in_soln = _Size(soln_list)
+    num_in_student = _Size(student_list)
     if num_in_student > num_in_soln:
         penalty_multiple = too_many_penalty * (num_in_student - num_in_soln)
     if penalty_multiple > .9:
@@ -808,28 +1430,172 @@ def AssessQuerySelect(soln_select, student_select, debug=True):
 '''                         FOLLOWING 4 FUNCTIONS USED TO ANALYZE 'FROM' STATEMENT                                  '''
 # Purpose of this function is to return the tables, fields, and join types used in query
 # statement is SQL FROM line with 'FROM' already stripped
+# ---- FROM clause parser ----
+# A FROM clause is parsed once, left to right, into a list (one entry per comma separated item) of join trees.
+# A leaf is a table name; a JoinNode holds the join type ('INNER JOIN', 'LEFT JOIN', ...), its two sides and the
+# table/field names used in its ON condition. Brackets are removed and aliases are replaced by their table names.
+JoinNode = collections.namedtuple('JoinNode', ['JoinType', 'Left', 'Right', 'On'])
+
+_from_token_re = re.compile(r"\[[^\]]*\]|\"[^\"]*\"|'[^']*'|#[^#]*#|\w+|<>|<=|>=|\S")
+_join_words = {'INNER', 'LEFT', 'RIGHT', 'FULL', 'CROSS'}
+_from_keywords = _join_words | {'JOIN', 'OUTER', 'ON', 'AS', 'SELECT', 'WHERE', 'GROUP', 'HAVING', 'ORDER', 'UNION'}
+
+
+class _FromParser:
+    def __init__(self, text):
+        self._tokens = _from_token_re.findall(text)
+        self._pos = 0
+        self.Aliases = {}
+
+    def _Peek(self, offset=0):
+        if self._pos + offset < len(self._tokens):
+            return self._tokens[self._pos + offset]
+        return None
+
+    def _Upper(self, offset=0):
+        token = self._Peek(offset)
+        return token.upper() if token is not None else None
+
+    def _Next(self):
+        token = self._Peek()
+        self._pos += 1
+        return token
+
+    def _AtJoin(self):
+        return self._Upper() == 'JOIN' or (self._Upper() in _join_words and self._Upper(1) in ('JOIN', 'OUTER'))
+
+    @staticmethod
+    def _IsName(token):
+        return token is not None and (token[0] == '[' or token[0].isalnum() or token[0] == '_') and \
+            token.upper() not in _from_keywords
+
+    def FromList(self):
+        items = [self._JoinExpr()]
+        while self._Peek() == ',':
+            self._pos += 1
+            items.append(self._JoinExpr())
+        return items
+
+    def _JoinExpr(self):
+        node = self._Primary()
+        while self._AtJoin():
+            join_type = 'INNER' if self._Upper() == 'JOIN' else self._Next().upper()
+            if self._Upper() == 'OUTER':
+                self._pos += 1
+            self._pos += 1  # JOIN
+            right = self._Primary()
+            on = []
+            if self._Upper() == 'ON':
+                self._pos += 1
+                on = self._Condition()
+            node = JoinNode(join_type + ' JOIN', node, right, tuple(on))
+        return node
+
+    def _Primary(self):
+        if self._Peek() == '(':
+            if self._Upper(1) == 'SELECT':  # derived table; known by its alias (or its text if it has none)
+                text = self._Balanced()
+                alias = self._Alias()
+                return alias if alias is not None else text
+            self._pos += 1
+            node = self._JoinExpr()
+            if self._Peek() == ')':
+                self._pos += 1
+            return node
+        name = self._Name()
+        alias = self._Alias()
+        if alias is not None:
+            self.Aliases[alias] = name
+        return name
+
+    def _Name(self):
+        token = self._Next()
+        if token is None:
+            return ''
+        return token[1:-1] if token.startswith('[') else token
+
+    def _Alias(self):
+        if self._Upper() == 'AS':
+            self._pos += 1
+            return self._Name()
+        if self._IsName(self._Peek()):
+            return self._Name()
+        return None
+
+    def _Balanced(self):
+        depth = 0
+        start = self._pos
+        while self._Peek() is not None:
+            token = self._Next()
+            if token == '(':
+                depth += 1
+            elif token == ')':
+                depth -= 1
+                if depth == 0:
+                    break
+        return ' '.join(self._tokens[start:self._pos])
+
+    # Returns the (table, field) names in the condition, in order. Stops at the ')' closing an enclosing join,
+    # a ',' or the next JOIN (all at depth 0), or the end of the clause.
+    def _Condition(self):
+        names = []
+        depth = 0
+        while self._Peek() is not None:
+            token = self._Peek()
+            if token == '(':
+                depth += 1
+            elif token == ')':
+                if depth == 0:
+                    break
+                depth -= 1
+            elif depth == 0 and (token in (',', ';') or self._AtJoin()):
+                break
+            elif self._IsName(token) and self._Peek(1) == '.' and self._IsName(self._Peek(2)):
+                table = self._Name()
+                self._pos += 1
+                names.append((table, self._Name()))
+                continue
+            self._pos += 1
+        return names
+
+
+def _Unalias(node, aliases):
+    if isinstance(node, JoinNode):
+        return JoinNode(node.JoinType, _Unalias(node.Left, aliases), _Unalias(node.Right, aliases),
+                        tuple((aliases.get(table, table), field) for table, field in node.On))
+    return aliases.get(node, node)
+
+
+# from_statement is the text after FROM. Cached: the same solution/student FROM clauses are parsed once.
+@functools.lru_cache(maxsize=4096)
+def ParseFromClause(from_statement):
+    parser = _FromParser(from_statement.strip().rstrip(';'))
+    items = parser.FromList()
+    return tuple(_Unalias(item, parser.Aliases) for item in items)
+
+
+# Key elements of every join in a tree, innermost joins first (same order the old regex de-nesting produced):
+# ['<INNER|LEFT|RIGHT> JOIN', Table1, Field1, Table2, Field2, ...]
+def JoinElements(tree):
+    joins = []
+
+    def Walk(node):
+        if not isinstance(node, JoinNode):
+            return 0
+        height = max(Walk(node.Left), Walk(node.Right)) + 1
+        key_elements = [node.JoinType]
+        for table, field in node.On:
+            key_elements += [table, field]
+        joins.append((height, len(joins), key_elements))
+        return height
+    Walk(tree)
+    return [key_elements for height, cnt, key_elements in sorted(joins)]
+
+
 def GetKeyFromElements(statement, debug=True):
-    x = 0  # used for debugging purposes only
-    all_joins = []  # list of all tables, fields, and join types in query. Initialized to empty list.
-    cur_joins = [1]  # list of elements found in current parsing. Initialized to not empty for while loop.
-    while len(cur_joins) > 0:
-        # Use regular expression to find elements in statement of format:
-        #  '<TableName1> <INNER|RIGHT|LEFT> JOIN <TableName2> ON <TableName1.FieldName1> = <TableName2.FieldName2>'
-        cur_joins = re.findall(r'\(?\w+ \w+ JOIN \[?\w+\]? ON \w+\.\w+ = \w+\.\w+\)?', statement)
-        # Below loop accounts for nesting elements.
-        for join in cur_joins:
-            # Replace nested elements. Have to do this to go 'up' hierarchy
-            statement = statement.replace(join, 'BLAH'+str(x))
-            if debug:  # print statement after replacing found elements
-                print('De-nesting Iter {}: {}'.format(x+1, statement))
-            # Use of x in the 'BLAH' replacement potentially helps with debugging. Otherwise not needed
-            x += 1
-            # Strip out key elements (i.e. table names, fields, and join types)
-            key_elements = re.findall(r'\w+ JOIN', join)  # Find elements of format '<INNER|RIGHT|LEFT> JOIN'
-            for element in re.findall(r'\w+\.\w+', join):  # Find elements of format '<TableName>.<FieldName>'
-                key_elements += element.split('.')  # Split table name and field name and add to list
-            # Add key elements from JOIN sub-statement to the master list of joins
-            all_joins.append(key_elements)
+    all_joins = []  # list of all tables, fields, and join types in query
+    for tree in ParseFromClause(statement):
+        all_joins += JoinElements(tree)
     if debug:  # print found relationships
         for cnt, join in enumerate(all_joins):
             print('Relationship {}: {}'.format(cnt, join))
@@ -841,13 +1607,11 @@ def BreakdownQueryFromStmt(from_statement, debug=True):
     # Stripping 'FROM' from statement to allow additional manipulation.
     statement1 = from_statement.strip('\r').split('FROM ')[1]
     stmt_relationships = []
-    for sub_statmenet in statement1.split(', '):  # if no relationship, tables separated by commas
-        if 'JOIN' not in sub_statmenet:  # if no relationship, no JOIN in statement
-            stmt_relationships.append([sub_statmenet])
+    for tree in ParseFromClause(statement1):  # if no relationship, tables separated by commas
+        if not isinstance(tree, JoinNode):  # if no relationship, just the table name
+            stmt_relationships.append([tree])
         else:  # if relationship exists, get key elements (tables, fields, relationship type)
-            relationships = GetKeyFromElements(statement1, debug)
-            for rltn in relationships:
-                stmt_relationships.append(rltn)
+            stmt_relationships += JoinElements(tree)
     if debug:
         print(stmt_relationships)
     return stmt_relationships
@@ -957,6 +1721,271 @@ def BreakdownCriteriaStatement(full_statement):
     return num_elements, num_stmts, complete_elements_list
 
 
+# ---- Canonical criteria ----
+# CanonicalCriteria turns a criteria statement into a canonical string so equivalent criteria compare equal:
+# AND/OR are flattened and their operands sorted, '>'/'>=' are rewritten as '<'/'<=' with the operands swapped,
+# '='/'<>' operands are sorted, Between becomes two '<=' comparisons, Yes/True/On and No/False/Off are unified,
+# names and text are lower case (Access compares text case-insensitively) and numbers are normalized. Unbalanced
+# parentheses (left over from splitting a statement on ' AND '/' OR ') are tolerated.
+_criteria_token_re = re.compile(r"\"(?:[^\"]|\"\")*\"|'(?:[^']|'')*'|#[^#]*#|\d+\.?\d*|"
+                                r"(?:\[[^\]]*\]|\w+)(?:\.(?:\[[^\]]*\]|\w+))*|<>|<=|>=|\S")  # [T].[F] is one name
+_flip_comparison = {'>': '<', '>=': '<='}
+_true_words = {'yes', 'true', 'on'}
+_false_words = {'no', 'false', 'off'}
+
+
+class _CriteriaParser:
+    def __init__(self, statement):
+        self._tokens = _criteria_token_re.findall(statement)
+        self._pos = 0
+
+    def _Peek(self):
+        return self._tokens[self._pos] if self._pos < len(self._tokens) else None
+
+    def _Upper(self):
+        token = self._Peek()
+        return token.upper() if token is not None else None
+
+    def _Next(self):
+        token = self._Peek()
+        self._pos += 1
+        return token
+
+    def Parse(self):
+        nodes = []
+        while self._Peek() is not None:
+            if self._Peek() in (')', ';'):  # unmatched closing parenthesis, or the end of the SQL
+                self._pos += 1
+                continue
+            nodes.append(self._Or())
+        return nodes[0] if len(nodes) == 1 else _Group('AND', nodes)
+
+    def _Or(self):
+        nodes = [self._And()]
+        while self._Upper() == 'OR':
+            self._pos += 1
+            nodes.append(self._And())
+        return _Group('OR', nodes)
+
+    def _And(self):
+        nodes = [self._Not()]
+        while self._Upper() == 'AND':
+            self._pos += 1
+            nodes.append(self._Not())
+        return _Group('AND', nodes)
+
+    def _Not(self):
+        if self._Upper() == 'NOT':
+            self._pos += 1
+            return 'NOT(' + self._Not() + ')'
+        return self._Predicate()
+
+    def _Predicate(self):
+        left = self._Operand()
+        upper = self._Upper()
+        if upper in ('=', '<>', '<', '<=', '>', '>='):
+            self._pos += 1
+            return _Comparison(upper, left, self._Operand())
+        if upper == 'BETWEEN':
+            self._pos += 1
+            low = self._Operand()
+            if self._Upper() == 'AND':
+                self._pos += 1
+            high = self._Operand()
+            return _Group('AND', [_Comparison('<=', low, left), _Comparison('<=', left, high)])
+        if upper == 'IS':
+            self._pos += 1
+            negate = self._Upper() == 'NOT'
+            if negate:
+                self._pos += 1
+            self._pos += 1  # NULL
+            return 'NOT(NULL(' + left + '))' if negate else 'NULL(' + left + ')'
+        negate = upper == 'NOT'
+        if negate:
+            self._pos += 1
+        if self._Upper() == 'LIKE':
+            self._pos += 1
+            node = 'LIKE(' + left + ',' + self._Operand() + ')'
+            return 'NOT(' + node + ')' if negate else node
+        if self._Upper() == 'IN':
+            self._pos += 1
+            node = 'IN(' + left + ',' + self._InList() + ')'
+            return 'NOT(' + node + ')' if negate else node
+        return left
+
+    # In (a, b, ...): the items, sorted, as LIST(...); In (SELECT ...) is a sub-query like any other
+    def _InList(self):
+        sub_query = self._pos + 1 < len(self._tokens) and self._tokens[self._pos + 1].upper() == 'SELECT'
+        if self._Peek() != '(' or sub_query:
+            return self._Operand()
+        self._pos += 1
+        items = []
+        while self._Peek() not in (')', None):
+            if self._Peek() == ',':
+                self._pos += 1
+                continue
+            items.append(self._Operand())
+        self._pos += 1
+        return 'LIST(' + ','.join(sorted(items)) + ')'
+
+    # a value, or a value combined with arithmetic/concatenation operators; a parenthesized boolean is a value too
+    def _Operand(self):
+        parts = [self._Value()]
+        while self._Peek() in ('+', '-', '*', '/', '&', '\\', '^') or self._Upper() == 'MOD':
+            parts.append(self._Next().upper())
+            parts.append(self._Value())
+        return ''.join(parts)
+
+    def _Value(self):
+        token = self._Next()
+        if token is None:
+            return ''
+        if token == '(':
+            if self._Upper() == 'SELECT':  # sub-query: compared as text
+                depth = 1
+                parts = []
+                while self._Peek() is not None and depth:
+                    part = self._Next()
+                    depth += {'(': 1, ')': -1}.get(part, 0)
+                    parts.append(_Constant(part) if part[0] in '"\'' else part.lower())
+                return '(' + ' '.join(parts)
+            node = self._Or()
+            if self._Peek() == ')':
+                self._pos += 1
+            return node
+        if token == '-' and self._Peek() is not None and self._Peek()[0].isdigit():
+            return _Constant('-' + self._Next())
+        if self._Peek() == '(' and token[0].isalpha():  # function call
+            self._pos += 1
+            args = []
+            while self._Peek() not in (')', None):
+                if self._Peek() == ',':
+                    self._pos += 1
+                    continue
+                args.append(self._Or())
+            self._pos += 1
+            return token.lower() + '(' + ','.join(args) + ')'
+        return _Constant(token)
+
+
+# Text comes out in single quotes, with any single quote in it doubled (so _SplitTopLevel can find where it ends)
+def _Constant(token):
+    if token[0] in '"\'':
+        return "'" + token[1:-1].replace(token[0] * 2, token[0]).lower().replace("'", "''") + "'"
+    if token[0] == '#':
+        return token
+    if token[0].isdigit() or token[0] == '-':
+        try:
+            return repr(float(token))
+        except ValueError:
+            return token
+    if token.lower() in _true_words:
+        return 'TRUE'
+    if token.lower() in _false_words:
+        return 'FALSE'
+    return token.replace('[', '').replace(']', '').lower()
+
+
+def _Group(operator, nodes):
+    if len(nodes) == 1:
+        return nodes[0]
+    flat = []
+    prefix = operator + '('
+    for node in nodes:
+        if node.startswith(prefix) and _Balanced(node[len(prefix):-1]):
+            flat += _SplitTopLevel(node[len(prefix):-1])
+        else:
+            flat.append(node)
+    return prefix + ','.join(sorted(flat) if operator in ('AND', 'OR') else flat) + ')'
+
+
+def _Balanced(text):
+    depth = 0
+    for char in text:
+        depth += {'(': 1, ')': -1}.get(char, 0)
+        if depth < 0:
+            return False
+    return depth == 0
+
+
+# Splits a canonical node's operands on the commas outside parentheses and quotes. A quote inside text is doubled
+# (see _Constant), which closes and reopens the quote with nothing in between.
+def _SplitTopLevel(text):
+    parts = []
+    depth = 0
+    start = 0
+    quote = None
+    for cnt, char in enumerate(text):
+        if quote:
+            if char == quote:
+                quote = None
+        elif char in '\'#':
+            quote = char
+        elif char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        elif char == ',' and depth == 0:
+            parts.append(text[start:cnt])
+            start = cnt + 1
+    parts.append(text[start:])
+    return parts
+
+
+def _Comparison(operator, left, right):
+    if operator in _flip_comparison:
+        operator, left, right = _flip_comparison[operator], right, left
+    if operator in ('=', '<>'):
+        left, right = sorted((left, right))
+    return operator + '(' + left + ',' + right + ')'
+
+
+# Returns None if the statement can't be put in canonical form
+@functools.lru_cache(maxsize=4096)
+def CanonicalCriteria(statement):
+    try:
+        return _CriteriaParser(statement).Parse()
+    except Exception:
+        return None
+
+
+def CriteriaHash(statement):
+    canonical = CanonicalCriteria(statement)
+    return None if canonical is None else hashlib.sha1(canonical.encode('utf-8')).hexdigest()
+
+
+# Canonical form of each AND statement, laid out like BreakdownCriteriaStatement's elements list
+def _CanonicalCriteriaLines(full_statement):
+    return [[CanonicalCriteria(AND_stmt) for AND_stmt in OR_line.split(' AND ')]
+            for OR_line in full_statement.split(' OR ')]
+
+
+# Best one-to-one pairing of left and right items; pair_score(i, j) is computed once per pair. As with the permutations
+# this replaces, when there are more left items than right ones only the first len(right) left items are paired.
+# Returns (score, [(i, j), ...]).
+def _BestAssignment(num_left, num_right, pair_score):
+    num_pairs = min(num_left, num_right)
+    if not num_pairs:
+        return 0, []
+    scores = [[pair_score(i, j) for j in range(num_right)] for i in range(num_pairs)]
+    best_score, best_pairs = -1, []
+    for permute in itertools.permutations(range(num_right), num_pairs):
+        score = sum(scores[i][j] for i, j in enumerate(permute))
+        if score > best_score:
+            best_score, best_pairs = score, list(enumerate(permute))
+    return best_score, best_pairs
+
+
+# Matches one solution OR line against one student OR line: AND statements with the same canonical form score as a
+# full match; the rest go through the fuzzy GetNumberMatches comparison.
+def _CriteriaLineScore(soln_elements, soln_canonical, stdnt_elements, stdnt_canonical):
+    def PairScore(i, j):
+        if soln_canonical[i] is not None and soln_canonical[i] == stdnt_canonical[j]:
+            return len(soln_elements[i])
+        return GetNumberMatches(soln_elements[i], stdnt_elements[j])[0]
+    return _BestAssignment(len(soln_elements), len(stdnt_elements), PairScore)[0]
+
+
 def AssessQueryCriteria(soln_where, soln_having, student_where, student_having, debug=True):
     if debug:
         print('\n\tASSESSING WHERE/HAVING')
@@ -1006,47 +2035,24 @@ def AssessQueryCriteria(soln_where, soln_having, student_where, student_having,
 
     num_soln_elements, num_soln_stmts, soln_elements_list = BreakdownCriteriaStatement(soln_stripped_stmt)
     num_stdnt_elements, num_stdnt_stmts, stdnt_elements_list = BreakdownCriteriaStatement(student_stripped_stmt)
-    final_list = []
     extra_stmt = 0
-    for permute in list(itertools.permutations(stdnt_elements_list, len(stdnt_elements_list))):  #Permute student OR
-        # print('PERMUTE: ', permute)
-        permute_list = []
-        for cnt, row in enumerate(permute):
-            stmt_permute = []
-            for cnt2, stmts in enumerate(list(itertools.permutations(row, len(row)))):  # Permute student AND
-                # print('\tROW:', list(stmts))
-                stmt_permute.append(list(stmts))
-            permute_list.append(stmt_permute)
-        # print('Permute list:', permute_list)  # create list of permuted AND/OR combinations
-        final_list.append(list(itertools.product(*permute_list)))  # all combination taking one from each list
-    # print('PERMUTED LIST')
     if num_stdnt_stmts > num_soln_stmts:
         extra_stmt = num_stdnt_stmts - num_soln_stmts
-    best_score = 0
-    best_match = []
-    for item in final_list:
-        for item2 in item:
-            temp_score = 0
-            temp_list = []
-            # print(item2)
-            for cnt, item6 in enumerate(soln_elements_list):
-                # print('SOLN Element:', item6, '\nSTDNT Element:', item2[cnt])
-                if cnt + 1 <= len(item2):
-                    for cnt2, item7 in enumerate(item6):
-                        if cnt2+1 <= len(item2[cnt]):
-                            num_matches, matches = GetNumberMatches(item7, item2[cnt][cnt2])
-                            # print('MATCHES', matches, num_matches)
-                            temp_score += num_matches
-                            if num_matches > 0 and item2[cnt] not in temp_list:
-                                temp_list.append(item2[cnt])
-            if temp_score > best_score:
-                best_score = temp_score
-                best_match = temp_list
-            # for item3 in item2:
-            #     print(item3)
-                # for item4 in item3:
-                #     print(item4)
-                    # print(item6)
+    soln_canonical_list = _CanonicalCriteriaLines(soln_stripped_stmt)
+    stdnt_canonical_list = _CanonicalCriteriaLines(student_stripped_stmt)
+    soln_whole = CanonicalCriteria(soln_stripped_stmt)
+    if soln_whole is not None and soln_whole == CanonicalCriteria(student_stripped_stmt):
+        best_score = num_soln_elements  # equivalent criteria (e.g. same AND/OR terms in another order)
+        best_match = stdnt_elements_list
+    else:
+        line_scores = {}
+
+        def LineScore(i, j):
+            line_scores[i, j] = _CriteriaLineScore(soln_elements_list[i], soln_canonical_list[i],
+                                                   stdnt_elements_list[j], stdnt_canonical_list[j])
+            return line_scores[i, j]
+        best_score, pairs = _BestAssignment(len(soln_elements_list), len(stdnt_elements_list), LineScore)
+        best_match = [stdnt_elements_list[j] for i, j in pairs if line_scores[i, j] > 0]
     # print('BEST MATCH: {}\nBEST SCORE: {}'.format(best_match, best_score))
 
     final_criteria_score = (best_score / num_soln_elements) * (1 - (too_many_penalty * (extra_stmt)))
@@ -1098,7 +2104,7 @@ def AssessQueryTotalsFunctions(soln_totals, student_totals, debug=True):
         print('Solution Totals: {}'.format(soln_totals_elements))
         print('Student Totals: {}'.format(student_totals_elements))
         print('Best Match: {}'.format(best_match))
-        print('# Correct: {}\t# Select: {}'.format(np.size(soln_totals_elements), np.size(best_match)))
+        print('# Correct: {}\t# Select: {}'.format(_Size(soln_totals_elements), _Size(best_match)))
     # penalty_factor, num_elements, student_elements = GetPenaltyMultiple(soln_select_elements, student_select_elements)
     # compare_ratio = (select_cnt / num_elements) * (1 - penalty_factor)  # penalty for choosing too much stuff
     # return compare_ratio
@@ -1134,7 +2140,7 @@ def AssessQueryGroupby(soln_groupby, student_groupby, debug=True):
         print('Solution group by: {}'.format(soln_display_groupby))
         print('Student group by: {}'.format(stdnt_display_groupby))
         print('Best Match: {}'.format(best_match))
-        print('# Correct: {}\t# Groupby: {}'.format(np.size(best_match), np.size(soln_display_groupby)))
+        print('# Correct: {}\t# Groupby: {}'.format(_Size(best_match), _Size(soln_display_groupby)))
     # penalty_factor, num_elements, student_elements = GetPenaltyMultiple(soln_groupby_elements, student_groupby_elements)
     # compare_ratio = (groupby_cnt / num_elements) * (1 - penalty_factor)  # penalty for choosing too much stuff
     # return compare_ratio
@@ -1154,8 +2160,8 @@ def AssessTotalsRow(soln_groupby, student_groupby, soln_select, student_select,
     if '(' in soln_select or ')' in soln_select:  # If there is a totals function in solution
         soln_totals_elements, stdnt_totals_elements, best_totals = AssessQueryTotalsFunctions(soln_select,
                                                                                                 student_select, debug)
-    num_matches = np.size(best_groupby) + np.size(best_totals)
-    num_possible = np.size(soln_groupby_elements) + np.size(soln_totals_elements)
+    num_matches = _Size(best_groupby) + _Size(best_totals)
+    num_possible = _Size(soln_groupby_elements) + _Size(soln_totals_elements)
     extra_stmts = len(stdnt_groupby_elements) + len(stdnt_totals_elements) - len(soln_groupby_elements)\
                   - len(soln_totals_elements)
     if extra_stmts < 0:
@@ -1206,7 +2212,7 @@ def AssessQuerySort(soln_sort, student_sort, debug=True):
             if first_time_through_loop:
                 all_stdnt_elements.append(student_elements)
             # print('Stdnts', student_elements)
-            if distance.levenshtein(soln_elements[0], student_elements[0]) < max_misspelled:
+            if Levenshtein(soln_elements[0], student_elements[0]) < max_misspelled:
                 sort_score += 1
                 if cnt == cnt2:
                     order_score += 1
@@ -1242,6 +2248,15 @@ def FindSubStatement(statement_list, substring):
         if substring in substatement:
             return substatement
 
+
+# keyword -> sub-statement (or None) of a query's SQL. Cached: the same solution SQL (and each alternative solution's)
+# is taken apart again for every student otherwise.
+@functools.lru_cache(maxsize=4096)
+def _SQLStatements(sql):
+    parts = sql.strip().split('\n')
+    return {keyword: FindSubStatement(parts, keyword) for keyword in ('SELECT', 'FROM', 'WHERE', 'HAVING', 'GROUP BY',
+                                                                      'ORDER')}
+
 ###  Used to check if two SQL queries are the same.
 ###  query1: should be the SQL attribute from the Table class.
 ###  string: the exact SQL string from the 'answer' with a SELECT
@@ -1254,16 +2269,19 @@ def AssessStringQuery(query1, string):
 
 def QuickSQLCheck(SQL1, SQL2):
     global max_misspelled
-    if distance.levenshtein(SQL1.replace('\r', '').rstrip(), SQL2.replace('\r', '').rstrip()) < max_misspelled:
+    if Levenshtein(SQL1.replace('\r', '').rstrip(), SQL2.replace('\r', '').rstrip()) < max_misspelled:
         return 1
     else:
         return 0
 
 
-def AssessQuery(query1, query2, compare_records=True, debug=False):
+# checks (see CompileChecks) limits the assessment to what is scored; None assesses everything. The penalties are
+# always assessed. Records are still compared for an exact match, which earns full marks, but unless MatchScore is
+# wanted nothing more is done with them. sampling: as for AssessRecords.
+def AssessQuery(query1, query2, compare_records=True, debug=False, budget=None, checks=None, sampling=None):
     if debug:
         print('ASSESSING QUERY')
-    exact_rec_score = select_score = from_score = criteria_score = groupby_score = sort_score = 0
+    exact_rec_score = select_score = from_score = criteria_score = groupby_score = totals_score = sort_score = 0
     where_penalty = having_penalty = groupby_penalty = sort_penalty = False
     extra_statements = []
     query_report = ['{} QUERY\n'.format(query1.Name)]
@@ -1275,38 +2293,41 @@ def AssessQuery(query1, query2, compare_records=True, debug=False):
                query_report
 
     if compare_records:
-        if ExactRecordsMatch(query1, query2):
+        exact_rec_score, diff = AssessRecords(query1, query2, report=query_report, budget=budget,
+                                              exact_only=not _Wanted(checks, 'MatchScore'), sampling=sampling)
+        if exact_rec_score == 4:
             query_report += ['\tExact record match']
             if debug:
                 print(''.join(query_report))
             return QueryScore(1, 1, 1, 1, 1, 1, where_penalty, having_penalty, groupby_penalty, sort_penalty, 4), \
                    query_report
-    SQL1_parts = query1.SQL.strip().split('\n')
-    SQL2_parts = query2.SQL.strip().split('\n')
+    SQL1_parts = _SQLStatements(query1.SQL)
+    SQL2_parts = _SQLStatements(query2.SQL)
     # first element of any query SQL is the select statement, so see if they are selecting correct fields
     soln_criteria_statements = []
     student_criteria_statements = []
 
     # Assess the 'SELECT' statement
-    soln_select = FindSubStatement(SQL1_parts, 'SELECT')
-    student_select = FindSubStatement(SQL2_parts, 'SELECT')
-    if soln_select is not None:  # If there is a SELECT in solution
+    soln_select = SQL1_parts['SELECT']
+    student_select = SQL2_parts['SELECT']
+    if soln_select is not None and _Wanted(checks, 'SELECTscore'):  # If there is a SELECT in solution
         select_score, select_report = AssessQuerySelect(soln_select, student_select, debug)
         query_report += select_report
 
     # Assess the 'FROM' statement
-    soln_from = FindSubStatement(SQL1_parts, 'FROM')
-    student_from = FindSubStatement(SQL2_parts, 'FROM')
-    if soln_from is not None:  # If there is a FROM in solution
+    soln_from = SQL1_parts['FROM']
+    student_from = SQL2_parts['FROM']
+    if soln_from is not None and _Wanted(checks, 'FROMscore'):  # If there is a FROM in solution
         from_score, from_report = AssessQueryFrom(soln_from, student_from, debug)
         query_report += from_report
 
     # Assess 'WHERE' and 'HAVING' criteria
-    soln_where = FindSubStatement(SQL1_parts, 'WHERE')
-    soln_having = FindSubStatement(SQL1_parts, 'HAVING')
-    student_where = FindSubStatement(SQL2_parts, 'WHERE')
-    student_having = FindSubStatement(SQL2_parts, 'HAVING')
-    if soln_where is not None or soln_having is not None:  # If there is WHERE or HAVING in solution, assess
+    soln_where = SQL1_parts['WHERE']
+    soln_having = SQL1_parts['HAVING']
+    student_where = SQL2_parts['WHERE']
+    student_having = SQL2_parts['HAVING']
+    # If there is WHERE or HAVING in solution, assess
+    if (soln_where is not None or soln_having is not None) and _Wanted(checks, 'CRITERIAscore'):
         criteria_score, criteria_report = AssessQueryCriteria(soln_where, soln_having, student_where, student_having,
                                                               debug)
         query_report += criteria_report
@@ -1317,11 +2338,13 @@ def AssessQuery(query1, query2, compare_records=True, debug=False):
         having_penalty = True  # Penalty for using HAVING when not supposed to
         extra_statements.append('HAVING')
     # Assess 'GROUPBY' and Totals functions
-    soln_groupby = FindSubStatement(SQL1_parts, 'GROUP BY')
-    student_groupby = FindSubStatement(SQL2_parts, 'GROUP BY')
-    totals_score, totals_report = AssessTotalsRow(soln_groupby, student_groupby, soln_select, student_select, debug)
-    if len(totals_report) > 0:
-        query_report += totals_report
+    soln_groupby = SQL1_parts['GROUP BY']
+    student_groupby = SQL2_parts['GROUP BY']
+    if _Wanted(checks, 'TOTALSscore'):
+        totals_score, totals_report = AssessTotalsRow(soln_groupby, student_groupby, soln_select, student_select,
+                                                      debug)
+        if len(totals_report) > 0:
+            query_report += totals_report
     if (soln_groupby is None and student_groupby is not None) or ('(' not in soln_select and '(' in student_select):
         groupby_penalty = True  # Penalty for using totals functions when not supposed to
         if having_penalty and soln_where is not None:
@@ -1331,9 +2354,9 @@ def AssessQuery(query1, query2, compare_records=True, debug=False):
             student_having is not None and student_where is None:
         having_penalty = False
     # Assess 'SORT'
-    soln_sort = FindSubStatement(SQL1_parts, 'ORDER')
-    student_sort = FindSubStatement(SQL2_parts, 'ORDER')
-    if soln_sort is not None:  # If there is ORDER in solution, assess
+    soln_sort = SQL1_parts['ORDER']
+    student_sort = SQL2_parts['ORDER']
+    if soln_sort is not None and _Wanted(checks, 'SORTscore'):  # If there is ORDER in solution, assess
             sort_score, sort_report = AssessQuerySort(soln_sort, student_sort, debug)
             query_report += sort_report
     if soln_sort is None and student_sort is not None:
@@ -1353,6 +2376,161 @@ def AssessQuery(query1, query2, compare_records=True, debug=False):
         print(''.join(query_report))
     return query_results, query_report
 
+
+'''-----------------------------------------------------------------------------------------------------------------'''
+'''                                           WHOLE DATABASE ASSESSMENT                                             '''
+''' A rubric plan is a list of RubricItems (use TableItem, QueryItem and LookupItem to make them). AssessDatabase     '''
+''' finds the student's object for each item, runs the matching Assess function and totals the weighted points.     '''
+''' Every table/query is wrapped so its records are fetched at most once, however many items use it. When both      '''
+''' backends are ThreadSafe (snapshots, ACEdbUtils) the items are assessed concurrently.                             '''
+''' An item may name alternative solutions (other correct tables/queries in the solution database): the student's   '''
+''' object is assessed against each in turn, sharing its records, and the best assessment counts.                   '''
+
+
+RubricItem = collections.namedtuple('RubricItem', ['Kind', 'Name', 'Field', 'Weights', 'CompareRecords', 'Points',
+                                                   'Alternatives'], defaults=((),))
+ItemResult = collections.namedtuple('ItemResult', ['Item', 'StudentName', 'Assessment', 'Score', 'Points', 'Report',
+                                                   'Error'])
+DataBaseResult = collections.namedtuple('DataBaseResult', ['Items', 'Points', 'Possible', 'Report'])
+
+
+# alternatives: names of other solution tables/queries that are just as correct
+def TableItem(name, weights=base_table_weight, compare_records=True, points=1, alternatives=()):
+    return RubricItem('TABLE', name, None, weights, compare_records, points, tuple(alternatives))
+
+
+def QueryItem(name, weights=base_query_weight, compare_records=True, points=1, alternatives=()):
+    return RubricItem('QUERY', name, None, weights, compare_records, points, tuple(alternatives))
+
+
+def LookupItem(table_name, field_name, weights=base_lookup_weight, points=1):
+    return RubricItem('LOOKUP', table_name, field_name, weights, False, points)
+
+
+# exact name, then case-insensitive, then the closest name within max_misspelled; None if nothing is close enough
+def ResolveName(name, names):
+    if name in names:
+        return name
+    for candidate in names:
+        if candidate.lower() == name.lower():
+            return candidate
+    if not names:
+        return None
+    smallest_distance, smallest_item = FindMinDistance(name, list(names))
+    if smallest_distance <= max_misspelled:
+        return smallest_item
+    return None
+
+
+def _SharedObjects(objects):
+    from dbCache import SolutionObject
+    return {name: obj if isinstance(obj, SolutionObject) else SolutionObject(obj, preload=False)
+            for name, obj in objects.items()}
+
+
+# (assessment, report, score) of the student's table/query against one solution
+def _AssessAgainst(item, soln_obj, stdnt_obj, budget=None, memo=None, checks=None, sampling=None):
+    if item.Kind == 'TABLE':
+        assess = AssessTables if memo is None else memo.AssessTables
+        assessment, report = assess(soln_obj, stdnt_obj, compare_records=item.CompareRecords, budget=budget,
+                                    checks=checks, sampling=sampling)
+        return assessment, report, ScoreTable(assessment, item.Weights)
+    assess = AssessQuery if memo is None else memo.AssessQuery
+    assessment, report = assess(soln_obj, stdnt_obj, compare_records=item.CompareRecords, budget=budget,
+                                checks=checks, sampling=sampling)
+    return assessment, report, ScoreQuery(assessment, item.Weights)
+
+
+# The score of a perfect table/query under the item's weights
+def _FullScore(item):
+    if item.Kind == 'TABLE':
+        return ScoreTable(TableScore(*[0 if name == 'DiffPriKeysScore' else 1 for name in TableScore._fields]),
+                          item.Weights)
+    return ScoreQuery(QueryScore(1, 1, 1, 1, 1, 1, False, False, False, False, 4), item.Weights)
+
+
+def _AssessItem(item, soln_objects, stdnt_objects, budget=None, memo=None, sections=(), sampling=None):
+    kind_objects = soln_objects[item.Kind]
+    if item.Name not in kind_objects:  # a mistake in the rubric: an error for this item, not the whole run
+        error = LookupError('{} {} is not in the solution database'.format(item.Kind, item.Name))
+        return ItemResult(item, None, None, 0, 0, ['{} {} ERROR: {}\n'.format(item.Name, item.Kind, error)], error)
+    stdnt_kind_objects = stdnt_objects[item.Kind]
+    stdnt_name = ResolveName(item.Name, stdnt_kind_objects)
+    if stdnt_name is None:
+        return ItemResult(item, None, None, 0, 0, ['{} {} NOT FOUND\n'.format(item.Name, item.Kind)], None)
+    soln_obj = kind_objects[item.Name]
+    alternatives = [kind_objects[name] for name in item.Alternatives if name in kind_objects]
+    unknown = [name for name in item.Alternatives if name not in kind_objects]  # rubric mistakes: skipped
+    stdnt_obj = stdnt_kind_objects[stdnt_name]
+    checks = None if sections is None or item.Kind == 'LOOKUP' else CompileChecks(item.Weights, sections)
+    try:
+        if item.Kind in ('TABLE', 'QUERY'):
+            best = error = None
+            for tried, soln_obj in enumerate([soln_obj] + alternatives, 1):
+                try:
+                    assessment, report, score = _AssessAgainst(item, soln_obj, stdnt_obj, budget, memo, checks,
+                                                               sampling)
+                except Exception as e:  # an alternative the student's answer can't be compared with
+                    error = error or e
+                    continue
+                if best is None or score > best[2]:
+                    best = assessment, report, score, soln_obj.Name
+                if score >= _FullScore(item) - 1e-9:  # can't do better than this
+                    break
+            if best is None:
+                raise error
+            assessment, report, score, soln_name = best
+            if alternatives:
+                report = report + ['\t-Best match: {} solution {} ({} of {} tried)\n'.format(
+                    item.Kind.lower(), soln_name, tried, 1 + len(alternatives))]
+            if unknown:
+                report = report + ['\t-Alternative solutions not in the solution database: {}\n'.format(
+                    ', '.join(unknown))]
+        else:
+            stdnt_field = ResolveName(item.Field, stdnt_obj.GetFields())
+            if stdnt_field is None:
+                return ItemResult(item, stdnt_name, None, 0, 0, ['{} FIELD LOOKUP ({} Table) NOT FOUND\n'.format(
+                    item.Field, item.Name)], None)
+            assessment, report = CompareLookupProperties(soln_obj, item.Field, stdnt_obj, stdnt_field)
+            score = ScoreLookups(assessment, item.Weights)
+    except Exception as e:
+        return ItemResult(item, stdnt_name, None, 0, 0, ['{} {} ERROR: {}\n'.format(item.Name, item.Kind, e)], e)
+    return ItemResult(item, stdnt_name, assessment, score, score * item.Points, report, None)
+
+
+# Returns a DataBaseResult; Items are in plan order. workers=1 forces sequential grading. memo is an optional
+# dbCache.AssessmentMemo that skips re-assessing submissions identical to ones already graded. engine is an optional
+# dbLocalQuery.LocalEngine (loaded from soln_db) that runs both sides' query SQL on the solution's tables.
+# Only what an item's weights score is assessed (see CompileChecks), so e.g. a table's records aren't fetched unless
+# RowsScore has a weight; sections names TableScore/QueryScore fields to assess and report anyway, None for all.
+# Records are fetched under budget, dbBudget.grading_budget if None; sampling is as for AssessRecords.
+def AssessDatabase(soln_db, student_db, plan, budget=None, workers=None, memo=None, engine=None, sections=(),
+                   sampling=None):
+    if budget is None:
+        budget = grading_budget
+    soln_queries, stdnt_queries = soln_db.Queries, student_db.Queries
+    if engine is not None:
+        soln_queries, stdnt_queries = engine.Queries(soln_db), engine.Queries(student_db)
+    soln_objects = {'TABLE': _SharedObjects(soln_db.Tables), 'QUERY': _SharedObjects(soln_queries)}
+    soln_objects['LOOKUP'] = soln_objects['TABLE']
+    stdnt_objects = {'TABLE': _SharedObjects(student_db.Tables), 'QUERY': _SharedObjects(stdnt_queries)}
+    stdnt_objects['LOOKUP'] = stdnt_objects['TABLE']
+    concurrent_ok = getattr(soln_db, 'ThreadSafe', False) and getattr(student_db, 'ThreadSafe', False)
+    if concurrent_ok and workers != 1 and len(plan) > 1:
+        import concurrent.futures  # (and logging with it) only when it is needed
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(lambda item: _AssessItem(item, soln_objects, stdnt_objects, budget, memo,
+                                                                 sections, sampling), plan))
+    else:
+        results = [_AssessItem(item, soln_objects, stdnt_objects, budget, memo, sections, sampling) for item in plan]
+    report = []
+    for result in results:
+        report += result.Report
+        report += ['\tScore: {:.2f} of {}\n'.format(result.Points, result.Item.Points)]
+    return DataBaseResult(results, sum(result.Points for result in results),
+                          sum(item.Points for item in plan), report)
+
+
 def PrintReport(report, for_students=False, hide_output=None):
     if hide_output is None:
         final_report = ''.join(report).strip()
@@ -3,12 +3,23 @@ import sys, csv, datetime
 
 # sys.path.append(r"\\usmasvddeecs\eecs\S&F\Courses\IT305\libraries")
 import dbUtils as db
+from dbCache import solution_registry
+from dbGridView import GridView
 
 pypyodbc.lowercase = False
 tk = tkinter.Tk()
 displayFrame = tkinter.Frame(tk)
 displayFrame.pack()
 
+# column names, then one row per cadet (gridView works out which labels to change on a refresh)
+labels = ['Name', 'File', 'EB Tbl', 'EB R/C', 'EB Out', 'TS Tbl', 'TS R/C', 'TS Out', 'Total', 'Points']
+for cnt, label in enumerate(labels):
+    label = tkinter.Label(displayFrame, text=label, font=("Courier New", 14, "bold"))
+    label.grid(row=0, column=cnt)
+gridView = GridView(first_row=1)
+gridLabels = {}  # (row, column) -> tkinter.Label
+countLabel = tkinter.Label(displayFrame, font=("Courier New", 14, "bold"), relief="ridge")
+
 cdtDict = {}
 sections = []
 sec = ""
@@ -100,17 +111,10 @@ def ScoreToGrade(scoreVector, rubric):
 
 
 def setSection(section, tk):
-    global displayFrame
     global sec
     tk.title("Retrieving " + section + ": HW 5")
     tk.update()
     sec = section
-    newFrame = tkinter.Frame(tk)
-    # display column names in Tkinter
-    labels = ['Name', 'File', 'EB Tbl', 'EB R/C', 'EB Out', 'TS Tbl', 'TS R/C', 'TS Out', 'Total', 'Points']
-    for cnt, label in enumerate(labels):
-        label = tkinter.Label(newFrame, text=label, font=("Courier New", 14, "bold"))
-        label.grid(row=0, column=cnt)
     cdtCount = 0
     cdtOutput = []
 
@@ -139,20 +143,18 @@ def setSection(section, tk):
 
             wpg = True
             try:  # Try to connect to the database
-                conn = pypyodbc.connect(
-                    r"Driver={Microsoft Access Driver (*.mdb, *.accdb)};" + "Dbq={0};".format(workPath))
+                catalog = db.GetCatalog(workPath)
             except:
                 print('Cannot open DB')
                 wpg = False
 
             if wpg:  # if we have a good connection to the database
-                cur = conn.cursor()
                 cdtRes.append("Good".center(6))
                 # grade += 1 # no points for file found
 
                 try:
-                    studentTables = db.GetTableNames(cur)
-                    studentQueries = db.GetQueryNames(cur)
+                    studentTables = db.GetTableNames(catalog)
+                    studentQueries = db.GetQueryNames(catalog)
                     if debug:
                         print('TABLES:', studentTables, '\nQUERIES:', studentQueries)
                     '''--------------------------------------------------------------------------------------
@@ -169,7 +171,7 @@ def setSection(section, tk):
                     for tableName in solnQueryNames:
                         print('ANALYZING:', tableName)
                         scoreVector = [0, 0, 0]
-                        solnTable = db.Table(dbPath, tableName, type='QUERY')
+                        solnTable = solution_registry.Table(dbPath, tableName, type='QUERY')
                         if tableName in goodStudentNames:
                             bestBadTableName = tableName
                             try:
@@ -203,6 +205,7 @@ def setSection(section, tk):
                         DisplayTableScore(scoreVector, cdtRes)
                 except Exception as e:
                     print('Problem', e)
+                db.connection_pool.Close(workPath)
 
             # perc = str(round(grade / total * 3, 2)).rjust(5)
             score = int(round(grade * 100 / total, 0))
@@ -218,58 +221,23 @@ def setSection(section, tk):
             elif (score <= 0):
                 cdtRes.append("0".center(6))
 
-            cdtOutput.append(cdtRes)
-
-    rowNum = 1
-    cdtOutput.sort()
-    for cadet in cdtOutput:
-        colNum = 0
-        for item in cadet:
-            color = 'black'
-            if len(item.strip()) <= 6:
-                # if item.strip() == 'Good' or item.strip() in ['5/5','4/5'] or score>=0.7:
-                if (item.strip() == 'Good') or (item.strip() in ["5/5", "4/5"]):
-                    color = 'dark green'
-                # elif item.strip() == 'Ok' or item.strip() in ['1/5','2/5','3/5'] or (score <0.7 and score>=0.5):
-                elif (item.strip() == 'Ok') or (item.strip() in ["1/5", "2/5", "3/5"]):
-                    color = '#F39C12'  # a dark orange color
-                # elif item.strip() == '--' or item.strip() == '0/5' or score <= 0.5:
-                elif (item.strip() == '--') or (item.strip() in ["0/5"]):
-                    color = 'red'
-                # Have to do this series of elif's since item.strip() is not always a number
-                elif ('%' not in item):
-                    color = 'black'
-                elif (int(item.strip().strip('%')) >= 70):
-                    color = 'dark green'
-                elif (int(item.strip().strip('%')) < 70) and (int(item.strip().strip('%')) >= 50):
-                    color = '#3498DB'  # a light blue color
-                elif (int(item.strip().strip('%')) < 50) and (int(item.strip().strip('%')) > 0):
-                    color = '#F39C12'  # a dark orange color
-                elif (int(item.strip().strip('%')) <= 0):
-                    color = 'red'
-                else:
-                    color = 'black'
-            label = tkinter.Label(newFrame,
-                                  text=item,
-                                  font=("Courier New", 14, "bold"),
-                                  fg=color,
-                                  relief="ridge")
-            label.grid(row=rowNum, column=colNum)
-            colNum += 1
-        rowNum += 1
-
-    label = tkinter.Label(newFrame,
-                          text=str(cdtCount) + " Cadets",
-                          font=("Courier New", 14, "bold"),
-                          relief="ridge")
-    label.grid(row=rowNum + 1, column=0)
-
-    displayFrame.forget()
-    newFrame.pack()
-    for slave in displayFrame.grid_slaves():
-        slave.grid_remove()
-        slave.destroy()
-    displayFrame = newFrame
+            cdtOutput.append((cdtRes, cdt))
+
+    # only the cells that changed since the last refresh are touched
+    cdtOutput.sort(key=lambda output: output[0])
+    diff = gridView.Update([(cdt, cdtRes) for cdtRes, cdt in cdtOutput])
+    for change in diff.Changed:
+        label = gridLabels.get((change.Row, change.Column))
+        if label is None:
+            label = tkinter.Label(displayFrame, font=("Courier New", 14, "bold"), relief="ridge")
+            label.grid(row=change.Row, column=change.Column)
+            gridLabels[(change.Row, change.Column)] = label
+        label.config(text=change.Text, fg=change.Color)
+    for cell in diff.Removed:
+        gridLabels.pop(cell).destroy()
+    countLabel.config(text=str(cdtCount) + " Cadets")
+    countLabel.grid(row=len(gridView) + 2, column=0)
+
     if section == "":
         section = "Instructors"
     tk.title("Section " + section + ": DB HW 5")
@@ -0,0 +1,95 @@
+
+
+# Measures how long it takes a fresh python process (a grading worker, a command-line run) to import the modules.
+#   python bench_importtime.py [--baseline DIR] [--runs N] [module ...]
+# Each module is imported N times in a new process with "python -X importtime"; the report gives the best total
+# import time and the slowest of the module's own imports. With --baseline, the same modules are also timed from
+# another copy of the repository, e.g. an older commit:
+#   git worktree add ../dbutils-old <commit>
+#   python bench_importtime.py --baseline ../dbutils-old
+import argparse
+import os
+import subprocess
+import sys
+
+
+default_modules = ['DAOdbUtils', 'dbUtils', 'dbGrade', 'dbSnapshot', 'ACEdbUtils', 'dbLocalQuery', 'dbSimilarity']
+
+
+# [(depth, imported module, cumulative microseconds)] for one import of module, from the -X importtime lines on
+# stderr, in the order python prints them (a module's own imports come just before it, one level deeper):
+#   import time: self [us] | cumulative | imported package
+def ImportTimes(module, directory, python=sys.executable):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([os.path.abspath(directory)] +
+                                                      [p for p in os.environ.get('PYTHONPATH', '').split(os.pathsep)
+                                                       if p]))
+    result = subprocess.run([python, '-X', 'importtime', '-c', 'import ' + module], cwd=directory, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+    if result.returncode != 0:
+        raise RuntimeError('import {} failed in {}:\n{}'.format(module, directory, result.stderr.strip()[-2000:]))
+    times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        times.append(((len(name) - len(name.lstrip())) // 2, name.strip(), int(cumulative_us)))
+    return times
+
+
+# (total microseconds, [(microseconds, name)] of the modules it imported itself, slowest first)
+def Breakdown(module, times):
+    for i, (depth, name, cumulative_us) in enumerate(times):
+        if depth == 0 and name == module:
+            break
+    else:
+        raise RuntimeError('{} was already imported at start-up'.format(module))
+    direct = []
+    for child_depth, child, child_us in reversed(times[:i]):
+        if child_depth == 0:
+            break
+        if child_depth == 1:
+            direct.append((child_us, child))
+    return cumulative_us, sorted(direct, reverse=True)
+
+
+def Benchmark(module, directory, runs=5):
+    best = None
+    for _ in range(runs):  # the first run may also compile .pyc files
+        total_us, direct = Breakdown(module, ImportTimes(module, directory))
+        if best is None or total_us < best[0]:
+            best = total_us, direct
+    return best
+
+
+def Report(module, total_us, direct, top=5):
+    lines = ['{:<14} {:>8.1f} ms'.format(module, total_us / 1000)]
+    lines += ['    {:<30} {:>8.1f} ms'.format(name, us / 1000) for us, name in direct[:top]]
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time cold imports of the grading modules.')
+    parser.add_argument('modules', nargs='*', default=default_modules)
+    parser.add_argument('--baseline', help='another copy of the repository to compare against')
+    parser.add_argument('--runs', type=int, default=5, help='imports per module; the fastest is reported')
+    args = parser.parse_args(argv)
+    here = os.path.dirname(os.path.abspath(__file__))
+    for module in args.modules:
+        try:
+            total_us, direct = Benchmark(module, here, args.runs)
+        except RuntimeError as e:
+            print(e)
+            continue
+        print('\n'.join(Report(module, total_us, direct)))
+        if args.baseline:
+            try:
+                baseline_us, _ = Benchmark(module, args.baseline, args.runs)
+            except RuntimeError as e:
+                print('    baseline: {}'.format(str(e).splitlines()[0]))
+                continue
+            print('    baseline {:>8.1f} ms  ({:+.1f} ms)'.format(baseline_us / 1000, (total_us - baseline_us) / 1000))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
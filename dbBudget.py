@@ -0,0 +1,55 @@
+
+
+# Limits on how much a single GetRecords call may fetch. A student query with an accidental cartesian join can
+# return millions of rows; the budget stops the fetch part way instead of stalling the whole grading run.
+# Used by DAOdbUtils.Table, dbUtils.Table and the snapshot/ACE backends. Without a budget, GetRecords fetches
+# everything; AssessDatabase (and so dbGrade) grades under grading_budget unless given another.
+import collections
+import sys
+import time
+
+
+# None means no limit for that measure
+FetchBudget = collections.namedtuple('FetchBudget', ['MaxRows', 'MaxSeconds', 'MaxBytes'])
+
+unlimited_budget = FetchBudget(None, None, None)
+default_budget = unlimited_budget
+grading_budget = FetchBudget(MaxRows=100000, MaxSeconds=60, MaxBytes=256 * 1024 * 1024)
+
+
+# Records that can't be fetched for a reason worth reporting rather than an error in the grader
+class RecordsUnavailable(Exception):
+    pass
+
+
+class BudgetExceeded(RecordsUnavailable):
+    def __init__(self, name, limit, allowed, rows):
+        self.Name = name
+        self.Limit = limit  # 'MaxRows', 'MaxSeconds' or 'MaxBytes'
+        self.Allowed = allowed
+        self.Rows = rows  # rows fetched before stopping
+        units = {'MaxRows': 'rows', 'MaxSeconds': 'seconds', 'MaxBytes': 'bytes'}[limit]
+        RecordsUnavailable.__init__(self, '{} exceeded the fetch budget of {} {} (stopped after {} rows)'.format(
+            name, allowed, units, rows))
+
+
+# Counts rows, elapsed time and approximate bytes as records stream in. Call Add() once per fetched record.
+class BudgetMeter:
+    def __init__(self, name, budget=None):
+        self.Name = name
+        self.Budget = default_budget if budget is None else budget
+        self.Rows = 0
+        self.Bytes = 0
+        self._start = time.monotonic()
+
+    def Add(self, record):
+        self.Rows += 1
+        budget = self.Budget
+        if budget.MaxRows is not None and self.Rows > budget.MaxRows:
+            raise BudgetExceeded(self.Name, 'MaxRows', budget.MaxRows, self.Rows - 1)
+        if budget.MaxBytes is not None:
+            self.Bytes += sys.getsizeof(record) + sum(sys.getsizeof(value) for value in record)
+            if self.Bytes > budget.MaxBytes:
+                raise BudgetExceeded(self.Name, 'MaxBytes', budget.MaxBytes, self.Rows - 1)
+        if budget.MaxSeconds is not None and time.monotonic() - self._start > budget.MaxSeconds:
+            raise BudgetExceeded(self.Name, 'MaxSeconds', budget.MaxSeconds, self.Rows - 1)
@@ -0,0 +1,277 @@
+
+
+# Process-wide cache of solution objects. The solution database doesn't change while a class is being graded, so
+# its tables/queries are loaded once, with their records, and reused for every student comparison. An entry is
+# reloaded only when the solution file's size or modification time changes.
+#   registry = dbCache.solution_registry
+#   SolnDB = registry.DataBase(SolnDBPath)                            # DAOdbUtils (or snapshot/ACE) backend
+#   solnTable = registry.Table(SolnDBPath, 'TopSalesFigures', 'QUERY')  # dbUtils (ODBC) backend
+# AssessmentMemo (below) does the same for assessment results, across runs.
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+
+from dbBudget import RecordsUnavailable
+
+
+# (size, modification time) of a file, or None if it can't be read
+def FileFingerprint(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+def _Key(dbPath):
+    return os.path.normcase(os.path.abspath(dbPath))
+
+
+'''-----------------------------------------------------------------------------------------------------------------'''
+'''                                         CLASS: SOLUTIONOBJECT                                                   '''
+''' Wraps a loaded table/query (DAOdbUtils.Table, dbUtils.Table or a snapshot/ACE table) and answers GetRecords and  '''
+''' GetLookupProperties from memory. Every other attribute is read from the wrapped table, so a SolutionObject can   '''
+''' be passed anywhere the table itself could. A failure (e.g. a parameter query that can't be opened) is cached    '''
+''' too and raised again on every call, instead of being retried for every student; RecordsUnavailable (e.g. over   '''
+''' one caller's budget) isn't, so a later caller with a larger budget tries again. With preload=False the records  '''
+''' are fetched by the first GetRecords call (with that call's budget) rather than up front.                        '''
+
+
+class SolutionObject:
+    def __init__(self, table, preload=True):
+        self._table = table
+        self._lock = threading.Lock()
+        self._lookups = {}
+        self._loaded = False
+        self._records = None
+        self._records_error = None
+        self._digest = None
+        if preload:
+            try:
+                self._LoadRecords()
+            except RecordsUnavailable:
+                pass  # tried again by the first GetRecords
+
+    def _LoadRecords(self, budget=None):
+        with self._lock:
+            if self._loaded:
+                return
+            try:
+                self._records = self._table.GetRecords(budget=budget)
+            except RecordsUnavailable:  # e.g. over this caller's budget; a later caller may allow more
+                raise
+            except Exception as e:
+                self._records_error = e
+            self._loaded = True
+
+    def __getattr__(self, name):
+        return getattr(self._table, name)
+
+    def __str__(self):
+        return str(self._table)
+
+    # Records are kept from the first fetch that succeeds; the budgets of later calls are ignored
+    def GetRecords(self, debug=0, budget=None):
+        if not self._loaded:
+            self._LoadRecords(budget)
+        if self._records_error is not None:
+            raise self._records_error
+        if debug > 1:
+            for record in self._records:
+                print(record)
+        return self._records
+
+    # dbCache digest of the records, computed once (the memo asks for it for every comparison)
+    def RecordsDigest(self, budget=None):
+        if self._digest is None:
+            self._digest = _Digest(self.GetRecords(budget=budget))
+        return self._digest
+
+    def GetLookupProperties(self, fieldName, debug=0):
+        with self._lock:
+            if fieldName not in self._lookups:
+                try:
+                    self._lookups[fieldName] = (self._table.GetLookupProperties(fieldName), None)
+                except Exception as e:
+                    self._lookups[fieldName] = (None, e)
+        lookup, error = self._lookups[fieldName]
+        if error is not None:
+            raise error
+        if debug > 1:
+            print(lookup)
+        return lookup
+
+
+'''-----------------------------------------------------------------------------------------------------------------'''
+'''                                         CLASS: SOLUTIONREGISTRY                                                 '''
+
+
+class SolutionRegistry:
+    def __init__(self):
+        self._entries = {}  # key -> (fingerprint, object)
+        self._lock = threading.Lock()
+
+    def _Get(self, key, dbPath, load):
+        fingerprint = FileFingerprint(dbPath)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == fingerprint and fingerprint is not None:
+                return entry[1]
+            obj = load()
+            self._entries[key] = (fingerprint, obj)
+            return obj
+
+    # A DataBase whose Tables and Queries are all SolutionObjects. load defaults to DAOdbUtils.DataBase; pass
+    # dbSnapshot.LoadSnapshot or ACEdbUtils.LoadAccdb to cache another backend.
+    def DataBase(self, dbPath, load=None):
+        if load is None:
+            import DAOdbUtils
+            load = DAOdbUtils.DataBase
+
+        def LoadDataBase():
+            database = load(dbPath)
+            for name in database.TableNames:
+                database.Tables[name] = SolutionObject(database.Tables[name])
+            for name in database.QueryNames:
+                database.Queries[name] = SolutionObject(database.Queries[name])
+            return database
+        return self._Get((_Key(dbPath), None, 'DATABASE'), dbPath, LoadDataBase)
+
+    # A single dbUtils.Table (ODBC backend) with its records cached
+    def Table(self, dbPath, tableName, type='TABLE'):
+        def LoadTable():
+            import dbUtils
+            return SolutionObject(dbUtils.Table(dbPath, tableName, type=type))
+        return self._Get((_Key(dbPath), tableName, type), dbPath, LoadTable)
+
+    def Clear(self, dbPath=None):
+        with self._lock:
+            if dbPath is None:
+                self._entries.clear()
+                return
+            for key in [key for key in self._entries if key[0] == _Key(dbPath)]:
+                del self._entries[key]
+
+
+solution_registry = SolutionRegistry()
+
+
+'''-----------------------------------------------------------------------------------------------------------------'''
+'''                                         CLASS: ASSESSMENTMEMO                                                   '''
+''' Remembers AssessQuery/AssessTables results in a local SQLite file, keyed by content rather than by student: the '''
+''' solution object, the student's SQL (spacing, keyword case and the closing ; aside) or schema, and a digest of   '''
+''' both sets of records when records are compared. Identical submissions are assessed once, in this run or any     '''
+''' later run that uses the same memo file.                                                                         '''
+
+memo_version = 8  # bump when an Assess function changes what it returns, so old results aren't reused
+
+
+def _Digest(*parts):
+    return hashlib.sha256(json.dumps(parts, default=str, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def RecordsDigest(table, budget=None):
+    if isinstance(table, SolutionObject):
+        return table.RecordsDigest(budget)
+    return _Digest(table.GetRecords(budget=budget))
+
+
+def SchemaDigest(table):
+    foreign_keys = table.ForeignKeys or {}
+    relationships = sorted(list(rltn) for related in foreign_keys.values() for rltn in related.values())
+    return _Digest(table.Name, table.RecordCount, table.ColumnCount, [list(column) for column in
+                                                                      table.ColumnMetaData],
+                   list(table.PrimaryKeys), relationships)
+
+
+_sql_token_re = re.compile(r'"(?:[^"]|"")*"|\'(?:[^\']|\'\')*\'|\[[^\]]*\]|#[^#]*#|\w+|\s+|.')
+
+
+# SQL as the memo compares it: spaces, keyword case and the closing ; don't matter. Line breaks and brackets are
+# kept, since AssessQuery takes the SQL apart by line.
+def NormalizedSQL(sql):
+    from dbLocalQuery import keywords
+    lines = []
+    for line in (sql or '').replace('\r', '').split('\n'):
+        tokens = [' ' if token.isspace() else token.upper() if token.upper() in keywords else token
+                  for token in _sql_token_re.findall(line)]
+        if ''.join(tokens).strip():
+            lines.append(''.join(tokens).strip())
+    return '\n'.join(lines).rstrip(';').rstrip()
+
+
+def _ChecksKey(checks):
+    return None if checks is None else sorted(checks)
+
+
+class AssessmentMemo:
+    def __init__(self, memo_path='assessments.sqlite'):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(memo_path, timeout=30, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute('CREATE TABLE IF NOT EXISTS memo (key TEXT PRIMARY KEY, kind TEXT, assessment TEXT, '
+                               'report TEXT)')
+        self.Hits = self.Misses = 0
+
+    def _Get(self, key):
+        with self._lock:
+            row = self._conn.execute('SELECT assessment, report FROM memo WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            self.Misses += 1
+            return None
+        self.Hits += 1
+        return json.loads(row[0]), json.loads(row[1])
+
+    def _Put(self, key, kind, assessment, report):
+        with self._lock, self._conn:
+            self._conn.execute('INSERT OR REPLACE INTO memo VALUES (?, ?, ?, ?)',
+                               (key, kind, json.dumps(list(assessment)), json.dumps(report)))
+
+    def _Settings(self, budget, sampling):
+        import DAOdbUtils as dao
+        return (memo_version, dao.max_misspelled, dao.too_many_penalty, dao.partial_records_credit,
+                dao.diff_sample_size, dao.record_sampling if sampling is None else sampling, budget)
+
+    # Same arguments and results as DAOdbUtils.AssessQuery
+    def AssessQuery(self, query1, query2, compare_records=True, debug=False, budget=None, checks=None,
+                    sampling=None):
+        import DAOdbUtils as dao
+        records = None
+        if compare_records and not dao.QuickSQLCheck(query1.SQL, query2.SQL):  # a SQL match scores without records
+            try:
+                records = (RecordsDigest(query1, budget), RecordsDigest(query2, budget))
+            except Exception:  # records can't be fetched (e.g. over budget); AssessQuery reports why
+                return dao.AssessQuery(query1, query2, compare_records, debug, budget, checks, sampling)
+        key = _Digest('QUERY', self._Settings(budget, sampling), query1.Name, NormalizedSQL(query1.SQL),
+                      NormalizedSQL(query2.SQL), records, _ChecksKey(checks))
+        found = self._Get(key)
+        if found is not None:
+            return dao.QueryScore(*found[0]), found[1]
+        assessment, report = dao.AssessQuery(query1, query2, compare_records, debug, budget, checks, sampling)
+        self._Put(key, 'QUERY', assessment, report)
+        return assessment, report
+
+    # Same arguments and results as DAOdbUtils.AssessTables
+    def AssessTables(self, table1, table2, compare_records=True, budget=None, checks=None, sampling=None):
+        import DAOdbUtils as dao
+        records = None
+        if compare_records and (checks is None or 'RowsScore' in checks):  # don't fetch records that aren't scored
+            try:
+                records = (RecordsDigest(table1, budget), RecordsDigest(table2, budget))
+            except Exception:
+                return dao.AssessTables(table1, table2, compare_records, budget, checks, sampling)
+        key = _Digest('TABLE', self._Settings(budget, sampling), SchemaDigest(table1), SchemaDigest(table2),
+                      compare_records, records, _ChecksKey(checks))
+        found = self._Get(key)
+        if found is not None:
+            return dao.TableScore(*found[0]), found[1]
+        assessment, report = dao.AssessTables(table1, table2, compare_records, budget, checks, sampling)
+        self._Put(key, 'TABLE', assessment, report)
+        return assessment, report
+
+    def Close(self):
+        with self._lock:
+            self._conn.close()
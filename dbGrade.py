@@ -0,0 +1,338 @@
+
+
+# Headless, restartable batch grading.
+#   python dbGrade.py <solution> <rubric.json> <student dbs...> [--workers N] [--csv out.csv] [--jsonl out.jsonl]
+# Student databases are given as paths, glob patterns, or a roster file (.txt/.csv, one path in the first column
+# of each line). Results are appended to the CSV/JSONL outputs as each submission finishes, and recorded in a
+# checkpoint file. Running the same command again skips every submission already graded against the same rubric
+# and solution whose file hasn't changed since, so a crashed end-of-semester run picks up where it stopped.
+#
+# The rubric file is JSON:
+#   {"items": [{"kind": "TABLE", "name": "Platoon", "points": 5, "compare_records": true,
+#               "weights": {"NameScore": 0.05, "FieldNameScore": 0.05, ...}},
+#              {"kind": "QUERY", "name": "APFTStars", "points": 10, "alternatives": ["APFTStarsHaving"]},
+#              {"kind": "LOOKUP", "name": "SoldierCompletesTraining", "field": "soldierTrained", "points": 2}]}
+# Leaving out "weights" uses base_table_weight/base_query_weight/base_lookup_weight; the keyword names are
+# those of AssignTableWeights, AssignQueryWeights and AssignLookupWeights. "alternatives" (optional) names other
+# tables/queries in the solution database that are also correct; the best match counts.
+import DAOdbUtils as dao
+from dbBudget import grading_budget
+from dbCache import AssessmentMemo, FileFingerprint, solution_registry
+# these are built in to python
+import concurrent.futures
+import csv
+import glob
+import hashlib
+import json
+import os
+import sys
+
+
+'''-----------------------------------------------------------------------------------------------------------------'''
+'''                                               INPUTS                                                            '''
+
+
+# Snapshots are read with sqlite3; .accdb files with DAO on Windows (or a stand-in engine, e.g. dbReplay),
+# detached from their COM objects once loaded, otherwise with the pure-python reader
+def OpenDataBase(path, debug=0):
+    import dbSnapshot
+    if dbSnapshot.IsSnapshot(path):
+        return dbSnapshot.LoadSnapshot(path, debug=debug)
+    if dao.DAOAvailable() or dao.engine_factory is not None:
+        return dao.LoadDataBase(path, debug=debug)
+    import ACEdbUtils
+    return ACEdbUtils.LoadAccdb(path, debug=debug)
+
+
+def LoadRubric(rubric_path):
+    with open(rubric_path) as f:
+        rubric = json.load(f)
+    plan = []
+    for entry in rubric['items']:
+        kind = entry['kind'].upper()
+        weights = entry.get('weights')
+        points = entry.get('points', 1)
+        if kind == 'TABLE':
+            plan.append(dao.TableItem(entry['name'], dao.AssignTableWeights(**weights) if weights else
+                                      dao.base_table_weight, entry.get('compare_records', True), points,
+                                      entry.get('alternatives', ())))
+        elif kind == 'QUERY':
+            plan.append(dao.QueryItem(entry['name'], dao.AssignQueryWeights(**weights) if weights else
+                                      dao.base_query_weight, entry.get('compare_records', True), points,
+                                      entry.get('alternatives', ())))
+        elif kind == 'LOOKUP':
+            plan.append(dao.LookupItem(entry['name'], entry['field'], dao.AssignLookupWeights(**weights) if weights
+                                       else dao.base_lookup_weight, points))
+        else:
+            raise ValueError('Unknown rubric item kind: {}'.format(entry['kind']))
+    return plan
+
+
+def ExpandSubmissions(specs):
+    paths = []
+    for spec in specs:
+        if os.path.isfile(spec) and spec.lower().endswith(('.txt', '.csv')):
+            with open(spec, newline='') as f:
+                paths += [row[0].strip() for row in csv.reader(f) if row and row[0].strip()]
+        elif glob.has_magic(spec):
+            paths += sorted(glob.glob(spec))
+        else:
+            paths.append(spec)
+    seen = set()
+    return [path for path in paths if not (path in seen or seen.add(path))]
+
+
+'''-----------------------------------------------------------------------------------------------------------------'''
+'''                                               CHECKPOINT                                                        '''
+''' One JSON line per graded submission: its path, its file fingerprint and the run key (rubric, solution and the   '''
+''' settings that change scores). A submission is skipped on restart only if all three still match. Submissions that'''
+''' couldn't be graded (the file didn't open, the worker died) aren't recorded, so a restart tries them again.      '''
+
+
+def RunKey(solution_path, rubric_path, local_queries=False, sampling=None, budget=None):
+    digest = hashlib.sha1()
+    with open(rubric_path, 'rb') as f:
+        digest.update(f.read())
+    digest.update(json.dumps([os.path.abspath(solution_path), FileFingerprint(solution_path)]).encode('utf-8'))
+    if local_queries:  # query records come from somewhere else, so earlier grades don't carry over
+        digest.update(b'local queries')
+    if sampling is not None:  # sampled comparisons may grade differently from exact ones
+        digest.update(repr(tuple(sampling)).encode('utf-8'))
+    if budget is not None:  # a smaller budget leaves records uncompared
+        digest.update(repr(('budget',) + tuple(budget)).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def ReadCheckpoint(checkpoint_path, run_key):
+    done = {}
+    if not os.path.exists(checkpoint_path):
+        return done
+    with open(checkpoint_path) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:  # a line cut short by a crash
+                continue
+            if entry.get('run') == run_key:
+                done[entry['path']] = entry['fingerprint']
+    return done
+
+
+def _Append(path, line):
+    with open(path, 'a', newline='') as f:
+        f.write(line)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+'''-----------------------------------------------------------------------------------------------------------------'''
+'''                                               GRADING                                                           '''
+
+
+_memos = {}  # memo path -> AssessmentMemo, one per worker process
+_engines = {}  # (solution path, fingerprint) -> dbLocalQuery.LocalEngine, one per worker process
+
+
+def _LocalEngine(solution_path, soln_db):
+    key = (os.path.abspath(solution_path), FileFingerprint(solution_path))
+    if key not in _engines:
+        from dbLocalQuery import LocalEngine
+        _engines.clear()  # the solution file changed
+        _engines[key] = LocalEngine(soln_db)
+    return _engines[key]
+
+
+# Runs in a worker process. The solution is loaded once per process and reused for every submission it grades.
+# With local_queries, query records come from running the SQL on the solution's tables in SQLite (dbLocalQuery).
+# sections is passed on to AssessDatabase (None: assess and report everything, weighted or not). sampling is a
+# DAOdbUtils.RecordSampling to compare large record sets on a sample, or None to compare them in full.
+def GradeSubmission(solution_path, plan, student_path, budget=None, memo_path=None, local_queries=False,
+                    sections=(), sampling=None):
+    fingerprint = FileFingerprint(student_path)
+    row = {'path': student_path, 'fingerprint': fingerprint, 'points': 0,
+           'possible': sum(item.Points for item in plan), 'error': None, 'items': []}
+    try:
+        soln_db = solution_registry.DataBase(solution_path, load=OpenDataBase)
+        student_db = OpenDataBase(student_path)
+    except Exception as e:
+        row['error'] = 'Cannot open DB: {}'.format(e)
+        return row
+    memo = None
+    if memo_path:
+        memo = _memos.get(memo_path) or _memos.setdefault(memo_path, AssessmentMemo(memo_path))
+    engine = _LocalEngine(solution_path, soln_db) if local_queries else None
+    try:
+        result = dao.AssessDatabase(soln_db, student_db, plan, budget=budget, memo=memo, engine=engine,
+                                    sections=sections, sampling=sampling)
+    finally:
+        close = getattr(student_db, 'Close', None)
+        if close is not None:
+            close()
+    row['points'] = result.Points
+    for item_result in result.Items:
+        row['items'].append({'kind': item_result.Item.Kind, 'name': item_result.Item.Name,
+                             'field': item_result.Item.Field, 'student_name': item_result.StudentName,
+                             'points': item_result.Points, 'possible': item_result.Item.Points,
+                             'error': None if item_result.Error is None else str(item_result.Error)})
+    row['report'] = ''.join(result.Report)
+    return row
+
+
+def _ItemLabel(item):
+    return '{}:{}'.format(item.Name, item.Field) if item.Field else item.Name
+
+
+def WriteCSVRow(csv_path, plan, row):
+    write_header = not os.path.exists(csv_path) or os.path.getsize(csv_path) == 0
+    with open(csv_path, 'a', newline='') as f:
+        writer = csv.writer(f)
+        if write_header:
+            writer.writerow(['path', 'points', 'possible', 'error'] + [_ItemLabel(item) for item in plan])
+        writer.writerow([row['path'], round(row['points'], 4), row['possible'], row['error'] or ''] +
+                        [round(item['points'], 4) for item in row['items']])
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _ErrorRow(plan, path, fingerprint, error):
+    return {'path': path, 'fingerprint': fingerprint, 'points': 0, 'possible': sum(item.Points for item in plan),
+            'error': error, 'items': []}
+
+
+# With cache_dir, submissions are first copied to that local directory (dbPrefetch) and graded from there; grading
+# starts on each copy as soon as it arrives, while the rest are still being copied.
+def GradeBatch(solution_path, rubric_path, student_paths, workers=1, csv_path=None, jsonl_path=None,
+               checkpoint_path=None, budget=None, memo_path=None, local_queries=False, cache_dir=None, debug=0,
+               sections=(), sampling=None):
+    plan = LoadRubric(rubric_path)
+    if checkpoint_path is None:
+        checkpoint_path = (jsonl_path or csv_path or 'grades') + '.checkpoint'
+    run_key = RunKey(solution_path, rubric_path, local_queries, sampling, budget)
+    done = ReadCheckpoint(checkpoint_path, run_key)
+    cache = index = None
+    if cache_dir:
+        from dbPrefetch import LocalCache, ScanIndex
+        cache = LocalCache(cache_dir)
+        index = ScanIndex(student_paths)  # one directory listing instead of a stat per file
+    todo = []
+    for path in student_paths:
+        fingerprint = index[path] if index is not None else FileFingerprint(path)
+        if path in done and fingerprint is not None and done[path] == list(fingerprint):
+            if debug:
+                print('Skipping (already graded):', path)
+            continue
+        todo.append(path)
+    if debug:
+        print('{} submissions to grade, {} already graded'.format(len(todo), len(student_paths) - len(todo)))
+
+    def Sources():  # (path, path to grade or None, error)
+        if cache is None:
+            for path in todo:
+                yield path, path, None
+        else:
+            for fetched in cache.Prefetch(todo, index):
+                yield fetched.Path, fetched.LocalPath, fetched.Error
+
+    def Record(row, path):
+        row['path'] = path  # not the local copy's path
+        if csv_path:
+            WriteCSVRow(csv_path, plan, row)
+        if jsonl_path:
+            _Append(jsonl_path, json.dumps(row) + '\n')
+        item_errors = sum(1 for item in row['items'] if item['error'])
+        # failures (often temporary: a locked file, a dead worker, a missing module) are retried on restart
+        if not row['error'] and not item_errors:
+            _Append(checkpoint_path, json.dumps({'path': row['path'], 'fingerprint': row['fingerprint'],
+                                                 'run': run_key}) + '\n')
+        if debug:
+            error = row['error'] or ('{} item(s) failed'.format(item_errors) if item_errors else '')
+            print('{:<60} {:>7.2f} / {}{}'.format(row['path'], row['points'], row['possible'],
+                                                  '  ' + error if error else ''))
+        rows.append(row)
+
+    rows = []
+    if workers <= 1:
+        for path, grade_path, error in Sources():
+            if error is not None:
+                Record(_ErrorRow(plan, path, index[path], error), path)
+            else:
+                Record(GradeSubmission(solution_path, plan, grade_path, budget, memo_path, local_queries, sections,
+                                       sampling), path)
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {}
+
+            def Collect(wait):
+                finished, _ = concurrent.futures.wait(futures, timeout=None if wait else 0,
+                                                      return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in finished:
+                    path = futures.pop(future)
+                    try:
+                        Record(future.result(), path)
+                    except Exception as e:  # the worker process itself died
+                        Record(_ErrorRow(plan, path, FileFingerprint(path) if index is None else index[path],
+                                         'Grading failed: {}'.format(e)), path)
+            for path, grade_path, error in Sources():
+                if error is not None:
+                    Record(_ErrorRow(plan, path, index[path], error), path)
+                    continue
+                futures[executor.submit(GradeSubmission, solution_path, plan, grade_path, budget, memo_path,
+                                        local_queries, sections, sampling)] = path
+                Collect(wait=False)
+            while futures:
+                Collect(wait=True)
+    return rows
+
+
+def main(argv=None):
+    import argparse  # not needed by worker processes
+    parser = argparse.ArgumentParser(description='Grade a batch of student Access databases against a solution.')
+    parser.add_argument('solution', help='solution database (.accdb or dbSnapshot .sqlite)')
+    parser.add_argument('rubric', help='rubric plan (JSON)')
+    parser.add_argument('students', nargs='+', help='student databases: paths, glob patterns or roster files')
+    parser.add_argument('--workers', type=int, default=1, help='number of worker processes (default 1)')
+    parser.add_argument('--csv', dest='csv_path', help='append one row per submission to this CSV file')
+    parser.add_argument('--jsonl', dest='jsonl_path', help='append full results (with reports) to this JSONL file')
+    parser.add_argument('--checkpoint', dest='checkpoint_path',
+                        help='checkpoint file (default: <output>.checkpoint)')
+    parser.add_argument('--max-rows', type=int, help='fetch budget: rows per table/query')
+    parser.add_argument('--max-seconds', type=float, help='fetch budget: seconds per table/query')
+    parser.add_argument('--memo', dest='memo_path',
+                        help='reuse assessments of identical submissions, stored in this SQLite file across runs')
+    parser.add_argument('--local-queries', action='store_true',
+                        help="run query SQL in SQLite on the solution's tables instead of in Access")
+    parser.add_argument('--cache', dest='cache_dir',
+                        help='copy submissions to this local directory first and grade the copies')
+    parser.add_argument('--trace-com', action='store_true',
+                        help='count and time DAO (COM) calls and print a summary at the end (needs --workers 1)')
+    parser.add_argument('--full-report', action='store_true',
+                        help='assess and report every check, including those the rubric gives no weight')
+    parser.add_argument('--sample-records', action='store_true',
+                        help='compare large record sets on a sample of rows (DAOdbUtils.default_sampling)')
+    parser.add_argument('--quiet', action='store_true')
+    args = parser.parse_args(argv)
+    if not args.csv_path and not args.jsonl_path:
+        parser.error('give --csv and/or --jsonl')
+    if args.trace_com and args.workers > 1:
+        parser.error('--trace-com traces this process only; use --workers 1')
+    trace = None
+    if args.trace_com:
+        import dbTrace
+        trace = dbTrace.EnableTracing()
+    budget = None
+    if args.max_rows is not None or args.max_seconds is not None:
+        budget = grading_budget._replace(**{key: value for key, value in (('MaxRows', args.max_rows),
+                                                                   ('MaxSeconds', args.max_seconds))
+                                     if value is not None})
+    GradeBatch(args.solution, args.rubric, ExpandSubmissions(args.students), workers=args.workers,
+               csv_path=args.csv_path, jsonl_path=args.jsonl_path, checkpoint_path=args.checkpoint_path,
+               budget=budget, memo_path=args.memo_path, local_queries=args.local_queries,
+               cache_dir=args.cache_dir, debug=not args.quiet, sections=None if args.full_report else (),
+               sampling=dao.default_sampling if args.sample_records else None)
+    if trace is not None:
+        print(''.join(trace.Report()))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,137 @@
+
+
+# What the grading window (DBHW5_grader.pyw) shows, kept between refreshes without any Tk in it. Each refresh hands
+# GridView the new rows (one per cadet, in display order); it works out each cell's color and returns only the
+# cells that changed since the last refresh, so the window reconfigures a few labels instead of rebuilding the grid.
+#   view = GridView()
+#   diff = view.Update([('smith', ['Smith, J', 'Good', '--', ' 67% ', '  2   ']), ...])
+#   for change in diff.Changed: ...    # (row, column, text, color) to set
+#   for row, column in diff.Removed: ...  # cells that are no longer shown
+#   python dbGridView.py [cadets] [refreshes]   # time refreshes of a made-up section
+import collections
+import sys
+import time
+
+
+CellChange = collections.namedtuple('CellChange', ['Row', 'Column', 'Text', 'Color'])
+GridDiff = collections.namedtuple('GridDiff', ['Changed', 'Removed'])
+
+good_color = 'dark green'
+ok_color = '#F39C12'  # a dark orange color
+pass_color = '#3498DB'  # a light blue color
+bad_color = 'red'
+
+
+# The color a cell's text is shown in: Good/Ok/-- and x/5 marks, then percentages (70% and up is good)
+def CellColor(text):
+    text = text.strip()
+    if len(text) > 6:
+        return 'black'
+    if text == 'Good' or text in ['5/5', '4/5']:
+        return good_color
+    if text == 'Ok' or text in ['1/5', '2/5', '3/5']:
+        return ok_color
+    if text == '--' or text == '0/5':
+        return bad_color
+    if '%' not in text:
+        return 'black'
+    try:
+        percent = int(text.strip('%'))
+    except ValueError:
+        return 'black'
+    if percent >= 70:
+        return good_color
+    if percent >= 50:
+        return pass_color
+    if percent > 0:
+        return ok_color
+    return bad_color
+
+
+'''-----------------------------------------------------------------------------------------------------------------'''
+'''                                               CLASS: GRIDVIEW                                                   '''
+''' Rows are numbered from first_row (the rows above are left to the window, e.g. column headings). Cells are       '''
+''' compared by position, so a cadet who moves down a row changes the cells of the rows in between.                 '''
+
+
+class GridView:
+    def __init__(self, first_row=1):
+        self.FirstRow = first_row
+        self._rows = []  # [(key, [(text, color), ...]), ...] in display order
+        self._index = {}  # key -> row number
+
+    # rows: [(key, [text, ...]), ...], e.g. key a cadet's x-number. Returns what changed since the last Update.
+    def Update(self, rows):
+        changed = []
+        removed = []
+        new_rows = []
+        for position, (key, texts) in enumerate(rows):
+            old_cells = self._rows[position][1] if position < len(self._rows) else []
+            cells = []
+            for column, text in enumerate(texts):
+                if column < len(old_cells) and old_cells[column][0] == text:
+                    cells.append(old_cells[column])
+                    continue
+                cell = (text, CellColor(text))
+                cells.append(cell)
+                changed.append(CellChange(self.FirstRow + position, column, text, cell[1]))
+            removed += [(self.FirstRow + position, column) for column in range(len(texts), len(old_cells))]
+            new_rows.append((key, cells))
+        for position in range(len(rows), len(self._rows)):
+            removed += [(self.FirstRow + position, column) for column in range(len(self._rows[position][1]))]
+        self._rows = new_rows
+        self._index = {key: self.FirstRow + position for position, (key, cells) in enumerate(new_rows)}
+        return GridDiff(changed, removed)
+
+    # The row a key is shown on, or None
+    def RowOf(self, key):
+        return self._index.get(key)
+
+    # [(text, color), ...] of a key's row, or None
+    def Cells(self, key):
+        row = self._index.get(key)
+        return None if row is None else list(self._rows[row - self.FirstRow][1])
+
+    def __len__(self):
+        return len(self._rows)
+
+    def Clear(self):
+        self._rows = []
+        self._index = {}
+
+
+# Made-up rows like DBHW5_grader's: name, file, three marks for each of two queries, percentage and points. One
+# cadet's submission changes each tick.
+def _SampleRows(cadets, tick):
+    marks = ['Good', 'Ok', '--']
+    rows = []
+    for cnt in range(cadets):
+        bump = tick if cnt == tick % cadets else 0
+        cells = ['Cadet{:03d}, A'.format(cnt).ljust(22), 'Good'.center(6)]
+        cells += [marks[(cnt * 7 + bump + column) % 3].center(6) for column in range(6)]
+        score = (cnt * 13 + bump) % 101
+        cells += [('{}%'.format(score)).rjust(5).center(6), str(min(3, score // 25)).center(6)]
+        rows.append(('x{:03d}'.format(cnt), cells))
+    return rows
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    cadets = int(argv[0]) if len(argv) > 0 else 200
+    refreshes = int(argv[1]) if len(argv) > 1 else 50
+    view = GridView()
+    start = time.perf_counter()
+    cells = len(view.Update(_SampleRows(cadets, 0)).Changed)
+    first = time.perf_counter() - start
+    changed = 0
+    start = time.perf_counter()
+    for tick in range(1, refreshes + 1):
+        changed += len(view.Update(_SampleRows(cadets, tick)).Changed)
+    each = (time.perf_counter() - start) / refreshes
+    print('{} cadets, {} cells: first refresh {:.2f} ms, then {:.2f} ms and {:.1f} changed cells per refresh'.format(
+        cadets, cells, first * 1000, each * 1000, changed / refreshes))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,571 @@
+
+
+# Runs Access queries on a local, in-memory SQLite copy of the solution's tables. The solution tables are loaded
+# once; the solution's and each student's QueryDef SQL are translated from Access SQL to SQLite and run against the
+# same data, so query results can be compared quickly, in parallel threads and on any OS.
+#   engine = LocalEngine(SolnDB)
+#   AssessQuery(engine.Query(SolnDB.Queries['APFTStars'], SolnDB),
+#               engine.Query(StudentDB.Queries['APFTStars'], StudentDB))
+# The translation covers [bracketed] and Table!Field names, "strings", #date# literals, Yes/No/True/False,
+# DISTINCTROW, TOP n [PERCENT], &, Mod, Like wildcards, IIf, Nz and the common string, date and conversion
+# functions, and the First/Last/StDev/Var aggregates. Saved queries a query selects from are run as WITH clauses.
+# Anything else (parameter, crosstab and action queries, ^ and \ operators, Like character lists) raises
+# TranslationError, which AssessQuery reports as "Records NOT compared".
+# Dates are stored as Access date serials (days since 12/30/1899) so that date arithmetic such as Now()-[hiredate]
+# gives the same numbers it does in Access; Yes is stored as -1. Text comparisons ignore case, as in Access.
+# Known differences: & yields Null (not "") when an operand is Null, DISTINCTROW is treated as plain SELECT, and
+# TOP ignores ties in the last place.
+from dbBudget import BudgetExceeded, BudgetMeter, RecordsUnavailable, unlimited_budget
+# these are built in to python
+import datetime
+import decimal
+import math
+import re
+import sqlite3
+import threading
+import time
+
+
+class LocalQueryError(RecordsUnavailable):
+    pass
+
+
+# The query uses Access SQL that has no SQLite equivalent here
+class TranslationError(LocalQueryError):
+    pass
+
+
+'''-----------------------------------------------------------------------------------------------------------------'''
+'''                                               DATES                                                             '''
+
+date_epoch = datetime.datetime(1899, 12, 30)
+date_formats = ['%m/%d/%Y', '%m/%d/%Y %H:%M:%S', '%m/%d/%Y %I:%M:%S %p', '%m/%d/%Y %I:%M %p', '%m/%d/%Y %H:%M',
+                '%Y-%m-%d', '%Y-%m-%d %H:%M:%S', '%H:%M:%S', '%I:%M:%S %p', '%I:%M %p']
+
+
+def ToSerial(value):
+    if isinstance(value, datetime.datetime):
+        return (value - date_epoch) / datetime.timedelta(days=1)
+    return (datetime.datetime(value.year, value.month, value.day) - date_epoch).days
+
+
+def FromSerial(serial):
+    return date_epoch + datetime.timedelta(days=serial)
+
+
+def _ParseDate(text):
+    text = text.strip()
+    for date_format in date_formats:
+        try:
+            value = datetime.datetime.strptime(text, date_format)
+        except ValueError:
+            continue
+        if value.year == 1900 and '%Y' not in date_format:  # a time on its own is a time on day 0
+            value = value.replace(year=1899, month=12, day=30)
+        return value
+    return None
+
+
+def _AsDate(value):
+    if value is None or isinstance(value, datetime.datetime):
+        return value
+    if isinstance(value, str):
+        return _ParseDate(value)
+    return FromSerial(value)
+
+
+# DAO/ACE record values -> values stored in SQLite
+def _StoreValue(value):
+    if isinstance(value, bool):
+        return -1 if value else 0
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return ToSerial(value)
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    return value
+
+
+# Declared column types, by ColumnMeta.Type. Records read back from Date/Time and Yes/No columns are converted to
+# datetime and bool, as DAO returns them.
+column_types = {'Yes/No': 'ACCESS_YESNO', 'Autonumber': 'INTEGER', 'LongInteger': 'INTEGER', 'Double': 'REAL',
+                'Date/Time': 'ACCESS_DATETIME', 'ShortText': 'TEXT COLLATE NOCASE', 'LongText': 'TEXT COLLATE NOCASE'}
+sqlite3.register_converter('ACCESS_DATETIME', lambda value: FromSerial(float(value)))
+sqlite3.register_converter('ACCESS_YESNO', lambda value: float(value) != 0)
+
+
+'''-----------------------------------------------------------------------------------------------------------------'''
+'''                                               ACCESS FUNCTIONS                                                  '''
+''' Registered on every connection as access_<name>; the translator renames the Access calls to match.             '''
+
+
+def _Bool(value):
+    return -1 if value else 0
+
+
+def _Text(value):
+    if value is None:
+        return None
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def _IIf(condition, true_part, false_part):
+    return true_part if condition else false_part
+
+
+def _Nz(value, value_if_null=''):
+    return value_if_null if value is None else value
+
+
+def _Mid(text, start, length=None):
+    if text is None:
+        return None
+    text = _Text(text)
+    return text[int(start) - 1:] if length is None else text[int(start) - 1:int(start) - 1 + int(length)]
+
+
+def _InStr(*args):
+    start, text, find = (1,) + args if len(args) == 2 else args[:3]
+    if text is None or find is None:
+        return None
+    return _Text(text).lower().find(_Text(find).lower(), int(start) - 1) + 1
+
+
+def _Val(text):
+    match = re.match(r'\s*[-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?', _Text(text) or '')
+    if match is None:
+        return 0
+    number = float(match.group(0))
+    return int(number) if number.is_integer() else number
+
+
+def _Round(value, digits=0):
+    return None if value is None else round(value, int(digits))
+
+
+def _DatePart(part):
+    def Part(value):
+        value = _AsDate(value)
+        return None if value is None else part(value)
+    return Part
+
+
+def _DateSerial(year, month, day):
+    return ToSerial(_MonthsLater(datetime.datetime(int(year), 1, 1), int(month) - 1)) + int(day) - 1
+
+
+def _MonthsLater(value, months):
+    month = value.month - 1 + months
+    year = value.year + month // 12
+    month = month % 12 + 1
+    last_day = (datetime.datetime(year + month // 12, month % 12 + 1, 1) - datetime.timedelta(days=1)).day
+    return value.replace(year=year, month=month, day=min(value.day, last_day))
+
+
+interval_days = {'d': 1, 'y': 1, 'w': 1, 'ww': 7, 'h': 1 / 24, 'n': 1 / 1440, 's': 1 / 86400}
+interval_months = {'yyyy': 12, 'q': 3, 'm': 1}
+
+
+def _DateAdd(interval, number, value):
+    value = _AsDate(value)
+    if value is None or number is None:
+        return None
+    interval = interval.lower()
+    if interval in interval_months:
+        return ToSerial(_MonthsLater(value, int(number) * interval_months[interval]))
+    return ToSerial(value) + number * interval_days[interval]
+
+
+def _DateDiff(interval, value1, value2):
+    value1, value2 = _AsDate(value1), _AsDate(value2)
+    if value1 is None or value2 is None:
+        return None
+    interval = interval.lower()
+    # Access counts the boundaries crossed, e.g. 12/31/2017 to 1/1/2018 is one year and one day
+    if interval in interval_months:
+        per_year = 12 // interval_months[interval]
+        return (value2.year * per_year + (value2.month - 1) // interval_months[interval]) - \
+            (value1.year * per_year + (value1.month - 1) // interval_months[interval])
+    return math.floor(ToSerial(value2) / interval_days[interval] + 1e-9) - \
+        math.floor(ToSerial(value1) / interval_days[interval] + 1e-9)
+
+
+def _Convert(convert):
+    def Convert(value):
+        return None if value is None else convert(value)
+    return Convert
+
+
+functions = {'iif': (3, _IIf), 'nz': (-1, _Nz), 'isnull': (1, lambda value: _Bool(value is None)),
+             'left': (2, lambda text, n: None if text is None else _Text(text)[:int(n)]),
+             'right': (2, lambda text, n: None if text is None else _Text(text)[len(_Text(text)) - int(n):]),
+             'mid': (-1, _Mid), 'len': (1, lambda text: None if text is None else len(_Text(text))),
+             'ucase': (1, _Convert(lambda text: _Text(text).upper())),
+             'lcase': (1, _Convert(lambda text: _Text(text).lower())),
+             'trim': (1, _Convert(lambda text: _Text(text).strip(' '))),
+             'ltrim': (1, _Convert(lambda text: _Text(text).lstrip(' '))),
+             'rtrim': (1, _Convert(lambda text: _Text(text).rstrip(' '))),
+             'instr': (-1, _InStr), 'val': (1, _Val), 'cstr': (1, _Convert(_Text)),
+             'cint': (1, _Convert(lambda value: round(float(value)))),
+             'clng': (1, _Convert(lambda value: round(float(value)))),
+             'cdbl': (1, _Convert(float)), 'cdate': (1, _Convert(lambda value: ToSerial(_AsDate(value)))),
+             'int': (1, _Convert(math.floor)), 'fix': (1, _Convert(math.trunc)), 'round': (-1, _Round),
+             'year': (1, _DatePart(lambda value: value.year)), 'month': (1, _DatePart(lambda value: value.month)),
+             'day': (1, _DatePart(lambda value: value.day)), 'hour': (1, _DatePart(lambda value: value.hour)),
+             'minute': (1, _DatePart(lambda value: value.minute)),
+             'second': (1, _DatePart(lambda value: value.second)),
+             'weekday': (1, _DatePart(lambda value: (value.weekday() + 1) % 7 + 1)),
+             'dateserial': (3, _DateSerial), 'dateadd': (3, _DateAdd), 'datediff': (3, _DateDiff)}
+clock_functions = ['now', 'date']  # fixed per engine, so every query sees the same "now"
+
+
+class _First:
+    def __init__(self):
+        self.value, self.seen = None, False
+
+    def step(self, value):
+        if not self.seen:
+            self.value, self.seen = value, True
+
+    def finalize(self):
+        return self.value
+
+
+class _Last(_First):
+    def step(self, value):
+        self.value = value
+
+
+class _Variance:
+    population = False
+
+    def __init__(self):
+        self.values = []
+
+    def step(self, value):
+        if value is not None:
+            self.values.append(value)
+
+    def finalize(self):
+        count = len(self.values) - (0 if self.population else 1)
+        if count <= 0:
+            return None
+        mean = sum(self.values) / len(self.values)
+        return self.Result(sum((value - mean) ** 2 for value in self.values) / count)
+
+    def Result(self, variance):
+        return variance
+
+
+class _VarP(_Variance):
+    population = True
+
+
+class _StDev(_Variance):
+    def Result(self, variance):
+        return math.sqrt(variance)
+
+
+class _StDevP(_StDev):
+    population = True
+
+
+aggregates = {'first': _First, 'last': _Last, 'var': _Variance, 'varp': _VarP, 'stdev': _StDev, 'stdevp': _StDevP}
+
+
+access_functions = set(functions) | set(aggregates) | set(clock_functions)
+
+
+def _RegisterFunctions(conn, now):
+    for name, (num_args, function) in functions.items():
+        conn.create_function('access_' + name, num_args, function, deterministic=True)
+    conn.create_function('access_now', 0, lambda: now)
+    conn.create_function('access_date', 0, lambda: math.floor(now))
+    for name, aggregate in aggregates.items():
+        conn.create_aggregate('access_' + name, 1, aggregate)
+
+
+'''-----------------------------------------------------------------------------------------------------------------'''
+'''                                               TRANSLATION                                                       '''
+
+token_pattern = re.compile(r'''(?P<space>\s+)|(?P<bracket>\[[^\]]*\])|(?P<string>"(?:[^"]|"")*"|'(?:[^']|'')*')|
+                               (?P<date>\#[^\#]*\#)|(?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)|
+                               (?P<word>[A-Za-z_][A-Za-z0-9_]*)|(?P<op><>|<=|>=|[-+*/\\&=<>(),.;!^])''', re.VERBOSE)
+keywords = {'SELECT', 'DISTINCT', 'ALL', 'FROM', 'WHERE', 'GROUP', 'BY', 'HAVING', 'ORDER', 'ASC', 'DESC', 'AND',
+            'OR', 'NOT', 'IS', 'NULL', 'LIKE', 'BETWEEN', 'IN', 'AS', 'INNER', 'LEFT', 'RIGHT', 'FULL', 'OUTER',
+            'JOIN', 'ON', 'UNION', 'EXISTS', 'ANY', 'SOME', 'COUNT', 'SUM', 'AVG', 'MIN', 'MAX'}
+literals = {'YES': '-1', 'TRUE': '-1', 'NO': '0', 'FALSE': '0'}
+unsupported = {'PARAMETERS': 'parameter queries', 'TRANSFORM': 'crosstab queries', 'PIVOT': 'crosstab queries',
+               'INSERT': 'append queries', 'UPDATE': 'update queries', 'DELETE': 'delete queries',
+               'INTO': 'make-table queries', 'XOR': 'the Xor operator', 'EQV': 'the Eqv operator',
+               'IMP': 'the Imp operator', '^': 'the ^ operator', '\\': 'the \\ operator'}
+
+
+def _Tokens(sql):
+    tokens = []
+    position = 0
+    while position < len(sql):
+        match = token_pattern.match(sql, position)
+        if match is None:
+            raise TranslationError('Cannot translate {!r}'.format(sql[position:position + 20]))
+        tokens.append((match.lastgroup, match.group()))
+        position = match.end()
+    return tokens
+
+
+def QuoteName(name):
+    return '[{}]'.format(name)
+
+
+def _String(text):
+    quote = text[0]
+    return "'{}'".format(text[1:-1].replace(quote * 2, quote).replace("'", "''"))
+
+
+# An Access Like pattern (a string literal) -> SQLite LIKE pattern and optional ESCAPE clause
+def _LikePattern(text):
+    pattern = text[1:-1].replace(text[0] * 2, text[0])
+    if '[' in pattern or '#' in pattern:
+        raise TranslationError('Cannot translate Like pattern {} (character lists and # are not supported)'.format(
+            text))
+    escaped = pattern.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    translated = "'{}'".format(escaped.replace('*', '%').replace('?', '_').replace("'", "''"))
+    return translated + (" ESCAPE '\\'" if escaped != pattern else '')
+
+
+# One Access statement -> (SQLite statement, names it selects from or qualifies fields with)
+def TranslateStatement(sql):
+    tokens = [token for token in _Tokens(sql.strip())]
+    while tokens and tokens[-1][0] == 'space':
+        tokens.pop()
+    if tokens and tokens[-1] == ('op', ';'):
+        tokens.pop()
+    out = []
+    names = set()
+    depth = 0
+    selects = 0
+    limit = None
+    i = 0
+
+    def Next(j):  # index of the next non-space token
+        while j < len(tokens) and tokens[j][0] == 'space':
+            j += 1
+        return j
+
+    def Peek(j):  # text of the next non-space token
+        j = Next(j)
+        return tokens[j][1] if j < len(tokens) else ''
+
+    while i < len(tokens):
+        kind, text = tokens[i]
+        upper = text.upper()
+        if upper in unsupported and kind in ('word', 'op'):
+            raise TranslationError('Cannot run {} locally'.format(unsupported[upper]))
+        if kind == 'space':
+            out.append(' ' if '\n' in text or '\r' in text else text)
+        elif kind == 'bracket':
+            name = text[1:-1]
+            parts = name.split('.')  # [Table.Field] is accepted by Access
+            names.add(parts[0])
+            out.append('.'.join(QuoteName(part) for part in parts))
+        elif kind == 'string':  # compared without case, like Access, even against a computed value
+            out.append(_String(text) + ' COLLATE NOCASE')
+        elif kind == 'date':
+            value = _ParseDate(text[1:-1])
+            if value is None:
+                raise TranslationError('Cannot translate date {}'.format(text))
+            out.append(repr(ToSerial(value)))
+        elif kind == 'number':
+            out.append(text)
+        elif kind == 'op':
+            if text == '(':
+                depth += 1
+            elif text == ')':
+                depth -= 1
+            elif text == ';':
+                raise TranslationError('Cannot run more than one statement')
+            # Access always divides as reals (7/2 is 3.5); SQLite divides integers as integers. "* 1.0" binds as
+            # tightly as "/", so a/b becomes (a * 1.0) / b without changing what else it is evaluated with
+            out.append({'&': '||', '!': '.', '/': ' * 1.0 /'}.get(text, text))
+        elif upper == 'SELECT':
+            selects += 1
+            out.append(upper)
+            j = Next(i + 1)
+            if j < len(tokens) and tokens[j][1].upper() in ('DISTINCTROW', 'DISTINCT', 'ALL'):
+                if tokens[j][1].upper() != 'DISTINCTROW':
+                    out += [' ', tokens[j][1].upper()]
+                j = Next(j + 1)
+            if j < len(tokens) and tokens[j][1].upper() == 'TOP':
+                if depth > 0 or selects > 1:
+                    raise TranslationError('Cannot translate TOP outside the main SELECT')
+                k = Next(j + 1)
+                if k >= len(tokens) or tokens[k][0] != 'number':
+                    raise TranslationError('Cannot translate TOP without a number')
+                limit = [tokens[k][1], False]
+                j = Next(k + 1)
+                if j < len(tokens) and tokens[j][1].upper() == 'PERCENT':
+                    limit[1] = True
+                    j = Next(j + 1)
+            out.append(' ')
+            i = j
+            continue
+        elif upper == 'LIKE':
+            out.append(upper)
+            j = Next(i + 1)
+            if j >= len(tokens) or tokens[j][0] != 'string':
+                raise TranslationError('Cannot translate Like with a pattern that is not a literal string')
+            out += [' ', _LikePattern(tokens[j][1])]
+            i = j + 1
+            continue
+        elif text.lower() in access_functions and Peek(i + 1) == '(':  # Left( isn't LEFT JOIN
+            out.append('access_' + text.lower())
+        elif upper == 'MOD':
+            out.append('%')
+        elif upper in literals:
+            out.append(literals[upper])
+        elif upper in keywords:
+            out.append(upper)
+        elif Peek(i + 1) == '(':  # a function SQLite has too, e.g. Abs or Count
+            out.append(text)
+        else:
+            names.add(text)
+            out.append(QuoteName(text))
+        i += 1
+    statement = ''.join(out).strip()
+    if limit is not None:
+        number, percent = limit
+        if percent:
+            statement += ' LIMIT (SELECT -CAST(-(COUNT(*) * {}) / 100.0 AS INTEGER) FROM ({}))'.format(
+                number, statement)
+        else:
+            statement += ' LIMIT {}'.format(number)
+    return statement, names
+
+
+'''-----------------------------------------------------------------------------------------------------------------'''
+'''                                               CLASS: LOCALENGINE                                                '''
+''' Holds the solution's tables in memory. Each thread runs queries on its own copy of the master connection.       '''
+
+
+class LocalEngine:
+    ThreadSafe = True
+
+    def __init__(self, database, debug=0):
+        self.Source = getattr(database, 'Source', None)
+        self._database = database
+        self._solution_queries = None
+        self.TableNames = list(database.TableNames)
+        self.Now = ToSerial(datetime.datetime.now())
+        self._names = {name.lower() for name in self.TableNames}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._master = self._Open()
+        with self._master:
+            for name in self.TableNames:
+                table = database.Tables[name]
+                columns = ', '.join('{} {}'.format(QuoteName(column.Name), column_types.get(column.Type, ''))
+                                    for column in table.ColumnMetaData)
+                self._master.execute('CREATE TABLE {} ({})'.format(QuoteName(name), columns))
+                records = table.GetRecords(budget=unlimited_budget)
+                if debug:
+                    print('Loaded {} records of {}'.format(len(records), name))
+                self._master.executemany('INSERT INTO {} VALUES ({})'.format(
+                    QuoteName(name), ', '.join('?' * table.ColumnCount)),
+                    ([_StoreValue(value) for value in record] for record in records))
+
+    def _Open(self):
+        conn = sqlite3.connect(':memory:', detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False)
+        _RegisterFunctions(conn, self.Now)
+        return conn
+
+    def _Connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._Open()
+            with self._lock:
+                self._master.backup(conn)
+            self._local.conn = conn
+        return conn
+
+    # The SQLite statement for an Access statement. Saved queries of database that it selects from (directly or
+    # through other saved queries) become WITH clauses.
+    def Translate(self, sql, database=None):
+        statement, names = TranslateStatement(sql)
+        saved = {}
+        if database is not None:
+            saved = {name.lower(): name for name in database.QueryNames if name.lower() not in self._names}
+        order = []
+        done = set()
+
+        def Visit(names, path):
+            for name in sorted(names, key=str.lower):
+                query_name = saved.get(name.lower())
+                if query_name is None or query_name in done:
+                    continue
+                if query_name in path:
+                    raise TranslationError('Saved query {} refers to itself'.format(query_name))
+                body, body_names = TranslateStatement(database.Queries[query_name].SQL)
+                Visit(body_names, path + [query_name])
+                done.add(query_name)
+                order.append('{} AS ({})'.format(QuoteName(query_name), body))
+        Visit(names, [])
+        if order:
+            statement = 'WITH {} {}'.format(', '.join(order), statement)
+        return statement
+
+    # Records of an Access statement, as lists, fetched under the budget like any GetRecords
+    def Run(self, sql, database=None, name='query', budget=None):
+        statement = self.Translate(sql, database)
+        conn = self._Connection()
+        meter = BudgetMeter(name, budget)
+        max_seconds = meter.Budget.MaxSeconds
+        if max_seconds is not None:
+            deadline = time.monotonic() + max_seconds
+            conn.set_progress_handler(lambda: time.monotonic() > deadline, 10000)
+        records = []
+        try:
+            for record in conn.execute(statement):
+                meter.Add(record)
+                records.append(list(record))
+        except sqlite3.Error as e:
+            if max_seconds is not None and time.monotonic() > deadline:
+                raise BudgetExceeded(name, 'MaxSeconds', max_seconds, meter.Rows)
+            raise LocalQueryError('{} could not be run locally: {}'.format(name, e))
+        finally:
+            conn.set_progress_handler(None, 0)
+        return records
+
+    # A stand-in for query (from database) whose GetRecords runs on this engine
+    def Query(self, query, database):
+        return LocalQuery(self, query, database)
+
+    # The solution's own queries (database is the one the engine was loaded from) are run once and their records kept
+    def Queries(self, database):
+        if database is self._database:
+            if self._solution_queries is None:
+                from dbCache import SolutionObject
+                self._solution_queries = {name: SolutionObject(self.Query(database.Queries[name], database),
+                                                               preload=False) for name in database.QueryNames}
+            return dict(self._solution_queries)
+        return {name: self.Query(database.Queries[name], database) for name in database.QueryNames}
+
+
+class LocalQuery:
+    def __init__(self, engine, query, database):
+        self._engine = engine
+        self._query = query
+        self._database = database
+
+    def __getattr__(self, name):
+        return getattr(self._query, name)
+
+    def __str__(self):
+        return str(self._query)
+
+    def GetRecords(self, debug=0, budget=None):
+        records = self._engine.Run(self._query.SQL, self._database, self._query.Name, budget)
+        if debug > 1:
+            for record in records:
+                print(record)
+        return records
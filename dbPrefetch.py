@@ -0,0 +1,202 @@
+
+
+# Copies student databases from the network share to a local cache before they are graded. Opening an .accdb over
+# SMB pays network latency on every page read, and an unreachable share stalls the grading loop; instead the roster's
+# directories are listed once (one os.scandir per directory, with a time limit), changed submissions are copied by a
+# few threads and verified by size and hash, and each local copy is handed to grading as soon as it arrives.
+#   cache = LocalCache(r'C:\grading\cache')
+#   for fetched in cache.Prefetch(student_paths):
+#       grade(fetched.LocalPath) if fetched.Error is None else report(fetched.Path, fetched.Error)
+# Unchanged submissions (same size and modification time as when last copied) are not copied again.
+#   python dbPrefetch.py <cache dir> <student dbs...>
+import argparse
+import collections
+import concurrent.futures
+import hashlib
+import json
+import os
+import shutil
+import sys
+import threading
+
+
+chunk_size = 1024 * 1024
+manifest_name = 'manifest.jsonl'
+
+# LocalPath is None when the submission couldn't be copied; Error says why
+Fetched = collections.namedtuple('Fetched', ['Path', 'LocalPath', 'Fingerprint', 'Error'])
+
+
+class PrefetchError(Exception):
+    pass
+
+
+'''-----------------------------------------------------------------------------------------------------------------'''
+'''                                               INDEX                                                             '''
+
+
+def _ScanDirectory(directory):
+    with os.scandir(directory) as entries:
+        return {os.path.normcase(entry.name): entry.stat() for entry in entries if entry.is_file()}
+
+
+# path -> (size, modification time) for every path, or None if it doesn't exist or its directory can't be listed
+# within timeout seconds. Each directory is listed once, however many paths it holds.
+def ScanIndex(paths, workers=8, timeout=30):
+    by_directory = collections.defaultdict(list)
+    for path in paths:
+        by_directory[os.path.dirname(os.path.abspath(path))].append(path)
+    index = dict.fromkeys(paths)
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+    futures = {executor.submit(_ScanDirectory, directory): directory for directory in by_directory}
+    done, not_done = concurrent.futures.wait(futures, timeout=timeout)
+    executor.shutdown(wait=False)  # don't wait on a share that doesn't answer
+    for future in done:
+        try:
+            listing = future.result()
+        except OSError:
+            continue
+        for path in by_directory[futures[future]]:
+            stat = listing.get(os.path.normcase(os.path.basename(path)))
+            if stat is not None:
+                index[path] = (stat.st_size, stat.st_mtime_ns)
+    return index
+
+
+'''-----------------------------------------------------------------------------------------------------------------'''
+'''                                               CLASS: LOCALCACHE                                                 '''
+''' One local file per submission, named after a hash of its full path so that every cadet's "hw5.accdb" gets its    '''
+''' own copy. The manifest (one JSON line per copy, the last line for a path wins) records the source fingerprint    '''
+''' and the SHA-256 of each copy. Copies keep the source's modification time.                                       '''
+
+
+class LocalCache:
+    def __init__(self, cache_dir, workers=4, timeout=30):
+        self.CacheDir = cache_dir
+        self.Workers = workers
+        self.Timeout = timeout
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self._manifest_path = os.path.join(cache_dir, manifest_name)
+        self._manifest = {}
+        if os.path.exists(self._manifest_path):
+            with open(self._manifest_path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:  # a line cut short by a crash
+                        continue
+                    self._manifest[entry['key']] = entry
+
+    def _Key(self, path):
+        return os.path.normcase(os.path.abspath(path))
+
+    def LocalPath(self, path):
+        key = self._Key(path)
+        return os.path.join(self.CacheDir, '{}-{}'.format(hashlib.sha1(key.encode('utf-8')).hexdigest()[:12],
+                                                          os.path.basename(path)))
+
+    # The local copy, if it is of the file as it is now (fingerprint) and intact
+    def Cached(self, path, fingerprint):
+        entry = self._manifest.get(self._Key(path))
+        local_path = self.LocalPath(path)
+        if entry is None or fingerprint is None or entry['fingerprint'] != list(fingerprint):
+            return None
+        try:
+            if os.path.getsize(local_path) != fingerprint[0] or _FileHash(local_path) != entry['sha256']:
+                return None
+        except OSError:
+            return None
+        return local_path
+
+    # Copies path into the cache and returns the local path. The copy is hashed as it is read and again once written;
+    # a source that changes while it is copied (a cadet still saving) is copied again.
+    def Copy(self, path, fingerprint=None, attempts=3):
+        local_path = self.LocalPath(path)
+        for attempt in range(attempts):
+            if fingerprint is None:
+                stat = os.stat(path)
+                fingerprint = (stat.st_size, stat.st_mtime_ns)
+            temp_path = '{}.{}.part'.format(local_path, threading.get_ident())
+            digest = hashlib.sha256()
+            size = 0
+            try:
+                with open(path, 'rb') as source, open(temp_path, 'wb') as target:
+                    for chunk in iter(lambda: source.read(chunk_size), b''):
+                        digest.update(chunk)
+                        target.write(chunk)
+                        size += len(chunk)
+                stat = os.stat(path)
+                if (stat.st_size, stat.st_mtime_ns) != tuple(fingerprint) or size != fingerprint[0]:
+                    fingerprint = None  # changed while copying; try again with the new fingerprint
+                    continue
+                if os.path.getsize(temp_path) != size or _FileHash(temp_path) != digest.hexdigest():
+                    raise PrefetchError('Copy of {} does not match the original'.format(path))
+                os.utime(temp_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+                os.replace(temp_path, local_path)
+            finally:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+            entry = {'key': self._Key(path), 'path': path, 'fingerprint': list(fingerprint),
+                     'sha256': digest.hexdigest()}
+            with self._lock:
+                self._manifest[entry['key']] = entry
+                with open(self._manifest_path, 'a') as f:
+                    f.write(json.dumps(entry) + '\n')
+            return local_path
+        raise PrefetchError('{} kept changing while it was copied'.format(path))
+
+    def _Fetch(self, path, fingerprint):
+        try:
+            local_path = self.Cached(path, fingerprint) or self.Copy(path, fingerprint)
+        except (OSError, PrefetchError) as e:
+            return Fetched(path, None, fingerprint, 'Cannot copy DB: {}'.format(e))
+        return Fetched(path, local_path, fingerprint, None)
+
+    # Yields a Fetched for every path, in the order the copies finish. index is a ScanIndex of the paths; it is built
+    # here if not given. Missing files are reported without touching the network again.
+    def Prefetch(self, paths, index=None):
+        if index is None:
+            index = ScanIndex(paths, timeout=self.Timeout)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.Workers) as executor:
+            futures = []
+            for path in paths:
+                if index.get(path) is None:
+                    yield Fetched(path, None, None, 'Cannot open DB: {} not found'.format(path))
+                else:
+                    futures.append(executor.submit(self._Fetch, path, index[path]))
+            for future in concurrent.futures.as_completed(futures):
+                yield future.result()
+
+    def Clear(self):
+        with self._lock:
+            shutil.rmtree(self.CacheDir, ignore_errors=True)
+            os.makedirs(self.CacheDir, exist_ok=True)
+            self._manifest = {}
+
+
+def _FileHash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def main(argv=None):
+    from dbGrade import ExpandSubmissions
+    parser = argparse.ArgumentParser(description='Copy student databases to a local cache.')
+    parser.add_argument('cache', help='local cache directory')
+    parser.add_argument('students', nargs='+', help='student databases: paths, glob patterns or roster files')
+    parser.add_argument('--threads', type=int, default=4, help='concurrent copies (default 4)')
+    args = parser.parse_args(argv)
+    cache = LocalCache(args.cache, workers=args.threads)
+    failed = 0
+    for fetched in cache.Prefetch(ExpandSubmissions(args.students)):
+        print('{:<60} {}'.format(fetched.Path, fetched.Error or fetched.LocalPath))
+        failed += fetched.Error is not None
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
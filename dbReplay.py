@@ -0,0 +1,329 @@
+
+
+# Records every DAO interaction of a grading run in a small file, and plays the file back in place of DAO, so that
+# DAOdbUtils (loading a DataBase, fetching records, reading lookups, AssessDatabase) runs without Windows or the
+# Access engine, e.g. to benchmark or regression-test it on Linux.
+#   with Recording('hw5.replay.gz'):                 # on Windows, with the .accdb files
+#       SolnDB = DataBase(SolnDBPath)
+#       ...
+#   with Replaying('hw5.replay.gz'):                 # anywhere; the same paths and calls get the same answers
+#       SolnDB = DataBase(SolnDBPath)
+#   python dbReplay.py record <session> <solution> <rubric.json> <student dbs...>
+#   python dbReplay.py replay <session> <solution> <rubric.json> <student dbs...> [--runs N]
+#
+# An object is identified by the accesses that led to it from the engine, e.g.
+# "DBEngine.Workspaces(0).OpenDatabase('C:\\hw5.accdb').TableDefs('Platoon').Fields[2]". For each object and
+# access (".Name", "('Platoon')", "[]" for an iteration) the file keeps the answers in the order they were given, so a
+# Recordset's EOF and GetRows step through the rows again. Each object returned by an Open... call (OpenDatabase,
+# OpenRecordset) keeps its own place in the lists of everything reached from it, so a recordset that is opened twice
+# replays from the start both times; reading past the end of a list repeats its last answer.
+import base64
+import collections
+import datetime
+import decimal
+import gzip
+import json
+import sys
+import threading
+import time
+
+
+replay_version = 1
+
+# Results of these types are values, recorded as they are; anything else is a COM object and is recorded by path
+plain_types = (str, bytes, int, float, bool, type(None), datetime.datetime, datetime.date, decimal.Decimal, tuple,
+               list)
+
+
+class ReplayError(Exception):
+    pass
+
+
+# Raised on replay where the recorded call raised (e.g. reading a property a field doesn't have)
+class RecordedComError(Exception):
+    pass
+
+
+def _Encode(value):
+    if isinstance(value, bool) or value is None or isinstance(value, (int, float, str)):
+        return value
+    if isinstance(value, datetime.datetime):
+        return {'$dt': value.replace(tzinfo=None).isoformat()}
+    if isinstance(value, datetime.date):
+        return {'$d': value.isoformat()}
+    if isinstance(value, decimal.Decimal):
+        return {'$n': str(value)}
+    if isinstance(value, bytes):
+        return {'$b': base64.b64encode(value).decode('ascii')}
+    if isinstance(value, tuple):
+        return {'$t': [_Encode(item) for item in value]}
+    if isinstance(value, list):
+        return [_Encode(item) for item in value]
+    raise TypeError('cannot record a {}'.format(type(value).__name__))
+
+
+def _Decode(value):
+    if isinstance(value, list):
+        return [_Decode(item) for item in value]
+    if not isinstance(value, dict):
+        return value
+    if '$t' in value:
+        return tuple(_Decode(item) for item in value['$t'])
+    if '$dt' in value:
+        return datetime.datetime.fromisoformat(value['$dt'])
+    if '$d' in value:
+        return datetime.date.fromisoformat(value['$d'])
+    if '$n' in value:
+        return decimal.Decimal(value['$n'])
+    if '$b' in value:
+        return base64.b64decode(value['$b'])
+    return value
+
+
+# True if calling the object at path opens something new (a database, a recordset), with answers of its own
+def _Opens(path):
+    return path.rsplit('.', 1)[-1].startswith('Open')
+
+
+# "(0, 'x')": the key of a call; a recorded/replayed object passed as an argument is given by its path
+def _ArgsKey(args, kwargs):
+    parts = [arg._path if isinstance(arg, (RecordingProxy, ReplayObject)) else repr(arg) for arg in args]
+    parts += ['{}={!r}'.format(key, kwargs[key]) for key in sorted(kwargs)]
+    return '({})'.format(', '.join(parts))
+
+
+'''-----------------------------------------------------------------------------------------------------------------'''
+'''                                               CLASS: SESSION                                                    '''
+''' path -> access -> [answer, ...]. An answer is an encoded value, {"$o": 1} for a COM object (found at            '''
+''' path+access) or {"$e": [type, message]} for an exception. Saved as gzipped JSON, runs of equal answers collapsed.'''
+
+_object = {'$o': 1}
+
+
+class Session:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = collections.defaultdict(dict)
+
+    # Answers from another object at the same path are merged by position; the first answer at a position is kept
+    def Add(self, path, access, position, answer):
+        with self._lock:
+            answers = self._entries[path].setdefault(access, [])
+            if position == len(answers):
+                answers.append(answer)
+
+    def Answers(self, path, access):
+        return self._entries.get(path, {}).get(access)
+
+    def __len__(self):
+        return sum(len(accesses) for accesses in self._entries.values())
+
+    def Save(self, path):
+        entries = {}
+        with self._lock:
+            for object_path, accesses in self._entries.items():
+                entries[object_path] = {}
+                for access, answers in accesses.items():
+                    runs = []
+                    for answer in answers:
+                        if runs and runs[-1][0] == answer:
+                            runs[-1][1] += 1
+                        else:
+                            runs.append([answer, 1])
+                    entries[object_path][access] = runs
+        with gzip.open(path, 'wt', encoding='utf-8') as f:
+            json.dump({'version': replay_version, 'entries': entries}, f, separators=(',', ':'))
+
+    @classmethod
+    def Load(cls, path):
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get('version') != replay_version:
+            raise ReplayError('{} was recorded by another version of dbReplay'.format(path))
+        session = cls()
+        for object_path, accesses in data['entries'].items():
+            session._entries[object_path] = {access: [answer for answer, count in runs for _ in range(count)]
+                                             for access, runs in accesses.items()}
+        return session
+
+
+'''-----------------------------------------------------------------------------------------------------------------'''
+'''                                               CLASS: RECORDINGPROXY                                             '''
+''' Stands in for a COM object while recording: every access is passed on to it and its answer added to the session'''
+
+
+class RecordingProxy:
+    __slots__ = ('_obj', '_session', '_path', '_positions')
+
+    def __init__(self, obj, session, path, positions=None):
+        object.__setattr__(self, '_obj', obj)
+        object.__setattr__(self, '_session', session)
+        object.__setattr__(self, '_path', path)
+        object.__setattr__(self, '_positions', collections.Counter() if positions is None else positions)
+
+    def _Record(self, access, get, opens=False):
+        position = self._positions[self._path, access]
+        self._positions[self._path, access] += 1
+        try:
+            value = get()
+        except Exception as e:
+            self._session.Add(self._path, access, position, {'$e': [type(e).__name__, str(e)]})
+            raise
+        if isinstance(value, plain_types):
+            self._session.Add(self._path, access, position, _Encode(value))
+            return value
+        self._session.Add(self._path, access, position, _object)
+        return RecordingProxy(value, self._session, self._path + access, None if opens else self._positions)
+
+    def __getattr__(self, attr):
+        return self._Record('.' + attr, lambda: getattr(self._obj, attr))
+
+    def __setattr__(self, attr, value):
+        setattr(self._obj, attr, value._obj if isinstance(value, RecordingProxy) else value)
+
+    def __call__(self, *args, **kwargs):
+        key = _ArgsKey(args, kwargs)
+        args = [arg._obj if isinstance(arg, RecordingProxy) else arg for arg in args]
+        return self._Record(key, lambda: self._obj(*args, **kwargs), _Opens(self._path))
+
+    def __iter__(self):
+        items = list(self._obj)
+        self._Record('[]', lambda: len(items))
+        for cnt, item in enumerate(items):
+            yield self._Record('[{}]'.format(cnt), lambda: item)
+
+    def __len__(self):
+        return self._Record('len', lambda: len(self._obj))
+
+    def __bool__(self):
+        return True
+
+
+'''-----------------------------------------------------------------------------------------------------------------'''
+'''                                               CLASS: REPLAYOBJECT                                               '''
+''' Stands in for a COM object on replay, answering from the session. Attribute writes are ignored.                 '''
+
+
+class ReplayObject:
+    __slots__ = ('_session', '_path', '_positions')
+
+    def __init__(self, session, path, positions=None):
+        object.__setattr__(self, '_session', session)
+        object.__setattr__(self, '_path', path)
+        object.__setattr__(self, '_positions', collections.Counter() if positions is None else positions)
+
+    def _Answer(self, access, error=ReplayError, opens=False):
+        answers = self._session.Answers(self._path, access)
+        if not answers:
+            raise error('{}{} was not recorded'.format(self._path, access))
+        position = self._positions[self._path, access]
+        self._positions[self._path, access] += 1
+        answer = answers[min(position, len(answers) - 1)]
+        if answer == _object:
+            return ReplayObject(self._session, self._path + access, None if opens else self._positions)
+        if isinstance(answer, dict) and '$e' in answer:
+            raise RecordedComError('{}: {}'.format(*answer['$e']))
+        return _Decode(answer)
+
+    def __getattr__(self, attr):
+        return self._Answer('.' + attr, AttributeError)
+
+    def __setattr__(self, attr, value):
+        pass
+
+    def __call__(self, *args, **kwargs):
+        return self._Answer(_ArgsKey(args, kwargs), opens=_Opens(self._path))
+
+    def __iter__(self):
+        for cnt in range(self._Answer('[]')):
+            yield self._Answer('[{}]'.format(cnt))
+
+    def __len__(self):
+        return self._Answer('len')
+
+    def __bool__(self):
+        return True
+
+    def __repr__(self):
+        return '<replayed {}>'.format(self._path)
+
+
+'''-----------------------------------------------------------------------------------------------------------------'''
+'''                                               ON/OFF                                                            '''
+
+
+# Records every DAO engine DAOdbUtils makes until the end of the with block, then saves the session to path
+class Recording:
+    def __init__(self, path):
+        self.Path = path
+        self.Session = Session()
+
+    def __enter__(self):
+        import DAOdbUtils as dao
+        self._previous = dao.engine_wrapper
+        dao.engine_wrapper = lambda engine: RecordingProxy(engine, self.Session, 'DBEngine')
+        return self.Session
+
+    def __exit__(self, *exc):
+        import DAOdbUtils as dao
+        dao.engine_wrapper = self._previous
+        self.Session.Save(self.Path)
+        return False
+
+
+# DAOdbUtils makes its engines from the recorded session until the end of the with block
+class Replaying:
+    def __init__(self, path_or_session):
+        self.Session = Session.Load(path_or_session) if isinstance(path_or_session, str) else path_or_session
+
+    def __enter__(self):
+        import DAOdbUtils as dao
+        self._previous = dao.engine_factory
+        dao.engine_factory = lambda: ReplayObject(self.Session, 'DBEngine')
+        return self.Session
+
+    def __exit__(self, *exc):
+        import DAOdbUtils as dao
+        dao.engine_factory = self._previous
+        return False
+
+
+def _GradeAll(solution_path, plan, student_paths):
+    import dbGrade
+    from dbCache import solution_registry
+    solution_registry.Clear()
+    return [dbGrade.GradeSubmission(solution_path, plan, path) for path in student_paths]
+
+
+def main(argv=None):
+    import argparse
+    import dbGrade
+    parser = argparse.ArgumentParser(description='Record a grading run against DAO, or replay it without DAO.')
+    parser.add_argument('mode', choices=['record', 'replay'])
+    parser.add_argument('session', help='recorded session file')
+    parser.add_argument('solution', help='solution database')
+    parser.add_argument('rubric', help='rubric plan (JSON)')
+    parser.add_argument('students', nargs='+', help='student databases: paths, glob patterns or roster files')
+    parser.add_argument('--runs', type=int, default=1, help='replay: times to grade the batch (default 1)')
+    args = parser.parse_args(argv)
+    plan = dbGrade.LoadRubric(args.rubric)
+    student_paths = dbGrade.ExpandSubmissions(args.students)
+    if args.mode == 'record':
+        with Recording(args.session) as session:
+            rows = _GradeAll(args.solution, plan, student_paths)
+        print('Recorded {} accesses to {}'.format(len(session), args.session))
+    else:
+        session = Session.Load(args.session)
+        for run in range(args.runs):
+            with Replaying(session):
+                start = time.perf_counter()
+                rows = _GradeAll(args.solution, plan, student_paths)
+            print('Run {}: {:.3f} s'.format(run + 1, time.perf_counter() - start))
+    for row in rows:
+        print('{:<60} {:>8} of {:<8} {}'.format(row['path'], round(row['points'], 3), row['possible'],
+                                               row['error'] or ''))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,238 @@
+
+
+# Cross-cohort similarity detection. Each student database is reduced to sets of features (normalized query SQL
+# shingles, table/field names and types, relationships), each set is summarized by a MinHash signature, and LSH
+# banding buckets the signatures so only pairs that collide in some band are compared in detail. That keeps a
+# cohort of n submissions near O(n) instead of O(n^2) full comparisons.
+# Works with any DataBase-like object (DAOdbUtils.DataBase, dbSnapshot.SnapshotDataBase, ACEdbUtils.ACEDataBase).
+#   python dbSimilarity.py <submission folder> [solution database]
+import ACEdbUtils as ace
+import dbSnapshot as snap
+# these are built in to python
+import collections
+import hashlib
+import os
+import random
+import re
+import sys
+
+
+num_perm = 128  # signature length
+num_bands = 32  # num_perm must be divisible by num_bands; rows per band = num_perm / num_bands
+shingle_size = 3  # number of SQL tokens per shingle
+mersenne_prime = (1 << 61) - 1
+max_hash = (1 << 32) - 1
+
+SimilarPair = collections.namedtuple('SimilarPair', ['StudentA', 'StudentB', 'Score', 'QueryScore', 'SchemaScore',
+                                                     'RelationshipScore', 'IdenticalQueries'])
+
+
+'''-----------------------------------------------------------------------------------------------------------------'''
+'''                                               FEATURES                                                          '''
+
+
+_token_re = re.compile(r'"[^"]*"|\'[^\']*\'|#[^#]*#|[A-Za-z_][\w]*|\d+(?:\.\d+)?|<=|>=|<>|[^\s\w]')
+
+
+# Lower case, no brackets, no Access' redundant parentheses, no trailing ';', single spaced tokens
+def NormalizeSQL(sql):
+    if not sql:
+        return ''
+    tokens = [token for token in _token_re.findall(sql.replace('[', '').replace(']', '')) if token not in '();']
+    return ' '.join(token.lower() if token[0] not in '"\'#' else token for token in tokens)
+
+
+def Shingles(normalized_sql, size=shingle_size):
+    tokens = normalized_sql.split(' ')
+    if len(tokens) <= size:
+        return {normalized_sql} if normalized_sql else set()
+    return {' '.join(tokens[cnt:cnt + size]) for cnt in range(len(tokens) - size + 1)}
+
+
+# Returns {'QUERY': set, 'SCHEMA': set, 'RELATIONSHIP': set} for one database
+def SubmissionFeatures(database):
+    features = {'QUERY': set(), 'SCHEMA': set(), 'RELATIONSHIP': set()}
+    for name in database.QueryNames:
+        sql = getattr(database.Queries[name], 'SQL', None)
+        features['QUERY'] |= {'q:' + shingle for shingle in Shingles(NormalizeSQL(sql))}
+    for name in database.TableNames:
+        table = database.Tables[name]
+        features['SCHEMA'].add('t:' + name.lower())
+        for column in table.ColumnMetaData:
+            field = '{}.{}'.format(name, column.Name).lower()
+            features['SCHEMA'].add('f:' + field)
+            features['SCHEMA'].add('f:{}:{}:{}'.format(field, column.Type, column.Size).lower())
+        for key in getattr(table, 'PrimaryKeys', []):
+            features['SCHEMA'].add('pk:{}.{}'.format(name, key).lower())
+    for table_name in database.Relationships:
+        for related_table in database.Relationships[table_name]:
+            for rltn in database.Relationships[table_name][related_table].values():
+                features['RELATIONSHIP'].add('r:{}.{}>{}.{}:{}:{}'.format(
+                    rltn.Table, rltn.Field, rltn.RelatedTable, rltn.RelatedField, rltn.JoinType,
+                    rltn.EnforceIntegrity).lower())
+    return features
+
+
+def _QuerySQLByName(database):
+    return {name.lower(): NormalizeSQL(getattr(database.Queries[name], 'SQL', None))
+            for name in database.QueryNames}
+
+
+'''-----------------------------------------------------------------------------------------------------------------'''
+'''                                               MINHASH                                                           '''
+
+
+def _FeatureHash(feature):
+    return int.from_bytes(hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+class MinHasher:
+    def __init__(self, num_perm=num_perm, seed=1):
+        rand = random.Random(seed)
+        self.Permutations = [(rand.randrange(1, mersenne_prime), rand.randrange(0, mersenne_prime))
+                             for cnt in range(num_perm)]
+
+    def Signature(self, features):
+        if not features:
+            return (max_hash,) * len(self.Permutations)
+        hashes = [_FeatureHash(feature) for feature in features]
+        return tuple(min(((a * h + b) % mersenne_prime) & max_hash for h in hashes) for a, b in self.Permutations)
+
+
+def EstimateJaccard(signature1, signature2):
+    return sum(1 for h1, h2 in zip(signature1, signature2) if h1 == h2) / len(signature1)
+
+
+def Jaccard(set1, set2):
+    if not set1 and not set2:
+        return 0
+    return len(set1 & set2) / len(set1 | set2)
+
+
+'''-----------------------------------------------------------------------------------------------------------------'''
+'''                                         CLASS: SIMILARITYINDEX                                                  '''
+''' Add every submission, then RankedPairs() returns the candidate pairs (those sharing an LSH bucket) scored by    '''
+''' exact Jaccard similarity, highest first. Passing the solution database removes features every correct           '''
+''' submission shares with it, so pairs are ranked on what the students wrote beyond the answer key. Submissions    '''
+''' with nothing to compare (empty, or nothing beyond the answer key) are listed in Empty, not paired.              '''
+
+
+class SimilarityIndex:
+    def __init__(self, solution=None, num_perm=num_perm, num_bands=num_bands, seed=1,
+                 weights=(('QUERY', .5), ('SCHEMA', .3), ('RELATIONSHIP', .2))):
+        if num_perm % num_bands:
+            raise ValueError('num_perm ({}) must be divisible by num_bands ({})'.format(num_perm, num_bands))
+        self._hasher = MinHasher(num_perm, seed)
+        self._rows = num_perm // num_bands
+        self._num_bands = num_bands
+        self._weights = dict(weights)
+        self._baseline = SubmissionFeatures(solution) if solution is not None else None
+        self._baseline_queries = _QuerySQLByName(solution) if solution is not None else {}
+        self._features = {}
+        self._queries = {}
+        self._buckets = collections.defaultdict(list)
+        self.Empty = []  # student ids of submissions with no features
+
+    def Add(self, student_id, database):
+        features = SubmissionFeatures(database)
+        if self._baseline is not None:
+            features = {kind: values - self._baseline[kind] for kind, values in features.items()}
+        self._features[student_id] = features
+        self._queries[student_id] = {name: sql for name, sql in _QuerySQLByName(database).items()
+                                     if sql != self._baseline_queries.get(name)}
+        combined = set()
+        for kind, values in features.items():
+            combined |= values
+        if not combined:  # every empty submission would share every bucket
+            self.Empty.append(student_id)
+            return
+        signature = self._hasher.Signature(combined)
+        for band in range(self._num_bands):
+            key = (band, signature[band * self._rows:(band + 1) * self._rows])
+            self._buckets[key].append(student_id)
+
+    def CandidatePairs(self):
+        pairs = set()
+        for members in self._buckets.values():
+            if len(members) < 2:
+                continue
+            for cnt, student1 in enumerate(members):
+                for student2 in members[cnt + 1:]:
+                    if student1 != student2:
+                        pairs.add((student1, student2) if str(student1) <= str(student2) else (student2, student1))
+        return pairs
+
+    def ComparePair(self, student1, student2):
+        features1 = self._features[student1]
+        features2 = self._features[student2]
+        scores = {kind: Jaccard(features1[kind], features2[kind]) for kind in features1}
+        total_weight = sum(weight for kind, weight in self._weights.items() if features1[kind] or features2[kind])
+        score = sum(scores[kind] * weight for kind, weight in self._weights.items()) / total_weight \
+            if total_weight else 0
+        queries1 = self._queries[student1]
+        queries2 = self._queries[student2]
+        identical = sorted(name for name in queries1 if name in queries2 and queries1[name] and
+                           queries1[name] == queries2[name])
+        return SimilarPair(student1, student2, score, scores['QUERY'], scores['SCHEMA'], scores['RELATIONSHIP'],
+                           identical)
+
+    def RankedPairs(self, threshold=0.5, top=None):
+        ranked = [self.ComparePair(student1, student2) for student1, student2 in self.CandidatePairs()]
+        ranked = [pair for pair in ranked if pair.Score >= threshold]
+        ranked.sort(key=lambda pair: (-pair.Score, str(pair.StudentA), str(pair.StudentB)))
+        return ranked[:top] if top else ranked
+
+
+# databases is a dict of student id -> DataBase. With empty, the ids of submissions that had nothing to compare
+# are appended to it.
+def FindSimilarSubmissions(databases, solution=None, threshold=0.5, top=None, empty=None, **kwargs):
+    index = SimilarityIndex(solution=solution, **kwargs)
+    for student_id, database in databases.items():
+        index.Add(student_id, database)
+    if empty is not None:
+        empty += index.Empty
+    return index.RankedPairs(threshold, top)
+
+
+def SimilarityReport(pairs):
+    report = ['{:<25}{:<25}{:>7}{:>8}{:>8}{:>8}  {}\n'.format('Student A', 'Student B', 'Score', 'Query',
+                                                              'Schema', 'Rltns', 'Identical queries')]
+    for pair in pairs:
+        report += ['{:<25}{:<25}{:>6.1f}%{:>7.1f}%{:>7.1f}%{:>7.1f}%  {}\n'.format(
+            str(pair.StudentA)[:24], str(pair.StudentB)[:24], pair.Score * 100, pair.QueryScore * 100,
+            pair.SchemaScore * 100, pair.RelationshipScore * 100, ', '.join(pair.IdenticalQueries))]
+    return report
+
+
+# Snapshots are read with sqlite3, .accdb files with the pure-python reader; neither needs Access
+def LoadSubmission(path, debug=0):
+    if snap.IsSnapshot(path):
+        return snap.LoadSnapshot(path, debug=debug)
+    return ace.LoadAccdb(path, debug=debug)
+
+
+def main():
+    if len(sys.argv) not in (2, 3):
+        print('Usage: python dbSimilarity.py <submission folder> [solution database]')
+        return 1
+    folder = sys.argv[1]
+    solution = LoadSubmission(sys.argv[2]) if len(sys.argv) == 3 else None
+    databases = {}
+    for entry in sorted(os.scandir(folder), key=lambda entry: entry.name):
+        if not entry.is_file() or not entry.name.lower().endswith(('.accdb', '.sqlite')):
+            continue
+        try:
+            databases[entry.name] = LoadSubmission(entry.path)
+        except Exception as e:
+            print('Cannot open', entry.name, e)
+    empty = []
+    pairs = FindSimilarSubmissions(databases, solution=solution, empty=empty)
+    print(''.join(SimilarityReport(pairs)))
+    if empty:
+        print('Nothing to compare (empty{}): {}'.format(', or only the solution' if solution else '',
+                                                        ', '.join(map(str, empty))))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
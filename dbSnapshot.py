@@ -0,0 +1,258 @@
+
+
+# Snapshot an Access database into a local SQLite file, then grade against the snapshot.
+# Exporting needs the DAO engine (Windows), but loading a snapshot only needs python's built in sqlite3 module,
+# so a solution and the student submissions can be snapshotted once and graded many times on any OS.
+#   python dbSnapshot.py <database.accdb> <snapshot.sqlite>
+import DAOdbUtils as dao
+# these are built in to python
+import datetime
+import decimal
+import json
+import os
+import sqlite3
+import sys
+import threading
+
+
+snapshot_version = 1
+meta_table = '_dbutils_meta'  # side-table holding the schema; one row per (kind, object, field)
+
+
+'''-----------------------------------------------------------------------------------------------------------------'''
+'''                                               EXPORT                                                            '''
+''' Data is stored in one SQLite table per Access table/query with positional column names (c0, c1, ...). The real  '''
+''' column names, types, sizes, keys, relationships, query SQL and lookups are stored as JSON in the meta table.    '''
+
+
+def _DataTableName(name, isTable=True):
+    return ('t:' if isTable else 'q:') + name
+
+
+def _Quote(identifier):
+    return '"' + identifier.replace('"', '""') + '"'
+
+
+def _ToSQLite(value):
+    if isinstance(value, datetime.datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes(value)
+    if value is None or isinstance(value, (int, float, str)):
+        return value
+    return str(value)
+
+
+def _FromSQLite(value, column_type):
+    if value is None:
+        return None
+    if column_type == 'Date/Time' and isinstance(value, str):
+        return datetime.datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
+    if column_type == 'Yes/No':
+        return bool(value)
+    return value
+
+
+def _WriteMeta(conn, kind, obj, field, value):
+    conn.execute('INSERT INTO {} VALUES (?, ?, ?, ?)'.format(meta_table), (kind, obj, field, json.dumps(value)))
+
+
+def _WriteRecords(conn, data_table, num_columns, records):
+    columns = ['c{}'.format(cnt) for cnt in range(num_columns)]
+    conn.execute('CREATE TABLE {} ({})'.format(_Quote(data_table), ', '.join(columns) if columns else 'c0'))
+    if not columns:
+        return
+    sql = 'INSERT INTO {} VALUES ({})'.format(_Quote(data_table), ', '.join('?' * num_columns))
+    conn.executemany(sql, ([_ToSQLite(value) for value in record] for record in records))
+
+
+def _ExportTable(conn, table, debug=0):
+    isTable = table.TableType == 'TABLE'
+    meta = {'Columns': [list(column) for column in table.ColumnMetaData], 'DataTable': _DataTableName(table.Name,
+                                                                                                    isTable)}
+    if isTable:
+        meta['PrimaryKeys'] = list(table.PrimaryKeys)
+    else:
+        meta['SQL'] = table.SQL
+    try:
+        records = table.GetRecords(budget=dao.unlimited_budget)
+        meta['RecordCount'] = len(records)
+        _WriteRecords(conn, meta['DataTable'], table.ColumnCount, records)
+    except Exception as e:  # e.g. parameter queries can't be opened without input
+        if debug:
+            print('Could not export records for', table.Name, e)
+        meta['RecordCount'] = table.RecordCount if isTable else None
+        meta['DataTable'] = None
+        meta['RecordsError'] = str(e)
+    _WriteMeta(conn, 'TABLE' if isTable else 'QUERY', table.Name, '', meta)
+    for column in table.ColumnMetaData:
+        try:
+            lookup = table.GetLookupProperties(column.Name)
+        except Exception:  # field has no lookup (DisplayControl etc. properties don't exist)
+            continue
+        _WriteMeta(conn, 'LOOKUP', table.Name, column.Name, list(lookup))
+
+
+# database can be a dao.DataBase (or a detached dao.DataBaseMeta) or a path to an .accdb file
+def ExportSnapshot(database, snapshot_path, debug=0):
+    if isinstance(database, str):
+        database = dao.DataBase(database, debug=debug)
+    if os.path.exists(snapshot_path):
+        os.remove(snapshot_path)
+    conn = sqlite3.connect(snapshot_path)
+    try:
+        conn.execute('CREATE TABLE {} (kind TEXT, object TEXT, field TEXT, value TEXT)'.format(meta_table))
+        _WriteMeta(conn, 'DATABASE', '', 'version', snapshot_version)
+        _WriteMeta(conn, 'DATABASE', '', 'source', database._dbPath)
+        _WriteMeta(conn, 'DATABASE', '', 'created', datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+        _WriteMeta(conn, 'DATABASE', '', 'TableNames', database.TableNames)
+        _WriteMeta(conn, 'DATABASE', '', 'QueryNames', database.QueryNames)
+        for table_name in database.Relationships:
+            for related_table in database.Relationships[table_name]:
+                for field_name, rltn in database.Relationships[table_name][related_table].items():
+                    _WriteMeta(conn, 'RELATIONSHIP', table_name, field_name, list(rltn))
+        for table_name in database.TableNames:
+            _ExportTable(conn, database.Tables[table_name], debug)
+        for query_name in database.QueryNames:
+            _ExportTable(conn, database.Queries[query_name], debug)
+        conn.commit()
+    finally:
+        conn.close()
+    if debug:
+        print('Wrote snapshot of {} to {}'.format(database._dbPath, snapshot_path))
+    return snapshot_path
+
+
+# True if path is a SQLite file written by ExportSnapshot
+def IsSnapshot(path):
+    try:
+        with open(path, 'rb') as f:
+            if f.read(16) != b'SQLite format 3\x00':
+                return False
+        conn = sqlite3.connect(path)
+        try:
+            conn.execute('SELECT 1 FROM {} LIMIT 1'.format(meta_table))
+        finally:
+            conn.close()
+        return True
+    except (OSError, sqlite3.Error):
+        return False
+
+
+'''-----------------------------------------------------------------------------------------------------------------'''
+'''                                   SNAPSHOT BACKEND FOR DATABASE AND TABLE                                       '''
+''' SnapshotDataBase and SnapshotTable expose the same attributes and methods as dao.DataBase and dao.Table, so the  '''
+''' Assess*/Score* functions in DAOdbUtils work unchanged on snapshots.                                             '''
+
+
+class SnapshotTable(dao.Table):
+    def __init__(self, database, name, meta, lookups, isTable=True, debug=0):
+        dao.Table.__init__(self)
+        self._database = database
+        self._dbPath = database._dbPath
+        self._data_table = meta['DataTable']
+        self._lookups = lookups
+        self.Name = name
+        self.debug = debug
+        self.ColumnMetaData = [dao.ColumnMeta(*column) for column in meta['Columns']]
+        self.ColumnCount = len(self.ColumnMetaData)
+        self.RecordCount = meta['RecordCount']
+        if isTable:
+            self.TableType = 'TABLE'
+            self.PrimaryKeys = meta['PrimaryKeys']
+            self.ForeignKeys = ''
+        else:
+            self.TableType = 'QUERY'
+            self.SQL = meta['SQL']
+
+    def QueryRecordCount(self):
+        return self.RecordCount
+
+    def GetRecords(self, debug=0, budget=None):
+        if self._data_table is None:
+            raise dao.RecordsUnavailable('No records were exported for {}'.format(self.Name))
+        meter = dao.BudgetMeter(self.Name, budget)
+        types = self.GetTypes()
+        rows = self._database._Connection().execute('SELECT * FROM {} ORDER BY rowid'.format(
+            _Quote(self._data_table)))
+        records = []
+        for row in rows:
+            records.append([_FromSQLite(value, types[cnt]) for cnt, value in enumerate(row[:self.ColumnCount])])
+            meter.Add(records[-1])
+            if debug > 1:
+                print(records[-1])
+        return records
+
+    def GetLookupProperties(self, fieldName, debug=0):
+        lookup = dao.Lookup(*self._lookups[fieldName])
+        if debug > 1:
+            print(lookup)
+        return lookup
+
+    # Snapshots keep no DAO field objects; what they know of a field is in ColumnMetaData and its lookup
+    def GetFieldObject(self, name):
+        raise KeyError('Snapshot table {} has no field object for {}'.format(self.Name, name))
+
+
+class SnapshotDataBase(dao.DataBase):
+    ThreadSafe = True  # each thread opens its own sqlite3 connection
+
+    def __init__(self, dbPath, debug=0):
+        self._dbPath = dbPath
+        self._debug = debug
+        self._local = threading.local()
+        meta = {}
+        lookups = {}
+        self.Relationships = dict()
+        for kind, obj, field, value in self._Connection().execute('SELECT * FROM {}'.format(meta_table)):
+            value = json.loads(value)
+            if kind == 'RELATIONSHIP':
+                rltn = dao.Relationship(*value)
+                self.Relationships.setdefault(rltn.Table, dict()).setdefault(rltn.RelatedTable, dict())
+                self.Relationships[rltn.Table][rltn.RelatedTable][field] = rltn
+            elif kind == 'LOOKUP':
+                lookups.setdefault(obj, {})[field] = value
+            else:
+                meta[(kind, obj, field)] = value
+        if meta[('DATABASE', '', 'version')] > snapshot_version:
+            raise ValueError('Snapshot {} was written by a newer version of dbSnapshot'.format(dbPath))
+        self.Source = meta[('DATABASE', '', 'source')]
+        self.TableNames = meta[('DATABASE', '', 'TableNames')]
+        self.QueryNames = meta[('DATABASE', '', 'QueryNames')]
+        self.Tables = {}
+        for table in self.TableNames:
+            self.Tables[table] = SnapshotTable(self, table, meta[('TABLE', table, '')], lookups.get(table, {}),
+                                               debug=debug)
+            if table in self.Relationships:
+                self.Tables[table].ForeignKeys = self.Relationships[table]
+        self.Queries = {}
+        for query in self.QueryNames:
+            self.Queries[query] = SnapshotTable(self, query, meta[('QUERY', query, '')], lookups.get(query, {}),
+                                                isTable=False, debug=debug)
+
+    # sqlite3 connections can't be shared between threads, so each thread reading records gets its own
+    def _Connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            import pathlib  # only for the file: URI
+            conn = sqlite3.connect(pathlib.Path(os.path.abspath(self._dbPath)).as_uri() + '?mode=ro', uri=True)
+            self._local.conn = conn
+        return conn
+
+
+def LoadSnapshot(snapshot_path, debug=0):
+    return SnapshotDataBase(snapshot_path, debug=debug)
+
+
+def main():
+    if len(sys.argv) != 3:
+        print('Usage: python dbSnapshot.py <database.accdb> <snapshot.sqlite>')
+        return 1
+    ExportSnapshot(sys.argv[1], sys.argv[2], debug=1)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,184 @@
+
+
+# Counts and times the COM round-trips DAOdbUtils makes. Every property read, method call and collection step on a
+# DAO object crosses into the Access engine, and none of it shows up in an ordinary profile, where it is all just
+# "getattr". With tracing on, the engine (win32com's DBEngine, or whatever DAOdbUtils.engine_factory makes) is
+# wrapped in a proxy that wraps every object it hands out, so each access is recorded under a name (e.g.
+# "Fields[].Type": the Type of a field got by iterating over Fields) and the line of code that made it.
+#   with Tracing() as trace:
+#       SolnDB = DataBase(SolnDBPath)
+#   print(''.join(trace.Report()))
+#   python dbGrade.py ... --trace-com
+import collections
+import datetime
+import os
+import sys
+import threading
+import time
+
+
+# Results of these types are plain values, not COM objects, and are returned as they are
+plain_types = (str, bytes, int, float, bool, type(None), datetime.datetime, datetime.date, tuple, list, dict)
+
+CallStats = collections.namedtuple('CallStats', ['Name', 'Site', 'Count', 'Seconds'])
+
+
+'''-----------------------------------------------------------------------------------------------------------------'''
+'''                                               CLASS: COMTRACE                                                   '''
+
+
+class ComTrace:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}  # (name, site) -> [count, seconds]
+
+    def Record(self, name, site, seconds):
+        with self._lock:
+            stats = self._stats.get((name, site))
+            if stats is None:
+                self._stats[(name, site)] = [1, seconds]
+            else:
+                stats[0] += 1
+                stats[1] += seconds
+
+    def Stats(self):
+        with self._lock:
+            return [CallStats(name, site, count, seconds) for (name, site), (count, seconds) in self._stats.items()]
+
+    def Clear(self):
+        with self._lock:
+            self._stats.clear()
+
+    # The top accesses by count and by time, each with its call site, then by name (all call sites together)
+    def Report(self, top=15):
+        stats = self.Stats()
+        report = ['COM CALLS: {} in {:.3f} s\n'.format(sum(s.Count for s in stats), sum(s.Seconds for s in stats))]
+        header = '\t{:>9} {:>10} {:>9}  {:<40} {}\n'.format('count', 'total ms', 'mean us', 'access', 'call site')
+
+        def Lines(rows):
+            return [header] + ['\t{:>9} {:>10.1f} {:>9.1f}  {:<40} {}\n'.format(
+                s.Count, s.Seconds * 1000, s.Seconds / s.Count * 1e6, s.Name, s.Site) for s in rows[:top]]
+        report += ['By count:\n'] + Lines(sorted(stats, key=lambda s: (-s.Count, -s.Seconds)))
+        report += ['By time:\n'] + Lines(sorted(stats, key=lambda s: -s.Seconds))
+        by_name = collections.defaultdict(lambda: [0, 0.0])
+        for s in stats:
+            by_name[s.Name][0] += s.Count
+            by_name[s.Name][1] += s.Seconds
+        totals = sorted((CallStats(name, 'all', count, seconds) for name, (count, seconds) in by_name.items()),
+                        key=lambda s: -s.Seconds)
+        report += ['By access (all call sites):\n'] + Lines(totals)
+        return report
+
+
+# "file:line function" of the first caller outside this module
+def _CallSite():
+    frame = sys._getframe(2)
+    while frame is not None and frame.f_code.co_filename == __file__:
+        frame = frame.f_back
+    if frame is None:
+        return '?'
+    return '{}:{} {}'.format(os.path.basename(frame.f_code.co_filename), frame.f_lineno, frame.f_code.co_name)
+
+
+'''-----------------------------------------------------------------------------------------------------------------'''
+'''                                               CLASS: TRACINGPROXY                                               '''
+''' Stands in for a COM object. Attribute reads, calls and iteration are passed on to it, timed and recorded; any   '''
+''' object that comes back is wrapped in turn, named after the access that returned it ("OpenRecordset()",       '''
+''' "Fields[]"). Attribute writes are passed on (and recorded) too.                                                 '''
+
+
+class TracingProxy:
+    __slots__ = ('_obj', '_trace', '_name')
+
+    def __init__(self, obj, trace, name):
+        object.__setattr__(self, '_obj', obj)
+        object.__setattr__(self, '_trace', trace)
+        object.__setattr__(self, '_name', name)
+
+    def _Wrap(self, value, name):
+        if isinstance(value, plain_types) or isinstance(value, TracingProxy):
+            return value
+        return TracingProxy(value, self._trace, name)
+
+    def __getattr__(self, attr):
+        start = time.perf_counter()
+        try:
+            value = getattr(self._obj, attr)
+        finally:
+            self._trace.Record('{}.{}'.format(self._name, attr), _CallSite(), time.perf_counter() - start)
+        return self._Wrap(value, attr)
+
+    def __setattr__(self, attr, value):
+        start = time.perf_counter()
+        try:
+            setattr(self._obj, attr, value._obj if isinstance(value, TracingProxy) else value)
+        finally:
+            self._trace.Record('{}.{}='.format(self._name, attr), _CallSite(), time.perf_counter() - start)
+
+    def __call__(self, *args, **kwargs):
+        args = [arg._obj if isinstance(arg, TracingProxy) else arg for arg in args]
+        start = time.perf_counter()
+        try:
+            value = self._obj(*args, **kwargs)
+        finally:
+            self._trace.Record('{}()'.format(self._name), _CallSite(), time.perf_counter() - start)
+        return self._Wrap(value, '{}()'.format(self._name))
+
+    # Each step of a COM collection is a round-trip of its own
+    def __iter__(self):
+        iterator = iter(self._obj)
+        name = '{}[]'.format(self._name)
+        while True:
+            start = time.perf_counter()
+            try:
+                value = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self._trace.Record(name, _CallSite(), time.perf_counter() - start)
+            yield self._Wrap(value, name)
+
+    def __len__(self):
+        return len(self._obj)
+
+    def __bool__(self):
+        return True
+
+    def __repr__(self):
+        return '<traced {} {!r}>'.format(self._name, self._obj)
+
+
+'''-----------------------------------------------------------------------------------------------------------------'''
+'''                                               ON/OFF                                                            '''
+
+current_trace = None
+
+
+# Wraps every DAO engine DAOdbUtils makes from now on; objects already loaded aren't traced
+def EnableTracing(trace=None):
+    global current_trace
+    import DAOdbUtils as dao
+    current_trace = trace = trace if trace is not None else ComTrace()
+    dao.engine_wrapper = lambda engine: TracingProxy(engine, trace, 'DBEngine')
+    return trace
+
+
+def DisableTracing():
+    global current_trace
+    import DAOdbUtils as dao
+    dao.engine_wrapper = None
+    trace, current_trace = current_trace, None
+    return trace
+
+
+class Tracing:
+    def __init__(self, trace=None):
+        self.Trace = trace
+
+    def __enter__(self):
+        self.Trace = EnableTracing(self.Trace)
+        return self.Trace
+
+    def __exit__(self, *exc):
+        DisableTracing()
+        return False
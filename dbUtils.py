@@ -1,34 +1,179 @@
-import os, tkinter, pypyodbc, tkinter.messagebox
-import csv, datetime
-import win32com.client
+import os, datetime, threading
+from dbBudget import BudgetExceeded, BudgetMeter
+from dbCache import FileFingerprint  # tells when a cached catalog is stale
+# pypyodbc (the Access ODBC driver) is imported by the first connection, see AccessConnect
 
 
-pypyodbc.lowercase = False
-
 # python3 python3 "z:\S&F\Courses\It305\ay181\admin\database_grader\DBHW3_grader.pyw"
 cdtDict = {}
 sections = []
 sec = ""
 debug = 0 #Set from 0 or 2 to get varying levels of output; 0=no output, 2=very verbose
 
+'''-----------------------------------------------------------------------------------------------'''
+'''    CONNECTION POOL: one ODBC connection per database path, shared by every Table. Each thread '''
+'''    gets its own cursor, so Tables used from different threads don't read each other's rows.   '''
+
+
+def AccessConnect(dbPath):
+    import pypyodbc
+    pypyodbc.lowercase = False
+    return pypyodbc.connect(r"Driver={Microsoft Access Driver (*.mdb, *.accdb)};" + "Dbq={0};".format(dbPath))
+
+
+class ConnectionPool:
+    # connect is any callable taking a database path and returning a DB-API connection. Defaults to the Access
+    # ODBC driver, but a sqlite3 stand-in or a fake connection can be passed in for testing.
+    def __init__(self, connect=AccessConnect):
+        self._connect = connect
+        self._connections = {}
+        self._cursors = {}  # (path key, thread id) -> cursor
+        self._lock = threading.Lock()
+
+    def _Key(self, dbPath):
+        return os.path.normcase(os.path.normpath(dbPath))
+
+    def Connection(self, dbPath):
+        key = self._Key(dbPath)
+        with self._lock:
+            if key not in self._connections:
+                self._connections[key] = self._connect(dbPath)
+            return self._connections[key]
+
+    # The calling thread's cursor for a database
+    def Cursor(self, dbPath):
+        key = (self._Key(dbPath), threading.get_ident())
+        conn = self.Connection(dbPath)
+        with self._lock:
+            if key not in self._cursors:
+                self._cursors[key] = conn.cursor()
+            return self._cursors[key]
+
+    # Closes the connection for one database path, or every pooled connection if no path is given
+    def Close(self, dbPath=None):
+        with self._lock:
+            keys = list(self._connections) if dbPath is None else [self._Key(dbPath)]
+            for key in keys:
+                cursors = [self._cursors.pop(cursor_key) for cursor_key in list(self._cursors) if cursor_key[0] == key]
+                conn = self._connections.pop(key, None)
+                try:
+                    for cur in cursors:
+                        cur.close()
+                    if conn is not None:
+                        conn.close()
+                except Exception as e:
+                    if debug:
+                        print('Error closing connection:', e)
+
+
+connection_pool = ConnectionPool()
+
+
+'''-----------------------------------------------------------------------------------------------'''
+'''    CATALOG: snapshot of every table/query, its columns and its key statistics for one database  '''
+'''    One tables() call and one columns() call cover the whole file. ODBC only returns statistics  '''
+'''    for a named table, so those are fetched once per table the first time they are asked for.    '''
+
+
+class Catalog:
+    def __init__(self, dbPath, pool=None):
+        self._dbPath = dbPath
+        self._pool = connection_pool if pool is None else pool
+        self.Fingerprint = FileFingerprint(dbPath)
+        self.TableNames = []
+        self.QueryNames = []
+        self.Columns = {}  # object name -> list of (column name, column type) in ordinal order
+        self.Statistics = {}  # table name -> statistics() rows
+        cur = self._pool.Cursor(dbPath)
+        for row in cur.tables():
+            if row[2].startswith('~'):
+                continue
+            if row[3] == 'TABLE':
+                self.TableNames.append(row[2])
+            elif row[3] == 'VIEW':
+                self.QueryNames.append(row[2])
+        objects = set(self.TableNames + self.QueryNames)
+        for row in cur.columns():
+            if row[2] in objects:
+                self.Columns.setdefault(row[2], []).append((row[3], row[5]))
+
+    def ColumnNames(self, name):
+        return ["[" + column[0] + "]" for column in self.Columns.get(name, [])]
+
+    def ColumnTypes(self, name):
+        return [column[1] for column in self.Columns.get(name, [])]
+
+    def ColCount(self, name):
+        return len(self.Columns.get(name, []))
+
+    def GetStatistics(self, tableName):
+        if tableName not in self.Statistics:
+            cur = self._pool.Cursor(self._dbPath)
+            self.Statistics[tableName] = list(cur.statistics(table=tableName))
+        return self.Statistics[tableName]
+
+    # Primary keys, foreign keys and foreign key tables. Row layout is the ODBC SQLStatistics result:
+    # row[3] = NON_UNIQUE, row[5] = INDEX_NAME, row[8] = COLUMN_NAME (None for the whole-table statistics row)
+    def KeyInfo(self, tableName, debug=0):
+        PKs = []
+        FKs = []
+        FKTables = []
+        for row in self.GetStatistics(tableName):
+            # Ignore the index of the whole table
+            if row[8] == None:
+                continue
+            if not row[3]:
+                # unique index, append column name
+                PKs.append(row[8])
+            if row[8] != row[5] and row[5] != 'PrimaryKey':
+                FKs.append(row[8])
+                FKTables.append(row[5].replace(tableName,''))
+            if debug > 1:
+                print(row)
+        return PKs, FKs, FKTables
+
+
+_catalogs = {}
+
+
+# Returns the cached catalog for a database file, rebuilding it if the file changed since it was built
+def GetCatalog(dbPath, pool=None, refresh=False):
+    key = os.path.normcase(os.path.normpath(dbPath))
+    catalog = _catalogs.get(key)
+    if refresh or catalog is None or catalog.Fingerprint != FileFingerprint(dbPath):
+        catalog = Catalog(dbPath, pool)
+        _catalogs[key] = catalog
+    return catalog
+
+
+def ClearCatalogs():
+    _catalogs.clear()
+
+
 class Table:
-    def __init__(self, dbPath, tableName, type='TABLE'):
+    def __init__(self, dbPath, tableName, type='TABLE', pool=None, catalog=None):
         self._dbPath = dbPath
-        self._conn = None
+        self._pool = connection_pool if pool is None else pool
+        self._catalog = catalog
         self._cur = None
         self._is_connected = False
         self._tableName = tableName
         self._tableType = type
         if self._ConnectToDB():
-            self._rows = self.RowCount()
-            self._columns = self.ColCount()
-            self._columnNames = self.ColumnNames()
-            self._columnTypes = self.ColumnTypes()
-            if type == 'TABLE':
-                self._primaryKeys = self.PrimaryKeys()
-                self._foreignKeys, self._foreignKeysTables = self.ForeignKeys()
+            if self._catalog is None:
+                self._catalog = GetCatalog(dbPath, self._pool)
+            self._LoadMetaData()
             self._CloseConnection()
 
+    # Everything except the row count is read from the database catalog; only the COUNT query hits the table
+    def _LoadMetaData(self):
+        self._rows = self.RowCount()
+        self._columns = self._catalog.ColCount(self._tableName)
+        self._columnNames = self._catalog.ColumnNames(self._tableName)
+        self._columnTypes = self._catalog.ColumnTypes(self._tableName)
+        if self._tableType == 'TABLE':
+            self._primaryKeys, self._foreignKeys, self._foreignKeysTables = self._catalog.KeyInfo(self._tableName)
+
 
     def PrintTable(self):
         print('TABLE NAME:', self._tableName)
@@ -43,11 +188,10 @@ class Table:
             print('FOREIGN KEY(S) TABLES:',self._foreignKeysTables)
 
 
+    # Borrows the pooled cursor for this table's database. The connection itself stays open in the pool.
     def _ConnectToDB(self):
         try:  # Try to connect to the database
-            self._conn = pypyodbc.connect(
-                r"Driver={Microsoft Access Driver (*.mdb, *.accdb)};" + "Dbq={0};".format(self._dbPath))
-            self._cur = self._conn.cursor()
+            self._cur = self._pool.Cursor(self._dbPath)
             self._is_connected = True
             return 1
         except Exception as e:
@@ -55,18 +199,15 @@ class Table:
             return 0
 
     def _CloseConnection(self):
-        try:
-            self._cur.close()
-            del self._cur
-            self._cur = None
-            self._conn.close()
-            del self._conn
-            self._conn = None
-            self._is_connected = False
-            return 1
-        except:
+        if not self._is_connected:
             print('No connection to close')
             return 0
+        self._cur = None
+        self._is_connected = False
+        return 1
+
+    def _Cursor(self):  # the pool's cursor for this thread, which may not be the one that connected
+        return self._pool.Cursor(self._dbPath)
 
 
     # returns the name of the table
@@ -76,58 +217,29 @@ class Table:
 
     # returns the number of rows in a table
     def RowCount(self):
-        if not self._is_connected:
-            self._ConnectToDB()
-        numRows = self._cur.execute('SELECT COUNT(*) AS count FROM [' + self._tableName + ']').fetchone()[0]
-        if not self._is_connected:
-            self._CloseConnection()
-        return numRows
+        return self._Cursor().execute('SELECT COUNT(*) AS count FROM [' + self._tableName + ']').fetchone()[0]
 
 
-    # returns the number of columns in a table
+    # returns the number of columns in a table (zero-row query, only the description is needed)
     def ColCount(self):
-        if not self._is_connected:
-            self._ConnectToDB()
-        self._cur.execute('SELECT * FROM [' + self._tableName + ']').fetchone()
-        numCols = len(self._cur.description)
-        if not self._is_connected:
-            self._CloseConnection()
-        return numCols
+        cur = self._Cursor()
+        cur.execute('SELECT * FROM [' + self._tableName + '] WHERE 1=0').fetchall()
+        return len(cur.description)
 
 
     # returns the names of the columns in a table
     def ColumnNames(self):
-        if not self._is_connected:
-            self._ConnectToDB()
-        fieldNames = []
-        for row in self._cur.columns(table=self._tableName):
-            fieldNames.append("[" + row[3] + "]")
-        if not self._is_connected:
-            self._CloseConnection()
-        return fieldNames
+        return self._catalog.ColumnNames(self._tableName)
 
 
     # returns the types of the columns in a table
     def ColumnTypes(self):
-        if not self._is_connected:
-            self._ConnectToDB()
-        fieldTypes = []
-        for row in self._cur.columns(table=self._tableName):
-            fieldTypes.append(row[5])
-        if not self._is_connected:
-            self._CloseConnection()
-        return fieldTypes
+        return self._catalog.ColumnTypes(self._tableName)
 
 
     # Get a row of valid data from a table
     def GetValidRow(self):
-        if not self._is_connected:
-            self._ConnectToDB()
-            self._ConnectToDB()
-        row = self._cur.execute('SELECT * FROM [' + self._tableName + ']').fetchone()
-        if not self._is_connected:
-            self._CloseConnection()
-        return row
+        return self._Cursor().execute('SELECT * FROM [' + self._tableName + ']').fetchone()
 
     # Generates data that should not be in the table based on column type
     # def GetBadVal(self, cnt):
@@ -158,44 +270,16 @@ class Table:
     #         print('Delete error:',e)
 
 
+    def _KeyInfo(self, debug=0):
+        return self._catalog.KeyInfo(self._tableName, debug)
+
+
     def PrimaryKeys(self, debug=0):
-        PKs=[]
-        if not self._is_connected:
-            self._ConnectToDB()
-        # Get unique indexes for the table
-        rows = self._cur.statistics(table=self._tableName, unique=True)
-        for row in rows:
-            # Ignore the index of the whole table
-            if row[8] == None:
-                continue
-            else:
-                # append column name
-                PKs.append(row[8])
-            if debug > 1:
-                print(row)
-        if not self._is_connected:
-            self._CloseConnection()
-        return PKs
+        return self._KeyInfo(debug)[0]
 
 
     def ForeignKeys(self, debug=0):
-        FKs=[]
-        FKTables = []
-        if not self._is_connected:
-            self._ConnectToDB()
-        rows = self._cur.statistics(table=self._tableName)
-        for row in rows:
-            if row[8] == None:
-                continue
-            elif row[8] != row[5] and row[5] != 'PrimaryKey':
-                FKs.append(row[8])
-                FKTables.append(row[5].replace(self._tableName,''))
-                if debug > 1:
-                    print(row)
-        for row in self._cur.statistics(table=self._tableName):
-            print(row)
-        if not self._is_connected:
-            self._CloseConnection()
+        PKs, FKs, FKTables = self._KeyInfo(debug)
         return FKs, FKTables
 
     # def PrimaryKeys(self, debug=0):
@@ -233,24 +317,26 @@ class Table:
 
 
     def ExecuteQuery(self):
-        if not self._is_connected:
-            self._ConnectToDB()
         sql = '{CALL ' + self._tableName + '}'
         # rows = self._cur.execute(sql)._last_executed
-        rows = self._cur.execute(sql)
+        rows = self._Cursor().execute(sql)
         for row in rows:
             print(row)
-        if not self._is_connected:
-            self._CloseConnection()
 
-    def GetRecords(self):
-        if not self._is_connected:
-            self._ConnectToDB()
+    # Streams rows in batches so a runaway query stops at the budget (dbBudget.FetchBudget) instead of fetchall()
+    def GetRecords(self, budget=None, batch_size=500):
+        meter = BudgetMeter(self._tableName, budget)
         sql = 'SELECT * FROM [' + self._tableName + ']'
-        rows = self._cur.execute(sql).fetchall()
-        if not self._is_connected:
-            self._CloseConnection()
-        return rows
+        cur = self._Cursor().execute(sql)
+        records = []
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                meter.Add(row)
+                records.append(row)
+        return records
 
     def PrintRecords(self):
         rows = self.GetRecords()
@@ -267,10 +353,14 @@ def GradeTables(table1, table2):
         scoreVector[0] = 1
     if table1._rows == table2._rows:
         scoreVector[1] += 1
-        table1_records = table1.GetRecords()
-        table2_records = table2.GetRecords()
-        scoreVector[2] = 1
-        for rowNum in range(table1._rows):
+        try:
+            table1_records = table1.GetRecords()
+            table2_records = table2.GetRecords()
+            scoreVector[2] = 1
+        except BudgetExceeded as e:
+            print('RECORDS NOT COMPARED:', e)
+            table1_records = []
+        for rowNum in range(len(table1_records)):
             table_intersection = set(table1_records[rowNum]).intersection(set(table2_records[rowNum]))
             if len(table_intersection) != len(table1_records[rowNum]):
                 scoreVector[2] = 0
@@ -302,7 +392,10 @@ def FindBestTable(solnTable, tableNameList, dbPath):
 
 
 
+# cur may be an ODBC cursor or a Catalog. Prefer the catalog: it has already read both names lists in one call.
 def GetTableNames(cur):
+    if isinstance(cur, Catalog):
+        return list(cur.TableNames)
     tableList = []
     for row in cur.tables():
         if row[3] == 'TABLE':
@@ -311,6 +404,8 @@ def GetTableNames(cur):
     return tableList
 
 def GetQueryNames(cur):
+    if isinstance(cur, Catalog):
+        return list(cur.QueryNames)
     queryList = []
     for row in cur.tables():
         if row[3] == 'VIEW':
@@ -335,16 +430,14 @@ def main():
 
     # Connect to DB
     try:  # Try to connect to the database
-        conn = pypyodbc.connect(
-            r"Driver={Microsoft Access Driver (*.mdb, *.accdb)};" + "Dbq={0};".format(dbPath))
+        catalog = GetCatalog(dbPath)
     except:
         print('Cannot open DB')
         return 0
 
     # if we have a good connection to the database
-    cur = conn.cursor()
-    tableList = GetTableNames(cur)
-    queryList = GetQueryNames(cur)
+    tableList = GetTableNames(catalog)
+    queryList = GetQueryNames(catalog)
     for table in queryList:
         solnTable = Table(dbPath, table, type="QUERY")
         solnTable.PrintTable()
@@ -355,6 +448,7 @@ def main():
     # print(solnTable.Statistics())
     # studentTable = Table(studentDBPath, 'EmployeeBioBrief')
     # print(gradeTables(solnTable, studentTable))
+    connection_pool.Close()
 
 if __name__ == "__main__":
     main()